@@ -1,19 +1,58 @@
 import os
-import json
 import asyncio
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from config.logger import logger
-from app.db.user_data import get_partial_summary, get_user_profile
+from config.metrics import metrics
+from app.ai.prompt_builder import PromptAssembler
+from app.ai.tokens import token_counter
+from app.ai.output_parser import StreamParser
+from app.ai.resilience import AI_ATTEMPT_TIMEOUT, ResilientChat
 
 # ── Load environment ───────────────────────────────────────────────────────────
 load_dotenv()
 api_key    = os.getenv("AI_API_KEY")
-model_name = "gpt-4o"
+model_name = os.getenv("AI_MODEL", "gpt-4o")
+# Used while the primary model's circuit breaker is open (empty disables)
+AI_FALLBACK_MODEL = os.getenv("AI_FALLBACK_MODEL", "gpt-4o-mini")
+# Point at another OpenAI-compatible endpoint, e.g. the fake server in benchmarks/
+AI_BASE_URL = os.getenv("AI_BASE_URL") or None
 if not api_key:
     logger.error("❌ AI_API_KEY is missing in environment variables.")
     raise ValueError("AI_API_KEY is required in .env")
-ai_client = OpenAI(api_key=api_key)
+
+# ── Shared async client ────────────────────────────────────────────────────────
+# One bounded HTTP pool for every conversation; the semaphore caps how many
+# completions are in flight at once (instead of the default thread pool size).
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "50"))
+# Background summaries have their own limit (see summarizer.py); leave them
+# connections of their own so they never queue replies on the pool
+_SUMMARY_CONNECTIONS = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "4"))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", str(AI_MAX_CONCURRENCY + _SUMMARY_CONNECTIONS)))
+AI_MAX_KEEPALIVE   = int(os.getenv("AI_MAX_KEEPALIVE", str(AI_MAX_CONNECTIONS)))
+
+http_client = DefaultAsyncHttpxClient(
+    limits=httpx.Limits(
+        max_connections=AI_MAX_CONNECTIONS,
+        max_keepalive_connections=AI_MAX_KEEPALIVE,
+    )
+)
+# Retries and deadlines are handled by ResilientChat, not the SDK
+ai_client = AsyncOpenAI(
+    api_key=api_key,
+    base_url=AI_BASE_URL,
+    http_client=http_client,
+    max_retries=0,
+    timeout=httpx.Timeout(AI_ATTEMPT_TIMEOUT, connect=5.0),
+)
+ai_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+chat = ResilientChat(ai_client, model_name, AI_FALLBACK_MODEL)
+
+
+async def close_ai_client():
+    """Close the shared HTTP pool."""
+    await ai_client.close()
 
 # ── Load system prompt ─────────────────────────────────────────────────────────
 prompt_path = os.path.join(os.path.dirname(__file__), "prompt.txt")
@@ -22,86 +61,76 @@ try:
         system_prompt = f.read()
     logger.info("✅ System prompt loaded.")
 except FileNotFoundError as e:
-    logger.error(f"❌ System prompt file not found: {e}")
+    logger.error("❌ System prompt file not found: %s", e)
     raise FileNotFoundError("The system prompt file (prompt.txt) is missing.")
 
+prompt_assembler = PromptAssembler(system_prompt)
+logger.info("🧱 Static prompt prefix hash: %s", prompt_assembler.prefix_hash)
+logger.info(
+    "🧮 Static prompt: %s tokens (%s); per-user context budget: %s tokens",
+    prompt_assembler.static_tokens, token_counter.stats()["tokenizer"], prompt_assembler.token_budget
+)
+
 # ── Async AI caller with streaming ─────────────────────────────────────────────
 async def ask_ai(
     user_id: int,
     message_history: list,
-    pending_messages_text: str = None
+    pending_messages_text: str = None,
+    partial_summary: str = None,
+    user_profile: dict = None,
+    on_text=None
 ) -> dict:
-    logger.info(f"🤖 ask_ai → user {user_id}, history length={len(message_history)}")
-    try:
-       # Prepare the full prompt
-        partial_summary = get_partial_summary(user_id) or ""
-        user_profile = get_user_profile(user_id) or {}
-
-        full_prompt = system_prompt
-        if partial_summary:
-            full_prompt += f"\n\n# USER SUMMARY:\n{partial_summary}"
-        if user_profile:
-            profile_json = json.dumps(user_profile, ensure_ascii=False, indent=2)
-            full_prompt += f"\n\n# USER PROFILE:\n{profile_json}"
-
-
-
-        # Trim history to last N messages
-        RECENT_MESSAGES = 3
-        trimmed = message_history[-RECENT_MESSAGES:] if len(message_history) > RECENT_MESSAGES else message_history
-
-
-        # Compose messages
-        messages = [{"role": "system", "content": full_prompt}]
-        if pending_messages_text:
-            messages.append({"role": "user", "content": pending_messages_text})
-        messages.extend(trimmed)
+    """
+    Ask the model for a reply. The caller loads the user's partial summary
+    and profile from Mongo and passes them in.
 
-        # Streaming completion
-        stream = ai_client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            stream=True,
-            max_tokens=1024,
+    If `on_text` is given it is awaited with each newly visible piece of the
+    reply while the completion is still streaming.
+    """
+    logger.info("🤖 ask_ai → user %s, history length=%s", user_id, len(message_history))
+    try:
+        # Compose messages: static prefix first, per-user context after it,
+        # then the newest history that fits in CONTEXT_TOKEN_BUDGET
+        messages = prompt_assembler.build(
+            message_history,
+            partial_summary=partial_summary,
+            user_profile=user_profile,
+            pending_messages_text=pending_messages_text,
+            user_id=user_id,
         )
 
-        raw_chunks = []
-        for chunk in stream:
-            delta = chunk.choices[0].delta.content
-            if delta:
-                raw_chunks.append(delta)
-
-        raw = "".join(raw_chunks)
-        logger.debug(f"AI raw preview: {raw[:200]!r}")
-
-        # Handle [SEND_PDF] tag + embedded JSON
-        pdf_flag   = "[SEND_PDF]" in raw
-        clean_text = raw.replace("[SEND_PDF]", "").strip()
-
-        pdf_content     = None
-        profile_updates = None
-        start = clean_text.find("{")
-        end   = clean_text.rfind("}")
-        if start != -1 and end != -1:
-            try:
-                blob   = clean_text[start : end + 1]
-                parsed = json.loads(blob)
-                if isinstance(parsed, dict):
-                    pdf_content     = parsed
-                    profile_updates = parsed.get("profile_updates")
-                clean_text = clean_text[:start].strip()
-            except Exception as e:
-                logger.warning(f"⚠️ Failed to parse JSON blob: {e}")
+        # Streaming completion, split into visible text / tag / JSON as it arrives
+        parser = StreamParser()
+        with metrics.timer("ai_semaphore_wait"):
+            await ai_semaphore.acquire()
+        try:
+            # Deadlines, retries, hedging and fallback live in ResilientChat
+            async for delta in chat.stream(
+                messages,
+                max_tokens=1024,
+                on_usage=lambda usage: prompt_assembler.record_usage(user_id, usage),
+            ):
+                visible = parser.feed(delta)
+                if visible and on_text:
+                    await on_text(visible)
+        finally:
+            ai_semaphore.release()
+
+        tail = parser.close()
+        if tail and on_text:
+            await on_text(tail)
+        logger.debug("AI reply preview: %r", parser.text[:200])
 
         return {
-            "reply":           clean_text,
-            "pdf_request":     pdf_flag,
-            "pdf_content":     pdf_content,
-            "profile_updates": profile_updates,
+            "reply":           parser.text.strip(),
+            "pdf_request":     parser.pdf_requested,
+            "pdf_content":     parser.payload,
+            "profile_updates": parser.profile_updates,
         }
 
     except Exception as e:
-        logger.error(f"❌ OpenAI error for user {user_id}: {e}")
+        metrics.count("ai_failed")
+        logger.error("❌ OpenAI error for user %s: %s", user_id, e)
         return {
             "reply":           "عذرًا، حدث خطأ أثناء محاولة الرد من الذكاء الاصطناعي.",
             "pdf_request":     False,
@@ -109,19 +138,39 @@ async def ask_ai(
             "profile_updates": None,
         }
 
-# ── Sync wrapper for run_in_executor ─────────────────────────────────────────
-def ask_ai_sync(
-    user_id: int,
-    message_history: list,
-    pending_messages_text: str = None
-) -> dict:
+# ── Incremental summarizer ─────────────────────────────────────────────────────
+SUMMARY_MODEL = os.getenv("AI_SUMMARY_MODEL", model_name)
+SUMMARY_SYSTEM_PROMPT = (
+    "أنت تحدّث ملخصًا موجزًا لمحادثة بين مستخدم وشات بوت إيجار. "
+    "ادمج الرسائل الجديدة في الملخص السابق، واحتفظ بكل المعلومات التي قدّمها المستخدم "
+    "(نوع العقد، بيانات العقار والأطراف، المبالغ)، وأعد الملخص المحدّث فقط."
+)
+
+
+async def summarize_conversation(user_id: int, previous_summary: str, new_messages: list) -> str:
     """
-    Synchronous wrapper around ask_ai(), safe to call in a threadpool.
+    Fold `new_messages` into `previous_summary` with a short, dedicated
+    prompt (not the full system prompt). Returns the updated summary.
     """
-    loop = asyncio.new_event_loop()
-    try:
-        return loop.run_until_complete(
-            ask_ai(user_id, message_history, pending_messages_text)
+    lines = []
+    for msg in new_messages:
+        role = "مستخدم" if msg["role"] == "user" else "مساعد"
+        lines.append(f"{role}: {msg['content']}")
+
+    content = f"الملخص السابق:\n{previous_summary or 'لا يوجد'}\n\nالرسائل الجديدة:\n" + "\n".join(lines)
+
+    # Not under ai_semaphore: summaries are capped by SummaryScheduler's own
+    # semaphore and must never take a slot from a user-facing reply
+    with metrics.timer("ai_summary"):
+        summary = await chat.complete(
+            [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": content},
+            ],
+            max_tokens=512,
+            model=SUMMARY_MODEL,
         )
-    finally:
-        loop.close()
+
+    summary = summary.strip()
+    logger.debug("📝 Summary for user %s: %s new messages → %s chars", user_id, len(new_messages), len(summary))
+    return summary
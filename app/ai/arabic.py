@@ -0,0 +1,28 @@
+import re
+
+# Harakat, tanween, shadda, sukun, superscript alef
+_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]")
+_TATWEEL = "\u0640"
+_LETTER_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ة": "ه",
+    "٠": "0", "١": "1", "٢": "2", "٣": "3", "٤": "4",
+    "٥": "5", "٦": "6", "٧": "7", "٨": "8", "٩": "9",
+})
+# Anything that is not a letter, digit or whitespace (punctuation, emoji…)
+_NON_WORD = re.compile(r"[^\w\s]|_")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_arabic(text: str) -> str:
+    """
+    Fold the spelling variants users type interchangeably: diacritics and
+    tatweel are dropped, alef/yaa/taa marbuta forms unified, Arabic-Indic
+    digits mapped to ASCII, punctuation and emoji removed, Latin lowercased.
+    """
+    text = _DIACRITICS.sub("", text or "").replace(_TATWEEL, "")
+    text = text.translate(_LETTER_MAP).lower()
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
@@ -0,0 +1,175 @@
+import os
+import re
+import time
+import numpy as np
+from dotenv import load_dotenv
+from config.logger import logger
+from app.ai.arabic import normalize_arabic
+from app.ai.agent import system_prompt
+
+load_dotenv()
+
+FAQ_ENABLED = os.getenv("FAQ_ENABLED", "true").lower() == "true"
+# Cosine similarity a question must reach to be answered from the index
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.7"))
+# Shorter messages are answers to the bot's questions, not questions
+FAQ_MIN_CHARS = int(os.getenv("FAQ_MIN_CHARS", "12"))
+NGRAM_SIZES = (2, 3, 4)
+
+# Only messages that read as questions are looked up, so data the user is
+# giving ("العنوان الوطني للعقار هو …") never matches an FAQ by accident
+QUESTION_WORDS = {
+    "وش", "ايش", "شو", "ما", "ماهي", "ماهو", "هل", "كيف", "كم",
+    "متى", "ليش", "لماذا", "ماذا", "من", "مين", "وين", "اين",
+}
+
+FAQ_HEADER = "لو سألك سؤال ابحث عن الاجابة في قائمة الاسئلة التالية:"
+DEED_DIFFERENCE_QUESTIONS = [
+    "وش الفرق بين الصك الإلكتروني والسجل العقاري؟",
+    "ايش الفرق بين الصك الالكتروني والسجل العقاري",
+    "ما الفرق بين صك ناجز والسجل العقاري؟",
+]
+MORTGAGED_QUESTIONS = [
+    "الصك مرهون وش أسوي؟",
+    "إذا الصك مرهون للبنك وش أرسل؟",
+]
+MORTGAGED_ANSWER = "إذا الصك مرهون، أرسل بيانات المرهون له (الشخص) مو البنك."
+
+
+def parse_faq(prompt: str) -> list:
+    """
+    Extract (questions, answer) pairs from the prompt: the FAQ list at the
+    end, plus the deed-difference explanation and the mortgaged-deed note.
+    """
+    entries = []
+
+    deed = re.search(r"إذا سأل عن الفرق، أرسل له:\s*\n((?:✅.+\n?)+)", prompt)
+    if deed:
+        entries.append((DEED_DIFFERENCE_QUESTIONS, deed.group(1).strip()))
+    if "الصك المرهون" in prompt:
+        entries.append((MORTGAGED_QUESTIONS, MORTGAGED_ANSWER))
+
+    start = prompt.find(FAQ_HEADER)
+    if start == -1:
+        return entries
+
+    question, answer = None, []
+    for line in prompt[start + len(FAQ_HEADER):].splitlines()[1:]:  # skip the note line
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if not line.startswith("\t") and stripped.endswith(("؟", "?")):
+            if question and answer:
+                entries.append(([question], "\n".join(answer)))
+            question, answer = stripped, []
+        elif question:
+            answer.append(stripped)
+    if question and answer:
+        entries.append(([question], "\n".join(answer)))
+    return entries
+
+
+def looks_like_question(text: str) -> bool:
+    if "؟" in text or "?" in text:
+        return True
+    words = normalize_arabic(text).split()
+    return bool(words) and (words[0] in QUESTION_WORDS or "يعني" in words)
+
+
+def char_ngrams(text: str) -> list:
+    """Character n-grams of each normalized word, padded with spaces."""
+    grams = []
+    for word in normalize_arabic(text).split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+class FAQIndex:
+    """
+    TF-IDF over character n-grams of the FAQ questions, held as one dense
+    L2-normalized NumPy matrix. A lookup vectorizes the message and takes
+    a single matrix-vector product, so it costs microseconds; matches at
+    or above the threshold are answered with the canned text.
+    """
+
+    def __init__(self, entries: list, threshold: float = FAQ_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.answers = []
+        rows = []  # (answer index, n-grams)
+        for questions, answer in entries:
+            for question in questions:
+                rows.append((len(self.answers), char_ngrams(question)))
+            self.answers.append(answer)
+        self.row_answer = np.array([answer for answer, _ in rows], dtype=np.int32)
+
+        vocab = {}
+        for _, grams in rows:
+            for gram in grams:
+                vocab.setdefault(gram, len(vocab))
+        self.vocab = vocab
+
+        counts = np.zeros((len(rows), len(vocab)), dtype=np.float32)
+        for r, (_, grams) in enumerate(rows):
+            for gram in grams:
+                counts[r, vocab[gram]] += 1
+
+        # Smoothed idf and sublinear tf, as in the usual TF-IDF setup
+        df = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1 + len(rows)) / (1 + df)) + 1).astype(np.float32)
+        self.matrix = self._normalize(np.log1p(counts) * self.idf)
+
+        self.metrics = {"lookups": 0, "hits": 0, "lookup_seconds": 0.0}
+        logger.info("📚 FAQ index built: %s answers, %s questions, %s n-grams", len(self.answers), len(rows), len(vocab))
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _vectorize(self, text: str) -> np.ndarray:
+        vector = np.zeros(len(self.vocab), dtype=np.float32)
+        for gram in char_ngrams(text):
+            column = self.vocab.get(gram)
+            if column is not None:
+                vector[column] += 1
+        return self._normalize(np.log1p(vector) * self.idf)
+
+    def search(self, text: str) -> tuple:
+        """Best (answer, score) for `text`; answer is None if the index is empty."""
+        if not self.answers:
+            return None, 0.0
+        scores = self.matrix @ self._vectorize(text)
+        best = int(np.argmax(scores))
+        return self.answers[self.row_answer[best]], float(scores[best])
+
+    def answer(self, user_id: int, text: str):
+        """The canned answer if `text` matches an FAQ with high confidence, else None."""
+        if not FAQ_ENABLED or len(text.strip()) < FAQ_MIN_CHARS or not looks_like_question(text):
+            return None
+        started = time.perf_counter()
+        answer, score = self.search(text)
+        self.metrics["lookups"] += 1
+        self.metrics["lookup_seconds"] += time.perf_counter() - started
+        if answer is None or score < self.threshold:
+            logger.debug("FAQ miss for user %s (best score %.2f)", user_id, score)
+            return None
+        self.metrics["hits"] += 1
+        logger.info("📚 FAQ hit for user %s (score %.2f)", user_id, score)
+        return answer
+
+    def stats(self) -> dict:
+        lookups = self.metrics["lookups"]
+        return {
+            "answers": len(self.answers),
+            "threshold": self.threshold,
+            "lookups": lookups,
+            "hits": self.metrics["hits"],
+            "hit_rate": round(self.metrics["hits"] / lookups, 4) if lookups else 0.0,
+            "avg_lookup_us": round(self.metrics["lookup_seconds"] / lookups * 1e6, 1) if lookups else 0.0,
+        }
+
+
+# Built once at startup from the system prompt
+faq_index = FAQIndex(parse_faq(system_prompt))
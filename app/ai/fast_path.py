@@ -0,0 +1,174 @@
+import os
+import re
+from dotenv import load_dotenv
+from config.logger import logger
+from app.ai.arabic import normalize_arabic
+from app.ai.agent import system_prompt
+
+load_dotenv()
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+
+# Extra spellings on top of the synonyms listed in prompt.txt
+EXTRA_YES = ["ايوه", "ايه", "اكيد", "تمام", "اوكي", "يب", "ok", "okay", "yes"]
+EXTRA_NO = ["لا شكرا", "ما ابي", "ماابغى", "ما ابغا", "no"]
+GREETINGS = [
+    "السلام عليكم", "السلام عليكم ورحمه الله", "السلام عليكم ورحمه الله وبركاته",
+    "سلام", "هلا", "هلا والله", "اهلا", "مرحبا", "مساء الخير", "صباح الخير",
+    "hi", "hello",
+]
+CONTRACT_TYPES = {
+    "residential": ["سكني", "سكنيه", "سكن"],
+    "commercial": ["تجاري", "تجاريه"],
+    "sublease": ["بالباطن", "باطن", "من الباطن"],
+}
+
+# Words that don't change the answer ("أيوه والله أبي أسوي عقد")
+FILLER_WORDS = {"والله", "يا", "طيب", "اخوي", "شكرا", "لو", "سمحت", "اسوي", "عقد", "ايجار"}
+CONTRACT_FILLER_WORDS = FILLER_WORDS | {"ابي", "ابغى", "ابغي", "ابغا", "ابيه", "ابغاه", "خله", "يكون", "نوعه"}
+
+
+class PhraseMatcher:
+    """
+    Classifies short replies by covering every word with known phrases of a
+    single intent, longest phrase first. Anything left over, or phrases of
+    two different intents, means the reply is free-form.
+    """
+
+    def __init__(self, intents: dict, fillers: set):
+        self.fillers = fillers
+        self.phrases = []
+        for intent, phrases in intents.items():
+            for phrase in phrases:
+                words = tuple(w for w in normalize_arabic(phrase).split() if w not in fillers)
+                if words:
+                    self.phrases.append((words, intent))
+        self.phrases.sort(key=lambda item: -len(item[0]))
+
+    def classify(self, text: str):
+        words = [w for w in normalize_arabic(text).split() if w not in self.fillers]
+        if not words:
+            return None
+        found = set()
+        i = 0
+        while i < len(words):
+            for phrase, intent in self.phrases:
+                if tuple(words[i:i + len(phrase)]) == phrase:
+                    found.add(intent)
+                    i += len(phrase)
+                    break
+            else:
+                return None
+        return found.pop() if len(found) == 1 else None
+
+
+def local_response(reply: str, session_end: bool = False) -> dict:
+    """An ask_ai()-shaped response for a reply produced without the model."""
+    return {
+        "reply": reply,
+        "pdf_request": False,
+        "pdf_content": None,
+        "profile_updates": None,
+        "session_end": session_end,
+    }
+
+
+def _scripted_line(prompt: str, pattern: str):
+    match = re.search(pattern, prompt)
+    return match.group(1).strip() if match else None
+
+
+def _synonyms(prompt: str, intent_word: str) -> list:
+    listed = _scripted_line(prompt, rf"مثل \(([^)]*)\) اعتبرها {intent_word}")
+    return [s.strip() for s in listed.split("،")] if listed else []
+
+
+class FastPath:
+    """
+    Answers the scripted opening of prompt.txt without calling the model:
+    the greeting, the yes/no to "تبي تسوي عقد إيجار؟" and the residential /
+    commercial choice. Texts and yes/no synonyms are read from the prompt
+    itself so the two can't drift apart.
+
+    The dialogue state is derived from the session history (the last
+    assistant message), so it survives restarts and works on every
+    replica. Any reply that doesn't match a scripted step exactly — and
+    the sublease branch, which skips ahead — is handed to the model.
+    """
+
+    def __init__(self, prompt: str):
+        self.greeting = _scripted_line(prompt, r"ابدأ بالنص هذا:\s*\n(.+)")
+        self.declined = _scripted_line(prompt, r"إذا قال المستخدم لا → قل له:(.+?)(?:\(وأنهِ المحادثة\))?\s*\n")
+        self.contract_question = _scripted_line(prompt, r"إذا قال المستخدم نعم → قل له:(.+)")
+        self.deed_question = _scripted_line(prompt, r"✅ نوع الصك\s*\n(.+)")
+
+        self.enabled = all([self.greeting, self.declined, self.contract_question, self.deed_question])
+        if not self.enabled:
+            logger.warning("⚠️ Scripted opening not found in prompt.txt; fast path disabled")
+            return
+
+        self.greetings = PhraseMatcher({"greeting": GREETINGS}, {"و", "يا", "الله", "حياك"})
+        self.yes_no = PhraseMatcher(
+            {
+                "yes": _synonyms(prompt, "نعم") + EXTRA_YES,
+                "no": _synonyms(prompt, "لا") + EXTRA_NO,
+            },
+            FILLER_WORDS,
+        )
+        self.contract_types = PhraseMatcher(CONTRACT_TYPES, CONTRACT_FILLER_WORDS)
+
+        self._states = {
+            normalize_arabic(self.greeting): self._after_greeting,
+            normalize_arabic(self.contract_question): self._after_contract_question,
+        }
+        self.metrics = {"answered": 0, "handoffs": 0}
+
+    def _opening(self, text: str):
+        if self.greetings.classify(text):
+            return local_response(self.greeting)
+        return None
+
+    def _after_greeting(self, text: str):
+        intent = self.yes_no.classify(text)
+        if intent == "yes":
+            return local_response(self.contract_question)
+        if intent == "no":
+            return local_response(self.declined, session_end=True)
+        return None
+
+    def _after_contract_question(self, text: str):
+        if self.contract_types.classify(text) in ("residential", "commercial"):
+            return local_response(self.deed_question)
+        return None
+
+    def answer(self, user_id: int, history: list):
+        """
+        Return an ask_ai()-shaped response for `history` (ending with the
+        new user message) if it is a scripted step, else None.
+        """
+        if not (FAST_PATH_ENABLED and self.enabled) or not history:
+            return None
+        text = history[-1]["content"]
+
+        step = None
+        if len(history) == 1:
+            response = self._opening(text)
+        else:
+            previous = history[-2]
+            step = self._states.get(normalize_arabic(previous["content"])) if previous["role"] == "assistant" else None
+            response = step(text) if step else None
+
+        if response is None:
+            if len(history) == 1 or step:
+                self.metrics["handoffs"] += 1
+            return None
+        self.metrics["answered"] += 1
+        logger.info("⚡ Fast path answered user %s without the model", user_id)
+        return response
+
+    def stats(self) -> dict:
+        return dict(self.metrics) if self.enabled else {"enabled": False}
+
+
+# Shared instance for all handlers
+fast_path = FastPath(system_prompt)
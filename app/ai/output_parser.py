@@ -0,0 +1,190 @@
+import json
+import re
+from config.logger import logger
+
+PDF_TAG = "[SEND_PDF]"
+
+# Longest run of undecided characters held back while streaming: enough for
+# the tag, a ```json fence and the whitespace before a JSON object's first key
+MAX_LOOKAHEAD = 32
+MAX_PAYLOAD_CHARS = 64 * 1024
+
+_SPECIAL = re.compile(r"[\[{`]")
+_FENCE_PREFIX = re.compile(r"`{1,3}(?:j(?:s(?:o(?:n)?)?)?)?\s*")
+_JSON_OPENING = re.compile(r"(?:```(?:json)?\s*)?\{\s*")
+_JSON_START = re.compile(r"(?:```(?:json)?\s*)?(\{\s*[\"}])")
+_FENCE = re.compile(r"```(?:json)?\s*")
+_CLOSING_FENCE = re.compile(r"\s*```")
+_CLOSING_FENCE_PREFIX = re.compile(r"\s*`{0,2}")
+
+
+class StreamParser:
+    """
+    Splits a streamed completion into user-visible text, the [SEND_PDF]
+    control tag and the trailing JSON payload, in one pass as chunks
+    arrive.
+
+    Text is released as soon as it can't be the start of the tag or of a
+    JSON object, so at most MAX_LOOKAHEAD characters are ever held back.
+    A "{" only opens the payload when the next non-space character is a
+    quote (or "}"), so braces in ordinary text stay visible; the object is
+    then tracked by brace depth, string- and escape-aware, and decoded
+    the moment it closes. Markdown ```json fences around it are dropped.
+    """
+
+    def __init__(self):
+        self.text = ""              # everything released as visible so far
+        self.pdf_requested = False
+        self.payload = None         # last JSON object that decoded to a dict
+
+        self._held = ""             # undecided text (possible tag / fence / "{")
+        self._closing_fence = False # a ``` right after the payload is dropped too
+        self._json = None           # raw payload while inside the object
+        self._oversized = False     # payload too big: track depth, keep nothing
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def profile_updates(self):
+        return self.payload.get("profile_updates") if self.payload else None
+
+    # ── Feeding ───────────────────────────────────────────────────────────────
+    def feed(self, chunk: str) -> str:
+        """Consume the next chunk; returns the newly visible text (may be "")."""
+        out = []
+        i = 0
+        while i < len(chunk):
+            if self._json is not None:
+                i = self._feed_json(chunk, i)
+                continue
+            if not self._held and not self._closing_fence:
+                # Fast path: copy plain text up to the next special character
+                match = _SPECIAL.search(chunk, i)
+                end = match.start() if match else len(chunk)
+                out.append(chunk[i:end])
+                i = end
+                if match is None:
+                    break
+            self._held += chunk[i]
+            i += 1
+            out.append(self._resolve())
+        visible = "".join(out)
+        self.text += visible
+        return visible
+
+    def close(self) -> str:
+        """Flush at the end of the stream; returns the last visible text."""
+        visible = ""
+        if self._json is not None:
+            logger.warning("⚠️ Completion ended inside the JSON payload (%s chars dropped)", len(self._json))
+            self._json = None
+        elif self._held and not (_FENCE.fullmatch(self._held) or self._closing_fence):
+            visible = self._held
+        self._held = ""
+        self.text += visible
+        return visible
+
+    # ── Internals ─────────────────────────────────────────────────────────────
+    def _resolve(self) -> str:
+        """Decide what the held text is; returns the part that is plain text."""
+        released = []
+        while self._held:
+            held = self._held
+            if self._closing_fence:
+                if _CLOSING_FENCE.fullmatch(held):
+                    self._held = ""
+                    self._closing_fence = False
+                    break
+                if _CLOSING_FENCE_PREFIX.fullmatch(held) and len(held) <= MAX_LOOKAHEAD:
+                    break
+                self._closing_fence = False
+                match = _SPECIAL.search(held)
+                if match is None:
+                    released.append(held)
+                    self._held = ""
+                    break
+                released.append(held[:match.start()])
+                self._held = held = held[match.start():]
+                continue
+            if held == PDF_TAG:
+                self.pdf_requested = True
+                self._held = ""
+                break
+            start = _JSON_START.fullmatch(held)
+            if start:
+                self._held = ""
+                self._json = ""
+                self._depth = 0
+                self._feed_json(start.group(1), 0)
+                break
+            undecided = (
+                PDF_TAG.startswith(held)
+                or _FENCE_PREFIX.fullmatch(held)
+                or _JSON_OPENING.fullmatch(held)
+            )
+            if undecided and len(held) <= MAX_LOOKAHEAD:
+                break
+            # Not special after all: release one character and look again
+            released.append(held[0])
+            rest = held[1:]
+            match = _SPECIAL.search(rest)
+            if match is None:
+                released.append(rest)
+                self._held = ""
+            else:
+                released.append(rest[:match.start()])
+                self._held = rest[match.start():]
+        return "".join(released)
+
+    def _feed_json(self, chunk: str, i: int) -> int:
+        """Consume payload characters from chunk[i:]; returns the next index."""
+        start = i
+        while i < len(chunk):
+            char = chunk[i]
+            i += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._json += chunk[start:i]
+                    self._finish_json()
+                    return i
+        if not self._oversized:
+            self._json += chunk[start:i]
+            if len(self._json) > MAX_PAYLOAD_CHARS:
+                logger.warning("⚠️ JSON payload over %s chars; dropping it", MAX_PAYLOAD_CHARS)
+                self._oversized = True
+        return i
+
+    def _finish_json(self):
+        blob, self._json = self._json, None
+        self._closing_fence = True
+        if self._oversized:
+            self._oversized = False
+            return
+        try:
+            parsed = json.loads(blob)
+        except ValueError as e:
+            logger.warning("⚠️ Failed to parse JSON blob: %s", e)
+            return
+        if isinstance(parsed, dict):
+            self.payload = parsed
+
+
+def parse_completion(raw: str) -> StreamParser:
+    """Parse a complete (non-streamed) completion in one go."""
+    parser = StreamParser()
+    parser.feed(raw)
+    parser.close()
+    return parser
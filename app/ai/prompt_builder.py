@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+from dotenv import load_dotenv
+from config.logger import logger
+from app.ai.tokens import MESSAGE_OVERHEAD_TOKENS, token_counter
+
+load_dotenv()
+
+# Tokens for everything after the static prefix: summary, profile and history
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+
+
+class PromptAssembler:
+    """
+    Builds chat messages so the provider's prefix cache can be reused.
+
+    The system prompt is always sent first and byte-for-byte identical, as
+    its own message. Everything that varies per user (summary, profile) goes
+    in a second, compact system message after it, followed by the turns.
+
+    The turns are packed newest first into what is left of the token
+    budget after the per-user context, so short exchanges carry more
+    history and one long pasted message cannot blow up the prompt.
+    """
+
+    def __init__(self, static_prompt: str, token_budget: int = CONTEXT_TOKEN_BUDGET):
+        self.static_prompt = static_prompt
+        self.static_message = {"role": "system", "content": static_prompt}
+        self.prefix_hash = hashlib.sha256(static_prompt.encode("utf-8")).hexdigest()[:12]
+        self.static_tokens = token_counter.message_tokens(dict(self.static_message))
+        self.token_budget = token_budget
+
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.packed_calls = 0
+        self.packed_tokens = 0
+        self.dropped_messages = 0
+        self.truncated_summaries = 0
+
+    @staticmethod
+    def user_context(partial_summary: str = None, user_profile: dict = None) -> str:
+        """Compact per-user context, or "" when there is nothing to add."""
+        parts = []
+        if partial_summary:
+            parts.append(f"# USER SUMMARY:\n{partial_summary}")
+        profile = {k: v for k, v in (user_profile or {}).items() if v}
+        if profile:
+            profile_json = json.dumps(profile, ensure_ascii=False, separators=(",", ":"))
+            parts.append(f"# USER PROFILE:\n{profile_json}")
+        return "\n\n".join(parts)
+
+    def pack(self, history: list, budget: int) -> tuple[list, int]:
+        """
+        The newest messages of `history` whose token counts fit in `budget`,
+        oldest first, and the tokens they use. The newest message (the
+        user's current turn) is always kept whole, even past the budget.
+        """
+        packed, used = [], 0
+        for message in reversed(history):
+            tokens = token_counter.message_tokens(message)
+            if packed and used + tokens > budget:
+                break
+            packed.append({"role": message["role"], "content": message["content"]})
+            used += tokens
+        packed.reverse()
+        self.dropped_messages += len(history) - len(packed)
+        return packed, used
+
+    def build(
+        self,
+        history: list,
+        partial_summary: str = None,
+        user_profile: dict = None,
+        pending_messages_text: str = None,
+        user_id: int = None
+    ) -> list:
+        """
+        Static prefix, then per-user context, then as much of the
+        conversation as the budget allows. What the user just wrote is
+        never cut; if the budget runs short the summary is shortened and
+        older history is left out instead.
+        """
+        messages = [self.static_message]
+        pending = {"role": "user", "content": pending_messages_text} if pending_messages_text else None
+        current = token_counter.message_tokens(history[-1]) if history else 0
+        reserved = current + (token_counter.count(pending_messages_text) + MESSAGE_OVERHEAD_TOKENS if pending else 0)
+
+        context = self.user_context(partial_summary, user_profile)
+        context_tokens = token_counter.count(context) + MESSAGE_OVERHEAD_TOKENS if context else 0
+        if partial_summary and reserved + context_tokens > self.token_budget:
+            without_summary = self.user_context(None, user_profile)
+            room = self.token_budget - reserved - context_tokens + token_counter.count(partial_summary)
+            summary = token_counter.truncate(partial_summary, room) if room > 0 else None
+            context = self.user_context(summary, user_profile) if summary else without_summary
+            context_tokens = token_counter.count(context) + MESSAGE_OVERHEAD_TOKENS if context else 0
+            self.truncated_summaries += 1
+        if context:
+            messages.append({"role": "system", "content": context})
+        if pending:
+            messages.append(pending)
+        fixed = context_tokens + reserved - current
+
+        turns, used = self.pack(history, self.token_budget - fixed)
+        messages.extend(turns)
+
+        self.packed_calls += 1
+        self.packed_tokens += fixed + used
+        logger.info(
+            "📦 Prompt for user %s: %s/%s context tokens (summary+profile=%s, history=%s in %s/%s messages), %s total",
+            user_id, fixed + used, self.token_budget, context_tokens, used, len(turns), len(history),
+            self.static_tokens + fixed + used
+        )
+        return messages
+
+    def record_usage(self, user_id: int, usage):
+        """Track cached vs. uncached prompt tokens from a completion's usage."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.cached_tokens += cached
+        self.completion_tokens += usage.completion_tokens
+
+        logger.info(
+            "🧾 Usage for user %s: prompt=%s (cached=%s, uncached=%s), completion=%s",
+            user_id, usage.prompt_tokens, cached, usage.prompt_tokens - cached, usage.completion_tokens
+        )
+
+    def stats(self) -> dict:
+        return {
+            "prefix_hash": self.prefix_hash,
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "uncached_tokens": self.prompt_tokens - self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+            "token_budget": self.token_budget,
+            "avg_context_tokens": round(self.packed_tokens / self.packed_calls) if self.packed_calls else 0,
+            "dropped_messages": self.dropped_messages,
+            "truncated_summaries": self.truncated_summaries,
+        }
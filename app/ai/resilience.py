@@ -0,0 +1,335 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+import httpx
+import openai
+from dotenv import load_dotenv
+from config.logger import logger
+from config.metrics import metrics
+
+load_dotenv()
+
+# Deadlines (seconds)
+AI_TTFT_TIMEOUT = float(os.getenv("AI_TTFT_TIMEOUT", "10"))          # request sent → first content token
+AI_STREAM_IDLE_TIMEOUT = float(os.getenv("AI_STREAM_IDLE_TIMEOUT", "10"))  # longest gap between chunks
+AI_ATTEMPT_TIMEOUT = float(os.getenv("AI_ATTEMPT_TIMEOUT", "60"))    # one whole attempt
+
+# Retries with "full jitter" exponential backoff
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.25"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "2"))
+
+# Hedging: if the first token is later than the recent p95, race a second request
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "false").lower() == "true"
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "1.0"))
+AI_HEDGE_WINDOW = int(os.getenv("AI_HEDGE_WINDOW", "200"))  # recent TTFTs the p95 is taken over
+
+# Circuit breaker per model; while the primary's is open, calls go to the fallback
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+
+# Errors worth another attempt; anything else (bad request, auth) fails at once
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Every model's breaker is open; fail fast instead of queueing on a dead provider."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `cooldown` seconds; then lets one probe through (half-open) and
+    closes again if it succeeds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = AI_BREAKER_FAILURES, cooldown: float = AI_BREAKER_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("✅ Circuit for %s closed again", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                metrics.count("ai_breaker_opened")
+                logger.warning("🔌 Circuit for %s opened after %s failures", self.name, self.failures)
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def abandon(self):
+        """A call was cancelled before it could tell us anything; free the probe slot."""
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "times_opened": self.times_opened}
+
+
+class _OpenStream:
+    """A streamed completion whose first content token has arrived."""
+
+    def __init__(self, model: str, stream, chunks, first: str, started: float):
+        self.model = model
+        self.stream = stream
+        self.chunks = chunks
+        self.first = first
+        self.started = started
+
+    async def close(self):
+        try:
+            await self.stream.close()
+        except Exception:
+            pass
+
+
+class ResilientChat:
+    """
+    Model calls with bounded latency.
+
+    A streamed call must produce its first token within AI_TTFT_TIMEOUT,
+    may not stall longer than AI_STREAM_IDLE_TIMEOUT between chunks, and
+    must finish within AI_ATTEMPT_TIMEOUT. Until the first token has been
+    handed to the caller, failed or timed-out attempts are retried with
+    jittered backoff, and (with AI_HEDGE_ENABLED) a second request is raced
+    once the wait passes the recent p95 time to first token. Each model has
+    a circuit breaker; while the primary's is open, calls go to the
+    fallback model, and if both are open the call fails immediately.
+    """
+
+    def __init__(
+        self,
+        client,
+        model: str,
+        fallback_model: str = None,
+        ttft_timeout: float = AI_TTFT_TIMEOUT,
+        idle_timeout: float = AI_STREAM_IDLE_TIMEOUT,
+        attempt_timeout: float = AI_ATTEMPT_TIMEOUT,
+        max_retries: int = AI_MAX_RETRIES,
+        hedge: bool = AI_HEDGE_ENABLED
+    ):
+        self.client = client
+        self.model = model
+        self.fallback_model = fallback_model if fallback_model and fallback_model != model else None
+        self.ttft_timeout = ttft_timeout
+        self.idle_timeout = idle_timeout
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.breakers = {m: CircuitBreaker(m) for m in filter(None, (self.model, self.fallback_model))}
+        self._ttfts = deque(maxlen=AI_HEDGE_WINDOW)
+
+    # ── Policy ────────────────────────────────────────────────────────────────
+    def _pick_model(self, preferred: str = None) -> str:
+        preferred = preferred or self.model
+        breaker = self.breakers.setdefault(preferred, CircuitBreaker(preferred))
+        if breaker.allow():
+            return preferred
+        if self.fallback_model and preferred != self.fallback_model and self.breakers[self.fallback_model].allow():
+            metrics.count("ai_fallback")
+            return self.fallback_model
+        raise CircuitOpenError(f"circuit open for {preferred}")
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return random.uniform(0, min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * 2 ** attempt))
+
+    def hedge_delay(self) -> float:
+        """Recent p95 time to first token (never below AI_HEDGE_MIN_DELAY)."""
+        if len(self._ttfts) < 20:
+            return max(AI_HEDGE_MIN_DELAY, self.ttft_timeout / 2)
+        ordered = sorted(self._ttfts)
+        return max(AI_HEDGE_MIN_DELAY, ordered[int(len(ordered) * 0.95) - 1])
+
+    def _failed(self, model: str, error: Exception):
+        self.breakers[model].record_failure()
+        metrics.count("ai_timeout" if isinstance(error, asyncio.TimeoutError) else "ai_error")
+        logger.warning("⚠️ %s attempt failed: %r", model, error)
+
+    # ── Streaming ─────────────────────────────────────────────────────────────
+    async def _open(self, model: str, on_usage, **request) -> _OpenStream:
+        """Send the request and wait (within the TTFT deadline) for the first content token."""
+        started = time.perf_counter()
+        stream = None
+
+        async def first_token():
+            nonlocal stream
+            stream = await self.client.chat.completions.create(
+                model=model, stream=True, stream_options={"include_usage": True}, **request
+            )
+            chunks = stream.__aiter__()
+            async for chunk in chunks:
+                if chunk.usage and on_usage:
+                    on_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    return _OpenStream(model, stream, chunks, chunk.choices[0].delta.content, started)
+            raise openai.APIConnectionError(message="stream ended before any content", request=None)
+
+        try:
+            opened = await asyncio.wait_for(first_token(), self.ttft_timeout)
+        except BaseException as e:
+            if stream is not None:
+                try:
+                    await stream.close()
+                except Exception:
+                    pass
+            if isinstance(e, RETRYABLE_ERRORS):
+                self._failed(model, e)
+            else:
+                self.breakers[model].abandon()
+            raise
+        ttft = time.perf_counter() - started
+        self._ttfts.append(ttft)
+        metrics.observe("ai_ttft", ttft)
+        self.breakers[model].record_success()
+        return opened
+
+    async def _first_token(self, model: str, on_usage, **request) -> _OpenStream:
+        """Open the stream, racing a hedged second request if the first is slow."""
+        primary = asyncio.create_task(self._open(model, on_usage, **request))
+        if not self.hedge:
+            return await primary
+
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay())
+            if not done:
+                try:
+                    hedge_model = self._pick_model(model)
+                except CircuitOpenError:
+                    hedge_model = None
+                if hedge_model:
+                    metrics.count("ai_hedged")
+                    tasks.add(asyncio.create_task(self._open(hedge_model, on_usage, **request)))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if not task.cancelled() and task.exception() is None]
+                if winners:
+                    for extra in winners[1:]:
+                        await extra.result().close()
+                    if winners[0] is not primary:
+                        metrics.count("ai_hedge_won")
+                    return winners[0].result()
+                error = next(task.exception() for task in done if not task.cancelled())
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                try:
+                    opened = await task
+                except BaseException:
+                    continue
+                await opened.close()
+
+    async def stream(self, messages: list, max_tokens: int, on_usage=None):
+        """
+        Yield the completion's content deltas. Retries and hedging only
+        happen before the first delta is yielded; after that a failure or
+        stall raises, since part of the reply may already be on screen.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                metrics.count("ai_retry")
+                await asyncio.sleep(self._backoff(attempt))
+            model = self._pick_model()
+            try:
+                opened = await self._first_token(model, on_usage, messages=messages, max_tokens=max_tokens)
+            except RETRYABLE_ERRORS as e:
+                error = e
+                continue
+            break
+        else:
+            raise error
+
+        deadline = opened.started + self.attempt_timeout
+        try:
+            yield opened.first
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError("completion exceeded AI_ATTEMPT_TIMEOUT")
+                try:
+                    chunk = await asyncio.wait_for(opened.chunks.__anext__(), min(self.idle_timeout, remaining))
+                except StopAsyncIteration:
+                    break
+                if chunk.usage and on_usage:
+                    on_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            metrics.observe("ai_completion", time.perf_counter() - opened.started)
+        except RETRYABLE_ERRORS as e:
+            self._failed(opened.model, e)
+            raise
+        finally:
+            # Also runs when the caller is cancelled: drop the connection so generation stops
+            await opened.close()
+
+    # ── Non-streaming ─────────────────────────────────────────────────────────
+    async def complete(self, messages: list, max_tokens: int, model: str = None) -> str:
+        """One non-streamed completion (summaries) with the same deadlines, retries and breakers."""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                metrics.count("ai_retry")
+                await asyncio.sleep(self._backoff(attempt))
+            chosen = self._pick_model(model)
+            try:
+                response = await asyncio.wait_for(
+                    self.client.chat.completions.create(model=chosen, messages=messages, max_tokens=max_tokens),
+                    self.attempt_timeout,
+                )
+            except RETRYABLE_ERRORS as e:
+                self._failed(chosen, e)
+                error = e
+                continue
+            self.breakers[chosen].record_success()
+            return response.choices[0].message.content or ""
+        raise error
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "fallback_model": self.fallback_model,
+            "hedge_delay_s": round(self.hedge_delay(), 3) if self.hedge else None,
+            "breakers": {name: breaker.stats() for name, breaker in self.breakers.items()},
+        }
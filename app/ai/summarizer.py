@@ -0,0 +1,146 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from config.logger import logger
+from app.ai.agent import summarize_conversation
+from app.ai.tokens import token_counter
+from app.db.user_data import get_logged_messages, update_partial_summary
+
+load_dotenv()
+
+SUMMARY_EVERY_N_MESSAGES = int(os.getenv("SUMMARY_EVERY_N_MESSAGES", "10"))
+SUMMARY_EVERY_N_TOKENS = int(os.getenv("SUMMARY_EVERY_N_TOKENS", "3000"))
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "4"))
+
+
+def estimate_tokens(messages: list) -> int:
+    """Tokens in `messages`, using the counts cached on each message."""
+    return sum(token_counter.message_tokens(msg) for msg in messages)
+
+
+class SummaryScheduler:
+    """
+    Keeps each session's partial summary up to date in the background.
+
+    After a reply has been sent, the messages added since the last summary
+    are checked against the message-count and token triggers; if either
+    fires, a task folds just those messages into the previous summary.
+    Unsummarized messages older than the tail the turn read are fetched
+    from the message log first; if the log cannot supply them the summary
+    is left as is, so summarized_count only ever advances over messages
+    that were actually folded in. At most one task runs per user
+    and SUMMARY_MAX_CONCURRENCY overall.
+    """
+
+    def __init__(
+        self,
+        every_n_messages: int = SUMMARY_EVERY_N_MESSAGES,
+        every_n_tokens: int = SUMMARY_EVERY_N_TOKENS,
+        max_concurrency: int = SUMMARY_MAX_CONCURRENCY
+    ):
+        self.every_n_messages = every_n_messages
+        self.every_n_tokens = every_n_tokens
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: dict[int, asyncio.Task] = {}
+
+        self.metrics = {
+            "scheduled": 0,
+            "completed": 0,
+            "failed": 0,
+            "backfilled_messages": 0,
+            "backfill_failed": 0,
+        }
+
+    def should_summarize(self, new_messages: list) -> bool:
+        user_messages = sum(1 for msg in new_messages if msg.get("role") == "user")
+        if self.every_n_messages and user_messages >= self.every_n_messages:
+            return True
+        return bool(self.every_n_tokens) and estimate_tokens(new_messages) >= self.every_n_tokens
+
+    def maybe_schedule(
+        self,
+        user_id: int,
+        session_id: str,
+        recent_history: list,
+        message_count: int,
+        previous_summary: str,
+        summarized_count: int
+    ) -> bool:
+        """
+        Schedule a summary update if the messages after `summarized_count`
+        hit a trigger. `recent_history` is the tail of the session (ending
+        with the turn that was just answered) and `message_count` the total
+        number of messages in it. Never blocks.
+        """
+        if not session_id or user_id in self._tasks:
+            return False
+
+        new_count = message_count - summarized_count
+        if new_count <= 0:
+            return False
+        new_messages = recent_history[-new_count:]
+        if not self.should_summarize(new_messages):
+            return False
+        # Older than the tail we were given; _run reads them from the message log
+        missing = max(0, new_count - len(recent_history))
+
+        self.metrics["scheduled"] += 1
+        task = asyncio.create_task(self._run(
+            user_id, session_id, list(new_messages), previous_summary, summarized_count, missing, message_count
+        ))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+        return True
+
+    async def _run(
+        self,
+        user_id: int,
+        session_id: str,
+        new_messages: list,
+        previous_summary: str,
+        summarized_count: int,
+        missing: int,
+        covered: int
+    ):
+        try:
+            if missing:
+                # The log entry right after the missing range must be the first message
+                # of the tail; otherwise positions in the log don't line up with the session
+                logged = await get_logged_messages(session_id, summarized_count, missing + 1)
+                first = new_messages[0]
+                if len(logged) <= missing or (logged[-1].get("role"), logged[-1].get("content")) != (
+                    first.get("role"), first.get("content")
+                ):
+                    self.metrics["backfill_failed"] += 1
+                    logger.warning(
+                        "⚠️ Message log does not line up with session %s; summary for user %s left as is",
+                        session_id, user_id
+                    )
+                    return
+                self.metrics["backfilled_messages"] += missing
+                new_messages = logged[:missing] + new_messages
+            async with self._semaphore:
+                summary = await summarize_conversation(user_id, previous_summary, new_messages)
+            if not summary:
+                logger.warning("⚠️ Empty summary returned for user %s", user_id)
+                return
+            await update_partial_summary(user_id, summary, summarized_count=covered, session_id=session_id)
+            self.metrics["completed"] += 1
+            logger.info("✅ Updated partial summary for user %s (%s new messages)", user_id, len(new_messages))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.metrics["failed"] += 1
+            logger.error("❌ Summary update failed for user %s: %s", user_id, e)
+
+    async def stop(self):
+        """Wait for in-flight summaries so they are not lost on shutdown."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {**self.metrics, "running": len(self._tasks)}
+
+
+# Shared instance used by the message handler
+summary_scheduler = SummaryScheduler()
@@ -0,0 +1,94 @@
+import os
+from dotenv import load_dotenv
+from config.logger import logger
+
+try:
+    import tiktoken
+except ImportError:  # optional; without it token counts are estimated
+    tiktoken = None
+
+load_dotenv()
+
+# Tokenizer of the chat model (o200k_base for the gpt-4o family)
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+# Role and separators the API wraps around every chat message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """
+    Counts tokens locally with tiktoken, or estimates them (about four
+    UTF-8 bytes per token, so roughly two Arabic letters) when tiktoken or
+    its encoding files are unavailable. A message's count is stored on the
+    message itself under "tokens", so it is computed once and then travels
+    with it into the session history.
+    """
+
+    def __init__(self, encoding_name: str = TOKENIZER_ENCODING):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._loaded = False
+
+        self.metrics = {
+            "counted": 0,
+            "estimated": 0,
+            "cached": 0,
+        }
+
+    def _encoder(self):
+        if not self._loaded:
+            self._loaded = True
+            if tiktoken is None:
+                logger.info("ℹ️ tiktoken not installed; estimating token counts")
+            else:
+                try:
+                    self._encoding = tiktoken.get_encoding(self.encoding_name)
+                except Exception as e:
+                    logger.warning("⚠️ Tokenizer %s unavailable, estimating token counts: %s", self.encoding_name, e)
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        encoding = self._encoder()
+        if encoding is not None:
+            self.metrics["counted"] += 1
+            return len(encoding.encode(text, disallowed_special=()))
+        self.metrics["estimated"] += 1
+        return (len(text.encode("utf-8")) + 3) // 4
+
+    def message_tokens(self, message: dict) -> int:
+        """Tokens a chat message costs, counted once and cached on the message."""
+        tokens = message.get("tokens")
+        if isinstance(tokens, int):
+            self.metrics["cached"] += 1
+            return tokens
+        tokens = self.count(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+        message["tokens"] = tokens
+        return tokens
+
+    def message(self, role: str, content: str) -> dict:
+        """A history message with its token count attached."""
+        message = {"role": role, "content": content}
+        self.message_tokens(message)
+        return message
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The start of `text`, cut to at most `max_tokens`."""
+        if max_tokens <= 0:
+            return ""
+        encoding = self._encoder()
+        if encoding is not None:
+            tokens = encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+        return text.encode("utf-8")[:max_tokens * 4].decode("utf-8", errors="ignore")
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "tokenizer": self.encoding_name if self._encoding is not None else "estimate",
+        }
+
+
+# Shared instance used for prompts and stored history
+token_counter = TokenCounter()
@@ -1,9 +1,27 @@
 import os
+import asyncio
+from telegram import Update
 from telegram.ext import Application
 from dotenv import load_dotenv
 from config.logger import logger  # Import the logger
+from config import queue as user_queue
+from config.metrics import metrics, METRICS_LISTEN, METRICS_PORT
 from app.handlers.start_handler import start_handler
-from app.handlers.message_handler import message_handler
+from app.handlers.stats_handler import stats_handler
+from app.handlers.message_handler import message_handler, start_worker, get_debounce_stats
+from app.handlers.outbound import outbound
+from app.handlers.debounce import debouncer
+from app.db.mongo_client import close_client
+from app.db.indexes import MONGO_ENSURE_INDEXES, ensure_indexes
+from app.db.compaction import COMPACTION_ENABLED, session_compactor
+from app.db.write_behind import write_buffer
+from app.db.training_storage import training_sink
+from app.db.session_cache import user_cache
+from app.ai.agent import chat, close_ai_client, prompt_assembler
+from app.ai.summarizer import summary_scheduler
+from app.ai.fast_path import fast_path
+from app.ai.faq_index import faq_index
+from app.pdf.contract_pdf import contract_renderer
 
 
 # Load environment variables
@@ -16,17 +34,147 @@ if not BOT_TOKEN:
     logger.critical("BOT_TOKEN is not set in the .env file")
     raise ValueError("BOT_TOKEN is not set in the .env file")
 
+# Update ingestion: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Updates handled at once in webhook mode; polling keeps one at a time, in order
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public https base URL registered with Telegram
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+if BOT_MODE == "webhook" and not (WEBHOOK_SECRET and WEBHOOK_URL):
+    logger.critical("WEBHOOK_SECRET and WEBHOOK_URL are required when BOT_MODE=webhook")
+    raise ValueError("WEBHOOK_SECRET and WEBHOOK_URL are required when BOT_MODE=webhook")
+
+# How often idle per-user state is swept
+JANITOR_INTERVAL_SECONDS = float(os.getenv("JANITOR_INTERVAL_SECONDS", "60"))
+_janitor_task = None
+_metrics_server = None
+
+
+def register_metrics():
+    """Expose the components' live stats as gauges and counters on /metrics."""
+    metrics.expose("bot_queued_messages", "Messages waiting in in-memory user queues",
+                   lambda: user_queue.get_queue_stats()["queued_messages"])
+    metrics.expose("bot_queue_workers", "User queue workers running", lambda: user_queue.get_queue_stats()["workers"])
+    metrics.expose("bot_active_slots", "Messages being processed right now", lambda: user_queue.active_slots)
+    metrics.expose("bot_waiting_for_slot", "Messages waiting for a processing slot", lambda: user_queue.waiting_slots)
+    metrics.expose("bot_debounce_buffers", "Users with buffered (debouncing) messages",
+                   lambda: get_debounce_stats()["buffers"])
+    metrics.expose("bot_ai_tokens_total", "Model tokens used", lambda: {
+        "prompt": prompt_assembler.prompt_tokens,
+        "cached": prompt_assembler.cached_tokens,
+        "completion": prompt_assembler.completion_tokens,
+    }, kind="counter", label="kind")
+    metrics.expose("bot_ai_calls_total", "Completions with usage reported", lambda: prompt_assembler.calls, kind="counter")
+    metrics.expose("bot_context_tokens_avg", "Average tokens of per-user context packed into a prompt",
+                   lambda: prompt_assembler.stats()["avg_context_tokens"])
+    metrics.expose("bot_context_messages_dropped_total", "History messages left out to stay within the token budget",
+                   lambda: prompt_assembler.dropped_messages, kind="counter")
+    metrics.expose("bot_summaries_running", "Background summary updates in flight",
+                   lambda: summary_scheduler.stats()["running"])
+    metrics.expose("bot_write_behind_pending", "Queued Mongo writes not yet flushed", lambda: {
+        "user_updates": write_buffer.stats()["pending_user_updates"],
+        "sessions": write_buffer.stats()["pending_sessions"],
+        "messages": write_buffer.stats()["pending_messages"],
+    }, label="kind")
+    metrics.expose("bot_user_cache_size", "Users in the in-memory cache", lambda: user_cache.stats()["size"])
+    metrics.expose("bot_user_cache_hit_ratio", "User cache hit ratio", lambda: user_cache.stats()["hit_rate"])
+    metrics.expose("bot_telegram_throttled_seconds_total", "Time sends waited for rate-limit tokens",
+                   lambda: outbound.metrics["throttled_seconds"], kind="counter")
+    metrics.expose("bot_telegram_retry_after_total", "Telegram flood-control (429) responses",
+                   lambda: outbound.metrics["retry_after"], kind="counter")
+    metrics.expose("bot_typing_chats", "Chats showing the typing indicator", lambda: outbound.stats()["typing_chats"])
+    metrics.expose("bot_compaction_bytes_reclaimed_total", "Bytes of session documents moved to the archive",
+                   lambda: session_compactor.metrics["bytes_reclaimed"], kind="counter")
+    metrics.expose("bot_ai_circuit_open", "1 while a model's circuit breaker is not closed", lambda: {
+        model: int(breaker["state"] != "closed") for model, breaker in chat.stats()["breakers"].items()
+    }, label="model")
+
+async def run_janitor():
+    """Periodically drop idle queues, expired cache entries and rate-limit state."""
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL_SECONDS)
+        user_queue.evict_idle_queues()
+        user_cache.evict_expired()
+        outbound.evict_idle()
+        debouncer.evict_idle()
+        logger.debug("📊 Queue stats: %s", user_queue.get_queue_stats())
+        logger.debug("📊 Local answers: fast path %s, FAQ %s", fast_path.stats(), faq_index.stats())
+
+async def on_startup(application: Application):
+    """Start background workers once the event loop is running."""
+    global _janitor_task, _metrics_server
+    if MONGO_ENSURE_INDEXES:
+        await ensure_indexes()
+    write_buffer.start()
+    training_sink.start()
+    if COMPACTION_ENABLED:
+        session_compactor.start()
+    _janitor_task = asyncio.create_task(run_janitor())
+    if METRICS_PORT:
+        from app.metrics_server import start_metrics_server
+        _metrics_server = start_metrics_server(METRICS_LISTEN, METRICS_PORT)
+
+    # Resume queues left by a restart or a crashed replica (Mongo backend)
+    async def resume_worker(user_id: int):
+        await start_worker(user_id, application)
+
+    user_queue.get_queue_backend().start(resume_worker)
+
+async def on_shutdown(application: Application):
+    """Flush pending writes and release shared resources once the bot has stopped."""
+    if _janitor_task:
+        _janitor_task.cancel()
+    if _metrics_server:
+        _metrics_server.stop()
+    await user_queue.get_queue_backend().stop()
+    await summary_scheduler.stop()
+    await session_compactor.stop()
+    contract_renderer.shutdown()
+    await write_buffer.stop()
+    await training_sink.stop()
+    await close_client()
+    await close_ai_client()
+    logger.info("Mongo and AI clients closed.")
+
 # Initialize the Telegram bot application
-app = Application.builder().token(BOT_TOKEN).build()
+app = (
+    Application.builder()
+    .token(BOT_TOKEN)
+    .concurrent_updates(CONCURRENT_UPDATES if BOT_MODE == "webhook" else False)
+    .post_init(on_startup)
+    .post_shutdown(on_shutdown)
+    .build()
+)
 
 # Placeholder for handler registration
 def register_handlers(application: Application):
     logger.debug("Registering handlers...")
     application.add_handler(start_handler)
+    application.add_handler(stats_handler)
     application.add_handler(message_handler)
 
 # Entry point to run the bot
 def run_bot():
     logger.info("Starting the bot...")
     register_handlers(app)
-    app.run_polling()
\ No newline at end of file
+    register_metrics()
+    if BOT_MODE == "webhook":
+        # Recorded updates can also be POSTed straight to the local server:
+        #   curl -X POST http://127.0.0.1:8443/telegram \
+        #        -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+        #        -H "Content-Type: application/json" -d @update.json
+        url_path = WEBHOOK_PATH.strip("/")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=url_path,
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        app.run_polling()
\ No newline at end of file
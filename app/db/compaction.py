@@ -0,0 +1,311 @@
+import asyncio
+import os
+import zlib
+from datetime import datetime, timedelta
+import bson
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DeleteOne, ReplaceOne
+from pymongo.errors import OperationFailure, PyMongoError
+from config.logger import logger
+from config.metrics import metrics
+from app.db.mongo_client import (
+    db,
+    users_collection,
+    sessions_collection,
+    sessions_archive_collection,
+    messages_collection,
+    counters_collection,
+)
+from app.db.session_cache import user_cache
+from app.db.write_behind import write_buffer
+
+load_dotenv()
+
+COMPACTION_ENABLED = os.getenv("COMPACTION_ENABLED", "true").lower() == "true"
+COMPACTION_INTERVAL = float(os.getenv("COMPACTION_INTERVAL", "3600"))       # seconds between passes
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", "100"))
+COMPACTION_BATCH_PAUSE = float(os.getenv("COMPACTION_BATCH_PAUSE", "1.0"))  # throttle between batches
+# Completed sessions are archived this long after they ended
+COMPACTION_COMPLETED_AFTER_HOURS = float(os.getenv("COMPACTION_COMPLETED_AFTER_HOURS", "24"))
+# Active sessions nobody has written to for this long are archived too
+COMPACTION_STALE_ACTIVE_DAYS = float(os.getenv("COMPACTION_STALE_ACTIVE_DAYS", "30"))
+
+# TTL policies (0 keeps documents forever)
+ARCHIVE_TTL_DAYS = int(os.getenv("ARCHIVE_TTL_DAYS", "365"))
+MESSAGES_TTL_DAYS = int(os.getenv("MESSAGES_TTL_DAYS", "0"))
+
+CHECKPOINT_ID = "session_compaction"
+
+# Copied uncompressed into the archive so they stay queryable
+ARCHIVE_FIELDS = (
+    "user_id", "status", "start_time", "end_time", "updated_at",
+    "message_count", "user_message_count", "summarized_count",
+    "partial_summary", "partial_summary_updated_at", "final_summary", "final_summary_created_at",
+)
+
+
+def pack_history(history: list) -> bytes:
+    return zlib.compress(bson.encode({"history": history}), 6)
+
+
+def unpack_history(archived: dict) -> list:
+    """The history of an archived session document."""
+    return bson.decode(zlib.decompress(archived["history_z"]))["history"]
+
+
+async def _ensure_ttl(collection, field: str, days: int):
+    """Create a TTL index on `field`, or change its expiry if it already exists."""
+    if days <= 0:
+        return
+    seconds = int(days * 86400)
+    name = f"{field}_ttl"
+    try:
+        await collection.create_index([(field, ASCENDING)], name=name, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        if e.code not in (85, 86):  # IndexOptionsConflict / IndexKeySpecsConflict
+            raise
+        await db.command("collMod", collection.name, index={"name": name, "expireAfterSeconds": seconds})
+    logger.info("⏳ TTL on %s.%s: %s days", collection.name, field, days)
+
+
+class SessionCompactor:
+    """
+    Moves finished sessions out of the hot `sessions` collection.
+
+    Completed sessions (COMPACTION_COMPLETED_AFTER_HOURS after they ended)
+    and active sessions nobody has written to for COMPACTION_STALE_ACTIVE_DAYS
+    are copied to `sessions_archive` with their summaries and metadata
+    intact and the history zlib-compressed, then deleted from `sessions`.
+    Work runs in batches of COMPACTION_BATCH_SIZE with a pause in between;
+    the last session id handled is checkpointed in `counters`, so a restart
+    resumes the pass where it stopped. The archive (and optionally the
+    message log) expires through TTL indexes.
+    """
+
+    def __init__(
+        self,
+        interval: float = COMPACTION_INTERVAL,
+        batch_size: int = COMPACTION_BATCH_SIZE,
+        batch_pause: float = COMPACTION_BATCH_PAUSE
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._task: asyncio.Task | None = None
+        self._running = False
+
+        self.metrics = {
+            "passes": 0,
+            "batches": 0,
+            "sessions_archived": 0,
+            "sessions_skipped": 0,
+            "bytes_reclaimed": 0,
+            "archive_bytes": 0,
+            "failed_batches": 0,
+        }
+
+    def _cutoffs(self) -> tuple[datetime, datetime]:
+        now = datetime.utcnow()
+        return (
+            now - timedelta(hours=COMPACTION_COMPLETED_AFTER_HOURS),
+            now - timedelta(days=COMPACTION_STALE_ACTIVE_DAYS),
+        )
+
+    async def _checkpoint(self) -> dict:
+        return await counters_collection.find_one({"_id": CHECKPOINT_ID}) or {}
+
+    async def _save_checkpoint(self, last_id, archived: int = 0, reclaimed: int = 0, archive_bytes: int = 0):
+        await counters_collection.update_one(
+            {"_id": CHECKPOINT_ID},
+            {
+                "$set": {"last_id": last_id, "updated_at": datetime.utcnow()},
+                "$inc": {"sessions_archived": archived, "bytes_reclaimed": reclaimed, "archive_bytes": archive_bytes},
+            },
+            upsert=True
+        )
+
+    async def compact_batch(self, after_id=None, dry_run: bool = False) -> tuple[dict, object]:
+        """
+        Archive the next batch of eligible sessions with _id > `after_id`.
+        Returns the batch report and the last _id scanned (None once the
+        pass has reached the end of the collection).
+        """
+        completed_before, stale_before = self._cutoffs()
+        query = {
+            "$or": [
+                {"status": "completed", "end_time": {"$lt": completed_before}},
+                {"status": "active", "start_time": {"$lt": stale_before}},
+            ]
+        }
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+        cursor = sessions_collection.find(query).sort("_id", ASCENDING).limit(self.batch_size)
+        sessions = await cursor.to_list(self.batch_size)
+
+        report = {"scanned": len(sessions), "archived": 0, "skipped": 0, "bytes_reclaimed": 0, "archive_bytes": 0}
+        archives, deletes, sizes = [], [], {}
+        for session in sessions:
+            if session["status"] == "active" and (
+                (session.get("updated_at") or session["start_time"]) >= stale_before
+                or write_buffer.pending_messages(session["_id"])
+            ):
+                report["skipped"] += 1
+                continue
+            history_z = pack_history(session.get("history", []))
+            archived = {field: session[field] for field in ARCHIVE_FIELDS if field in session}
+            archived.update(_id=session["_id"], archived_at=datetime.utcnow(), history_z=bson.Binary(history_z))
+            sizes[session["_id"]] = (len(bson.encode(session)), len(bson.encode(archived)))
+            archives.append(ReplaceOne({"_id": session["_id"]}, archived, upsert=True))
+            # Only delete what we archived: a message pushed meanwhile keeps the session hot
+            deletes.append(DeleteOne({"_id": session["_id"], "message_count": session.get("message_count")}))
+
+        last_id = sessions[-1]["_id"] if len(sessions) == self.batch_size else None
+        if dry_run or not archives:
+            report["archived"] = len(archives)
+            report["bytes_reclaimed"] = sum(hot for hot, _ in sizes.values())
+            report["archive_bytes"] = sum(cold for _, cold in sizes.values())
+            return report, last_id
+
+        # Archive first (idempotent upserts), so a crash in between leaves a copy in both places, never none
+        await sessions_archive_collection.bulk_write(archives, ordered=False)
+        for session in sessions:
+            if session["_id"] in sizes and session["status"] == "active":
+                # Stale active session: unlink it first so the user's next message starts a fresh one
+                await users_collection.update_one(
+                    {"user_id": session.get("user_id"), "current_session_id": session["_id"]},
+                    {"$unset": {"current_session_id": ""}}
+                )
+                cached = user_cache.get(session.get("user_id"))
+                if cached is not None and cached.get("current_session_id") == session["_id"]:
+                    user_cache.unset(session["user_id"], "current_session_id")
+        await sessions_collection.bulk_write(deletes, ordered=False)
+        kept = {doc["_id"] for doc in await sessions_collection.find(
+            {"_id": {"$in": list(sizes)}}, {"_id": 1}
+        ).to_list(None)}
+        if kept:
+            await sessions_archive_collection.delete_many({"_id": {"$in": list(kept)}})
+
+        for session_id, (hot, cold) in sizes.items():
+            if session_id in kept:
+                continue
+            report["archived"] += 1
+            report["bytes_reclaimed"] += hot
+            report["archive_bytes"] += cold
+        report["skipped"] += len(kept)
+        return report, last_id
+
+    async def run_pass(self, dry_run: bool = False) -> dict:
+        """One throttled pass over the collection, resuming from the checkpoint."""
+        totals = {"scanned": 0, "archived": 0, "skipped": 0, "bytes_reclaimed": 0, "archive_bytes": 0}
+        last_id = None if dry_run else (await self._checkpoint()).get("last_id")
+        if last_id is not None:
+            logger.info("🗜️ Resuming session compaction after %s", last_id)
+        while True:
+            try:
+                report, last_id = await self.compact_batch(last_id, dry_run=dry_run)
+            except PyMongoError as e:
+                self.metrics["failed_batches"] += 1
+                logger.error("❌ Session compaction batch failed, will resume next pass: %s", e)
+                break
+            for key, value in report.items():
+                totals[key] += value
+            if not dry_run:
+                self.metrics["batches"] += 1
+                self.metrics["sessions_archived"] += report["archived"]
+                self.metrics["sessions_skipped"] += report["skipped"]
+                self.metrics["bytes_reclaimed"] += report["bytes_reclaimed"]
+                self.metrics["archive_bytes"] += report["archive_bytes"]
+                if report["archived"]:
+                    metrics.count("sessions_archived", report["archived"])
+                await self._save_checkpoint(last_id, report["archived"], report["bytes_reclaimed"], report["archive_bytes"])
+            if last_id is None:
+                break
+            await asyncio.sleep(self.batch_pause)
+
+        self.metrics["passes"] += 1
+        logger.info(
+            "🗜️ Session compaction%s: archived %s of %s scanned sessions, reclaimed %.1f KB from sessions "
+            "(archived copies %.1f KB)",
+            " (dry run)" if dry_run else "", totals["archived"], totals["scanned"],
+            totals["bytes_reclaimed"] / 1024, totals["archive_bytes"] / 1024
+        )
+        return totals
+
+    async def ensure_ttl_indexes(self):
+        await _ensure_ttl(sessions_archive_collection, "archived_at", ARCHIVE_TTL_DAYS)
+        await _ensure_ttl(messages_collection, "created_at", MESSAGES_TTL_DAYS)
+
+    async def _run(self):
+        try:
+            await self.ensure_ttl_indexes()
+        except PyMongoError as e:
+            logger.error("❌ Could not apply TTL indexes: %s", e)
+        while True:
+            self._running = True
+            try:
+                with metrics.timer("session_compaction"):
+                    await self.run_pass()
+            finally:
+                self._running = False
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the periodic compaction loop on the running loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                "🗜️ Session compaction started (every %ss, batches of %s)", self.interval, self.batch_size
+            )
+
+    async def stop(self):
+        """Stop between batches; the checkpoint lets the next start resume."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {**self.metrics, "running": self._running}
+
+
+async def collection_sizes() -> dict:
+    """Logical data size and storage size of the hot and archive collections, in bytes."""
+    sizes = {}
+    for collection in (sessions_collection, sessions_archive_collection):
+        stats = await db.command("collStats", collection.name)
+        sizes[collection.name] = {"size": stats.get("size", 0), "storage_size": stats.get("storageSize", 0)}
+    return sizes
+
+
+# Shared instance started by the bot
+session_compactor = SessionCompactor()
+
+
+async def _main(dry_run: bool):
+    """One pass from the command line, with collection sizes before and after."""
+    from app.db.mongo_client import close_client
+
+    try:
+        before = await collection_sizes()
+        if not dry_run:
+            await session_compactor.ensure_ttl_indexes()
+        totals = await session_compactor.run_pass(dry_run=dry_run)
+        after = await collection_sizes()
+        print(f"{'dry run: would archive' if dry_run else 'archived'} {totals['archived']} of {totals['scanned']} "
+              f"scanned sessions ({totals['skipped']} skipped)")
+        print(f"bytes reclaimed from sessions: {totals['bytes_reclaimed']:,} "
+              f"(archived copies: {totals['archive_bytes']:,})")
+        for name in before:
+            print(f"{name:17} size {before[name]['size']:>14,} → {after[name]['size']:>14,} bytes, "
+                  f"storage {before[name]['storage_size']:>14,} → {after[name]['storage_size']:>14,} bytes")
+    finally:
+        await close_client()
+
+
+if __name__ == "__main__":
+    import sys
+
+    asyncio.run(_main("--dry-run" in sys.argv[1:]))
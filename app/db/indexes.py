@@ -0,0 +1,146 @@
+"""
+Index provisioning and query-plan checks.
+
+ensure_indexes() runs at startup and creates every index the bot's
+queries rely on (create_indexes is a no-op for indexes that already
+exist). The check mode runs explain() on each query shape the bot issues
+and flags any that would scan a whole collection:
+
+    python -m app.db.indexes            # create missing indexes
+    python -m app.db.indexes --check    # explain every query shape, exit 1 on a COLLSCAN
+"""
+import asyncio
+import os
+import sys
+from dotenv import load_dotenv
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from config.logger import logger
+from app.db.mongo_client import (
+    users_collection,
+    summaries_collection,
+    sessions_collection,
+    sessions_archive_collection,
+    messages_collection,
+    work_items_collection,
+    training_data,
+)
+
+load_dotenv()
+
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true"
+
+INDEXES = {
+    users_collection: [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    sessions_collection: [
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_id_status"),
+        IndexModel([("status", ASCENDING), ("_id", ASCENDING)], name="status_id"),
+    ],
+    sessions_archive_collection: [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    messages_collection: [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("session_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+                   name="session_id_created_at_id"),
+    ],
+    summaries_collection: [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    work_items_collection: [
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("seq", ASCENDING)], name="user_id_status_seq"),
+        IndexModel([("status", ASCENDING), ("user_id", ASCENDING)], name="status_user_id"),
+    ],
+    training_data: [
+        IndexModel([("batch", ASCENDING), ("status", ASCENDING)], name="batch_status"),
+    ],
+}
+
+# (description, collection, filter, sort) for every query the bot sends; the
+# values are placeholders, only the shape matters to the planner
+QUERY_SHAPES = [
+    ("user by user_id", users_collection, {"user_id": 0}, None),
+    ("session by _id", sessions_collection, {"_id": ""}, None),
+    ("sessions of a user", sessions_collection, {"user_id": 0}, None),
+    ("active sessions of a user", sessions_collection, {"user_id": 0, "status": "active"}, None),
+    ("compaction candidates", sessions_collection,
+     {"_id": {"$gt": ""}, "$or": [{"status": "completed", "end_time": {"$lt": 0}},
+                                  {"status": "active", "start_time": {"$lt": 0}}]}, [("_id", ASCENDING)]),
+    ("archived sessions of a user", sessions_archive_collection, {"user_id": 0}, None),
+    ("message log of a user", messages_collection, {"user_id": 0}, None),
+    ("message log of a session", messages_collection,
+     {"session_id": "", "created_at": {"$gte": 0}}, [("created_at", ASCENDING), ("_id", ASCENDING)]),
+    ("summary of a user", summaries_collection, {"user_id": 0}, None),
+    ("pending item of a user", work_items_collection, {"user_id": 0, "status": "pending"}, [("seq", ASCENDING)]),
+    ("in-flight items of a user", work_items_collection,
+     {"user_id": 0, "status": "processing", "owner": {"$ne": ""}}, None),
+    ("users with queued items", work_items_collection, {"status": {"$in": ["pending", "processing"]}}, None),
+    ("training batch by status", training_data, {"batch": 1, "status": "raw"}, None),
+]
+
+
+async def ensure_indexes() -> dict:
+    """Create missing indexes; returns {collection: [index names]}. Failures are logged, not raised."""
+    created = {}
+    for collection, models in INDEXES.items():
+        try:
+            created[collection.name] = await collection.create_indexes(models)
+        except PyMongoError as e:
+            # e.g. duplicate user_id values block the unique index, or an index
+            # with the same keys exists under another name
+            logger.error("❌ Could not create indexes on %s: %s", collection.name, e)
+    logger.info("🗂️ Mongo indexes ensured: %s", created)
+    return created
+
+
+def _stages(plan: dict):
+    """Every stage name in an explain() plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        yield from _stages(plan.get(key))
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+async def check_query_plans() -> list[dict]:
+    """Explain each query shape; `collscan` is True when the winning plan scans the collection."""
+    results = []
+    for description, collection, query, sort in QUERY_SHAPES:
+        cursor = collection.find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained = await cursor.explain()
+        winning = explained.get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(_stages(winning))
+        results.append({
+            "query": description,
+            "collection": collection.name,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return results
+
+
+async def _main(check: bool) -> int:
+    from app.db.mongo_client import close_client
+
+    try:
+        if not check:
+            await ensure_indexes()
+            return 0
+        results = await check_query_plans()
+        for result in results:
+            flag = "❌ COLLSCAN" if result["collscan"] else "✅"
+            print(f"{flag:11} {result['collection']:14} {result['query']:28} {' → '.join(result['stages'])}")
+        return 1 if any(result["collscan"] for result in results) else 0
+    finally:
+        await close_client()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main("--check" in sys.argv[1:])))
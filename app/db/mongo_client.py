@@ -1,4 +1,4 @@
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
 import os
 from dotenv import load_dotenv
 
@@ -8,13 +8,39 @@ MONGO_URI = os.getenv("MONGO_URI")
 if not MONGO_URI:
     raise ValueError("MONGO_URI not found in .env")
 
-client = MongoClient(MONGO_URI)
+# Connection pool tuning (all optional)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+client = AsyncMongoClient(
+    MONGO_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+)
 
 db = client["ejar_bot"]  # or "sukoon_db" if that's your DB
 
 # Collections
 users_collection = db["users"]
 summaries_collection = db["summaries"]
-sessions_collection = db["sessions"]  
+sessions_collection = db["sessions"]
+sessions_archive_collection = db["sessions_archive"]  # compacted sessions, history zlib-compressed
+messages_collection = db["messages"]  # full message log; sessions keep only a bounded tail
+
+# Distributed per-user work queue (QUEUE_BACKEND=mongo)
+work_items_collection = db["work_items"]
+queue_leases_collection = db["queue_leases"]
+
+training_data = db["training_data"]
+counters_collection = db["counters"]
+
 
-training_data = db["training_data"]
\ No newline at end of file
+async def close_client():
+    """Close the Mongo client and release pooled connections."""
+    await client.close()
@@ -0,0 +1,95 @@
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "900"))
+
+
+class SessionCache:
+    """
+    In-process LRU cache of user documents keyed by user_id.
+
+    Entries expire after `ttl` seconds without being touched, and the least
+    recently used entry is dropped once `max_size` is reached. The cache only
+    stays correct because every mutator in user_data.py writes through it.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_MAX_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int):
+        """Return the cached user document, or None on a miss."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        touched_at, doc = entry
+        if time.monotonic() - touched_at > self.ttl:
+            del self._entries[user_id]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries[user_id] = (time.monotonic(), doc)
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return doc
+
+    def set(self, user_id: int, doc: dict):
+        """Store (or replace) the user document."""
+        self._entries[user_id] = (time.monotonic(), doc)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, user_id: int, fields: dict):
+        """Merge fields into a cached document; no-op if it isn't cached."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry[1].update(fields)
+
+    def unset(self, user_id: int, *keys: str):
+        """Remove keys from a cached document; no-op if it isn't cached."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            for key in keys:
+                entry[1].pop(key, None)
+
+    def invalidate(self, user_id: int):
+        """Drop a user from the cache."""
+        self._entries.pop(user_id, None)
+
+    def evict_expired(self) -> int:
+        """Drop every idle entry; returns how many were removed."""
+        now = time.monotonic()
+        expired = [uid for uid, (touched_at, _) in self._entries.items() if now - touched_at > self.ttl]
+        for uid in expired:
+            del self._entries[uid]
+        self.evictions += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# Shared instance used by user_data.py
+user_cache = SessionCache()
@@ -1,17 +1,162 @@
+import asyncio
+import os
 from datetime import datetime
-from app.db.mongo_client import  training_data
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from config.logger import logger
+from app.db.mongo_client import training_data, counters_collection
 
-def store_for_training(prompt: str, completion: str):
-    total = training_data.count_documents({})
-    batch_number = (total // 200) + 1
+load_dotenv()
 
+TRAINING_BATCH_SIZE = 200
+TRAINING_FLUSH_SIZE = int(os.getenv("TRAINING_FLUSH_SIZE", "50"))
+TRAINING_FLUSH_INTERVAL = float(os.getenv("TRAINING_FLUSH_INTERVAL", "5"))
+
+COUNTER_ID = "training_data"
+
+
+class TrainingSink:
+    """
+    Buffers training records and writes them with insert_many.
+
+    Batch numbers come from an atomic counter document instead of counting
+    the collection: each flush reserves a block of sequence numbers with a
+    single $inc, and record N (0-based) lands in batch N // 200 + 1, the same
+    numbering store_for_training has always produced.
+    """
+
+    def __init__(self, flush_size: int = TRAINING_FLUSH_SIZE, flush_interval: float = TRAINING_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self._buffer: list[dict] = []
+        self._flush_lock = asyncio.Lock()
+        self._counter_ready = False
+
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+        self.metrics = {
+            "queued": 0,
+            "inserted": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+        }
+
+    def add(self, doc: dict):
+        """Queue a record; the batch number is assigned at flush time."""
+        self._buffer.append(doc)
+        self.metrics["queued"] += 1
+        if len(self._buffer) >= self.flush_size:
+            self._wakeup.set()
+
+    async def _ensure_counter(self):
+        """Seed the counter from the existing collection size, once."""
+        if self._counter_ready:
+            return
+        if await counters_collection.find_one({"_id": COUNTER_ID}) is None:
+            total = await training_data.count_documents({})
+            await counters_collection.update_one(
+                {"_id": COUNTER_ID},
+                {"$setOnInsert": {"seq": total}},
+                upsert=True
+            )
+            logger.info("🔢 Training counter seeded at %s", total)
+        self._counter_ready = True
+
+    async def _reserve(self, count: int) -> int:
+        """Reserve `count` sequence numbers; returns the first one."""
+        await self._ensure_counter()
+        counter = await counters_collection.find_one_and_update(
+            {"_id": COUNTER_ID},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"] - count
+
+    async def flush(self):
+        """Number and insert everything buffered so far."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            docs, self._buffer = self._buffer, []
+
+            try:
+                unnumbered = [doc for doc in docs if "batch" not in doc]
+                if unnumbered:
+                    first = await self._reserve(len(unnumbered))
+                    for offset, doc in enumerate(unnumbered):
+                        doc["batch"] = (first + offset) // TRAINING_BATCH_SIZE + 1
+
+                await training_data.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # insert_many set each _id in place, so a duplicate key means the
+                # record was stored by an earlier attempt; re-queue only real failures
+                failed_indexes = {
+                    err["index"] for err in e.details.get("writeErrors", []) if err.get("code") != 11000
+                }
+                failed = docs if e.details.get("writeConcernErrors") else [docs[i] for i in sorted(failed_indexes)]
+                self.metrics["inserted"] += len(docs) - len(failed)
+                if failed:
+                    self.metrics["failed_flushes"] += 1
+                    logger.error("❌ Training flush: %s of %s records failed, re-queueing them", len(failed), len(docs))
+                    self._buffer = failed + self._buffer
+                return
+            except Exception as e:
+                self.metrics["failed_flushes"] += 1
+                logger.error("❌ Training flush failed, re-queueing %s records: %s", len(docs), e)
+                # Records keep any batch number already assigned
+                self._buffer = docs + self._buffer
+                return
+
+            self.metrics["flushes"] += 1
+            self.metrics["inserted"] += len(docs)
+            logger.debug("🧠 Stored %s training records", len(docs))
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flusher on the running loop."""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out whatever is still buffered."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        logger.info("🧠 Training sink stopped: %s", self.stats())
+
+    def stats(self) -> dict:
+        return {**self.metrics, "pending": len(self._buffer)}
+
+
+# Shared instance used by the message handler
+training_sink = TrainingSink()
+
+
+async def store_for_training(prompt: str, completion: str, source: str = "ai"):
+    """Queue a prompt/completion pair; it is written off the reply path."""
     doc = {
         "prompt": prompt.strip(),
         "completion": completion.strip(),
         "timestamp": datetime.utcnow(),
-        "batch": batch_number,
         "status": "raw",
-        "source": "ai"
+        "source": source
     }
 
-    training_data.insert_one(doc)
+    training_sink.add(doc)
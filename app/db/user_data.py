@@ -1,15 +1,42 @@
 from datetime import datetime
+import os
 import uuid
-from app.db.mongo_client import users_collection, summaries_collection, sessions_collection
-
-
-def get_user_by_id(user_id: int):
-    """Return user document if exists."""
-    return users_collection.find_one({"user_id": user_id})
-
-
-def create_or_update_user(user_id: int, first_name: str = None, national_id: str = None, phone: str = None):
-    """Create or update user record."""
+from pymongo import ASCENDING, ReturnDocument
+from config.metrics import metrics
+from app.db.mongo_client import (
+    users_collection,
+    summaries_collection,
+    sessions_collection,
+    sessions_archive_collection,
+    messages_collection,
+)
+from app.db.session_cache import user_cache
+from app.db.write_behind import write_buffer, SESSION_HISTORY_MAX
+
+# How many recent messages a turn reads from the session
+HISTORY_FETCH_LIMIT = int(os.getenv("HISTORY_FETCH_LIMIT", "40"))
+
+
+async def get_user_by_id(user_id: int):
+    """Return user document if exists (served from the cache when possible)."""
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    with metrics.timer("mongo_user_read"):
+        user = await users_collection.find_one({"user_id": user_id})
+    if user:
+        user.update(write_buffer.pending_user_fields(user_id))
+        user_cache.set(user_id, user)
+    return user
+
+
+async def create_or_update_user(user_id: int, first_name: str = None, national_id: str = None, phone: str = None):
+    """
+    Create or update user record and refresh the cached document.
+    Known users are updated write-behind; unknown ones are upserted directly
+    so the cache can be seeded with the full document.
+    """
     user_data = {
         "user_id": user_id,
         "updated_at": datetime.utcnow(),
@@ -22,43 +49,72 @@ def create_or_update_user(user_id: int, first_name: str = None, national_id: str
     if phone:
         user_data["phone"] = phone
 
-    users_collection.update_one(
-        {"user_id": user_id},
-        {"$set": user_data, "$setOnInsert": {"created_at": datetime.utcnow()}},
-        upsert=True
-    )
-
-
-def get_partial_summary(user_id: int) -> str:
-    """Retrieve the current session's partial summary."""
-    session_id = get_current_session_id(user_id)
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        cached.update(user_data)
+        write_buffer.queue_user_update(user_id, user_data)
+        return cached
+
+    with metrics.timer("mongo_user_upsert"):
+        user = await users_collection.find_one_and_update(
+            {"user_id": user_id},
+            {"$set": user_data, "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    user_cache.set(user_id, user)
+    return user
+
+
+async def get_summary_state(user_id: int) -> dict:
+    """Return the current session's partial summary and how many history messages it covers."""
+    session_id = await get_current_session_id(user_id)
     if not session_id:
-        return None
+        return {"partial_summary": None, "summarized_count": 0}
+
+    session = await sessions_collection.find_one(
+        {"_id": session_id},
+        {"partial_summary": 1, "summarized_count": 1}
+    ) or {}
+    return {
+        "partial_summary": session.get("partial_summary"),
+        "summarized_count": session.get("summarized_count", 0),
+    }
 
-    session = sessions_collection.find_one({"_id": session_id})
-    return session.get("partial_summary")
 
-def update_partial_summary(user_id: int, summary: str):
-    """Update the partial summary for the current session."""
-    session_id = get_current_session_id(user_id)
+async def get_partial_summary(user_id: int) -> str:
+    """Retrieve the current session's partial summary."""
+    state = await get_summary_state(user_id)
+    return state["partial_summary"]
+
+async def update_partial_summary(user_id: int, summary: str, summarized_count: int = None, session_id: str = None):
+    """
+    Update the partial summary for the current session (or `session_id`),
+    optionally recording how many history messages it now covers.
+    """
+    session_id = session_id or await get_current_session_id(user_id)
     if not session_id:
         return
 
-    sessions_collection.update_one(
+    update_fields = {
+        "partial_summary": summary,
+        "partial_summary_updated_at": datetime.utcnow()
+    }
+    if summarized_count is not None:
+        update_fields["summarized_count"] = summarized_count
+
+    await sessions_collection.update_one(
         {"_id": session_id},
-        {"$set": {
-            "partial_summary": summary,
-            "partial_summary_updated_at": datetime.utcnow()
-        }}
+        {"$set": update_fields}
     )
 
 
 
 
 
-def get_user_profile(user_id: int):
+async def get_user_profile(user_id: int):
     """Return user profile for Claude (dict format)."""
-    user = get_user_by_id(user_id)
+    user = await get_user_by_id(user_id)
     if not user:
         return {}
 
@@ -69,7 +125,7 @@ def get_user_profile(user_id: int):
     }
 
 
-def create_new_session(user_id: int) -> str:
+async def create_new_session(user_id: int) -> str:
     """Create a new session for the user."""
     session_id = str(uuid.uuid4())
     session = {
@@ -79,48 +135,122 @@ def create_new_session(user_id: int) -> str:
         "end_time": None,
         "status": "active",
         "history": [],
+        "message_count": 0,
+        "user_message_count": 0,
     }
-    sessions_collection.insert_one(session)
-
-    users_collection.update_one(
-        {"user_id": user_id},
-        {"$set": {"current_session_id": session_id}}
-    )
+    with metrics.timer("mongo_session_create"):
+        await sessions_collection.insert_one(session)
+        await users_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"current_session_id": session_id}}
+        )
+    user_cache.update(user_id, {"current_session_id": session_id})
 
     return session_id
 
 
-def get_current_session_id(user_id: int) -> str:
+async def get_current_session_id(user_id: int) -> str:
     """Get current active session ID."""
-    user = get_user_by_id(user_id)
+    user = await get_user_by_id(user_id)
     return user.get("current_session_id") if user else None
 
 
-def get_current_session_history(user_id: int) -> list:
-    """Get the chat history from the current session."""
-    session_id = get_current_session_id(user_id)
+async def get_session_context(user_id: int, limit: int = HISTORY_FETCH_LIMIT) -> dict:
+    """
+    Read what a turn needs from the current session in one projected query:
+    the last `limit` messages, the message counters and the summary state.
+    """
+    context = {
+        "session_id": None,
+        "history": [],
+        "message_count": 0,
+        "user_message_count": 0,
+        "partial_summary": None,
+        "summarized_count": 0,
+    }
+    session_id = await get_current_session_id(user_id)
     if not session_id:
-        return []
+        return context
+
+    with metrics.timer("mongo_session_read"):
+        session, pending = await write_buffer.read_session(
+            session_id,
+            lambda: sessions_collection.find_one(
+                {"_id": session_id},
+                {
+                    "history": {"$slice": -limit},
+                    "message_count": 1,
+                    "user_message_count": 1,
+                    "partial_summary": 1,
+                    "summarized_count": 1,
+                    "flush_tokens": 1,  # tells write_buffer whether an unacknowledged push landed
+                }
+            )
+        )
+    session = session or {}
+    stored = session.get("history", [])
+    history = (stored + pending)[-limit:]
+
+    # Sessions written before the counters existed fall back to what we can see
+    stored_count = session.get("message_count", len(stored))
+    stored_user_count = session.get(
+        "user_message_count",
+        sum(1 for msg in stored if msg.get("role") == "user")
+    )
+    context.update(
+        session_id=session_id,
+        history=history,
+        message_count=stored_count + len(pending),
+        user_message_count=stored_user_count + sum(1 for msg in pending if msg.get("role") == "user"),
+        partial_summary=session.get("partial_summary"),
+        summarized_count=session.get("summarized_count", 0),
+    )
+    return context
+
+
+async def get_logged_messages(session_id: str, start: int, count: int) -> list:
+    """
+    `count` messages of a session starting at position `start`, read from
+    the full `messages` log for ranges that are no longer in the capped
+    `history`. Returns fewer if the log is behind.
+    """
+    session = await sessions_collection.find_one({"_id": session_id}, {"history_cleared_at": 1}) or {}
+    query = {"session_id": session_id}
+    if session.get("history_cleared_at"):
+        # Positions restart when the history is cleared; the log keeps the older messages
+        query["created_at"] = {"$gte": session["history_cleared_at"]}
+    cursor = (
+        messages_collection.find(query, {"role": 1, "content": 1, "tokens": 1})
+        .sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+        .skip(start)
+        .limit(count)
+    )
+    return [{k: v for k, v in doc.items() if k != "_id"} for doc in await cursor.to_list(length=count)]
 
-    session = sessions_collection.find_one({"_id": session_id})
-    return session.get("history", []) if session else []
 
+async def get_current_session_history(user_id: int, limit: int = SESSION_HISTORY_MAX) -> list:
+    """Get the most recent chat history from the current session."""
+    context = await get_session_context(user_id, limit=limit)
+    return context["history"]
 
-def append_message_to_current_session(user_id: int, message: dict):
-    """Append a message to the user's current active session."""
-    session_id = get_current_session_id(user_id)
+
+async def append_messages_to_current_session(user_id: int, messages: list):
+    """Queue several messages for the user's current session as one $push."""
+    session_id = await get_current_session_id(user_id)
     if not session_id:
-        session_id = create_new_session(user_id)
+        session_id = await create_new_session(user_id)
+
+    write_buffer.queue_session_push(session_id, messages, user_id=user_id)
 
-    sessions_collection.update_one(
-        {"_id": session_id},
-        {"$push": {"history": message}}
-    )
 
+async def append_message_to_current_session(user_id: int, message: dict):
+    """Append a message to the user's current active session."""
+    await append_messages_to_current_session(user_id, [message])
 
-def mark_session_completed(user_id: int, summary: str = None):
+
+async def mark_session_completed(user_id: int, summary: str = None):
     """Mark the current session as completed and unlink it from user."""
-    session_id = get_current_session_id(user_id)
+    session_id = await get_current_session_id(user_id)
     if not session_id:
         return
 
@@ -133,52 +263,72 @@ def mark_session_completed(user_id: int, summary: str = None):
         update_fields["final_summary"] = summary
         update_fields["final_summary_created_at"] = datetime.utcnow()
 
-    sessions_collection.update_one(
+    await sessions_collection.update_one(
         {"_id": session_id},
         {"$set": update_fields}
     )
 
-    users_collection.update_one(
+    await users_collection.update_one(
         {"user_id": user_id},
         {"$unset": {"current_session_id": ""}}
     )
+    user_cache.unset(user_id, "current_session_id")
 
 
 
-def clear_current_session(user_id: int):
+async def clear_current_session(user_id: int):
     """Remove history content from current session without ending it."""
-    session_id = get_current_session_id(user_id)
+    session_id = await get_current_session_id(user_id)
     if not session_id:
         return
 
-    sessions_collection.update_one(
+    await write_buffer.settle()
+    write_buffer.discard_session(session_id)
+    await sessions_collection.update_one(
         {"_id": session_id},
-        {"$set": {"history": []}}
+        {"$set": {
+            "history": [],
+            "message_count": 0,
+            "user_message_count": 0,
+            "summarized_count": 0,
+            "history_cleared_at": datetime.utcnow(),
+        }}
     )
 
 
-def delete_user_data(user_id: int):
+async def delete_user_data(user_id: int):
     """Delete all data related to a user (use with caution)."""
-    user = get_user_by_id(user_id)
+    user = await get_user_by_id(user_id)
     session_id = user.get("current_session_id") if user else None
 
+    # Drop queued writes so a late flush can't re-create the user
+    write_buffer.discard_user(user_id)
+    if session_id:
+        write_buffer.discard_session(session_id)
+    await write_buffer.settle()
+
     # Remove session
     if session_id:
-        sessions_collection.delete_one({"_id": session_id})
+        await sessions_collection.delete_one({"_id": session_id})
 
-    # Remove all sessions
-    sessions_collection.delete_many({"user_id": user_id})
+    # Remove all sessions (hot and archived) and their message log
+    await sessions_collection.delete_many({"user_id": user_id})
+    await sessions_archive_collection.delete_many({"user_id": user_id})
+    await messages_collection.delete_many({"user_id": user_id})
 
     # Remove summary
-    summaries_collection.delete_one({"user_id": user_id})
+    await summaries_collection.delete_one({"user_id": user_id})
 
     # Remove user
-    users_collection.delete_one({"user_id": user_id})
-def get_final_summary(user_id: int) -> str:
+    await users_collection.delete_one({"user_id": user_id})
+    user_cache.invalidate(user_id)
+
+
+async def get_final_summary(user_id: int) -> str:
     """Get the final summary if session is completed."""
-    session_id = get_current_session_id(user_id)
+    session_id = await get_current_session_id(user_id)
     if not session_id:
         return None
 
-    session = sessions_collection.find_one({"_id": session_id})
+    session = await sessions_collection.find_one({"_id": session_id})
     return session.get("final_summary")
@@ -0,0 +1,280 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from pymongo import ASCENDING, ReturnDocument
+from config.logger import logger
+from config.metrics import metrics
+from app.db.mongo_client import work_items_collection, queue_leases_collection
+from app.db.session_cache import user_cache
+from app.db.write_behind import write_buffer
+
+load_dotenv()
+
+QUEUE_LEASE_SECONDS = float(os.getenv("QUEUE_LEASE_SECONDS", "30"))
+QUEUE_HEARTBEAT_SECONDS = float(os.getenv("QUEUE_HEARTBEAT_SECONDS", "10"))
+QUEUE_RECOVERY_INTERVAL = float(os.getenv("QUEUE_RECOVERY_INTERVAL", "15"))
+# How long dequeue waits for a sequence number whose insert has not landed yet
+QUEUE_SEQ_GAP_WAIT = float(os.getenv("QUEUE_SEQ_GAP_WAIT", "2.0"))
+
+
+class MongoQueueBackend:
+    """
+    Per-user work queues stored in MongoDB, shared by every bot replica.
+
+    Each user has a lease document (`queue_leases`) holding a sequence
+    counter and the replica that currently owns the user's worker. Items in
+    `work_items` are numbered from that counter, so they are processed in
+    strict per-user FIFO order whichever replica enqueued them. Only the
+    lease owner dequeues; owners renew their leases with a heartbeat, and
+    a lease that expires (crashed replica) is taken over by the recovery
+    loop, which also returns the dead owner's in-flight item to pending.
+
+    Sequence numbers are allocated before the item is inserted, so seq N+1
+    can become visible before seq N; dequeue waits up to QUEUE_SEQ_GAP_WAIT
+    for the next number after the last one it handed out before skipping
+    it (an enqueuer that died between the two writes leaves a real gap).
+
+    The user cache and write-behind buffer are per process, so a worker
+    flushes the buffer before giving up a lease, and a replica that claims
+    a user last handled elsewhere drops its cached copy of that user.
+    """
+
+    name = "mongo"
+
+    def __init__(
+        self,
+        lease_seconds: float = QUEUE_LEASE_SECONDS,
+        heartbeat_seconds: float = QUEUE_HEARTBEAT_SECONDS,
+        recovery_interval: float = QUEUE_RECOVERY_INTERVAL
+    ):
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.recovery_interval = recovery_interval
+        self.replica_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self._owned: set[int] = set()
+        self._current: dict[int, object] = {}  # user_id -> _id of the item being processed
+        self._tasks: list[asyncio.Task] = []
+        self._spawn = None
+
+        self.metrics = {
+            "enqueued": 0,
+            "processed": 0,
+            "claims": 0,
+            "takeovers": 0,
+            "lost_leases": 0,
+            "seq_gaps_skipped": 0,
+        }
+
+    def _lease_deadline(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    # ── Queue operations ──────────────────────────────────────────────────────
+    async def enqueue(self, user_id: int, chat_id: int, first_name: str, message_text: str):
+        """Append an item to the user's queue with the next sequence number."""
+        lease = await queue_leases_collection.find_one_and_update(
+            {"_id": user_id},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        await work_items_collection.insert_one({
+            "user_id": user_id,
+            "seq": lease["seq"],
+            "chat_id": chat_id,
+            "first_name": first_name,
+            "text": message_text,
+            "status": "pending",
+            "created_at": datetime.utcnow(),
+        })
+        self.metrics["enqueued"] += 1
+        logger.info("📥 Queued message for user %s (seq %s)", user_id, lease["seq"])
+
+    async def claim_worker(self, user_id: int) -> bool:
+        """
+        Take the user's lease if it is free, expired or already ours.
+        Items left in flight by a previous owner go back to pending first.
+        """
+        now = datetime.utcnow()
+        previous = await queue_leases_collection.find_one_and_update(
+            {
+                "_id": user_id,
+                "$or": [
+                    {"owner": None},
+                    {"owner": self.replica_id},
+                    {"lease_expires_at": {"$lt": now}},
+                ],
+            },
+            {"$set": {"owner": self.replica_id, "lease_expires_at": self._lease_deadline()}},
+            return_document=ReturnDocument.BEFORE
+        )
+        if previous is None:
+            return False
+
+        self._owned.add(user_id)
+        self.metrics["claims"] += 1
+        if previous.get("owner") != self.replica_id and previous.get("last_owner") != self.replica_id:
+            # Another replica may have changed this user (e.g. started a session) since we cached it
+            user_cache.invalidate(user_id)
+        if previous.get("owner") != self.replica_id:
+            # Anything still "processing" belongs to a replica that died or shut down
+            result = await work_items_collection.update_many(
+                {"user_id": user_id, "status": "processing", "owner": {"$ne": self.replica_id}},
+                {"$set": {"status": "pending"}, "$unset": {"owner": ""}}
+            )
+            if result.modified_count:
+                self.metrics["takeovers"] += 1
+                logger.warning("♻️ Re-queued %s in-flight item(s) of user %s", result.modified_count, user_id)
+        return True
+
+    async def has_pending(self, user_id: int) -> bool:
+        item = await work_items_collection.find_one(
+            {"user_id": user_id, "status": "pending"},
+            {"_id": 1}
+        )
+        return item is not None
+
+    async def dequeue(self, user_id: int):
+        """
+        Claim the user's oldest pending item, or return None if there is
+        nothing to do or the lease was lost to another replica.
+        """
+        lease = await queue_leases_collection.find_one_and_update(
+            {"_id": user_id, "owner": self.replica_id},
+            {"$set": {"lease_expires_at": self._lease_deadline()}}
+        )
+        if lease is None:
+            self.metrics["lost_leases"] += 1
+            self._owned.discard(user_id)
+            logger.warning("⚠️ Lost queue lease for user %s", user_id)
+            return None
+
+        # Never jump over a seq that was allocated but whose insert is still on its way
+        last = lease.get("dequeued_seq")
+        give_up_at = asyncio.get_running_loop().time() + QUEUE_SEQ_GAP_WAIT
+        while True:
+            head = await work_items_collection.find_one(
+                {"user_id": user_id, "status": "pending"},
+                {"seq": 1},
+                sort=[("seq", ASCENDING)]
+            )
+            if head is None:
+                return None
+            if last is None or head["seq"] <= last + 1:
+                break
+            if asyncio.get_running_loop().time() >= give_up_at:
+                self.metrics["seq_gaps_skipped"] += 1
+                logger.warning("⚠️ Skipping missing seq %s..%s for user %s", last + 1, head["seq"] - 1, user_id)
+                break
+            await asyncio.sleep(0.05)
+
+        item = await work_items_collection.find_one_and_update(
+            {"_id": head["_id"], "status": "pending"},
+            {"$set": {"status": "processing", "owner": self.replica_id, "claimed_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if item is None:
+            return None
+        await queue_leases_collection.update_one(
+            {"_id": user_id, "owner": self.replica_id},
+            {"$max": {"dequeued_seq": item["seq"]}}
+        )
+
+        self._current[user_id] = item["_id"]
+        metrics.observe("queue_wait", (item["claimed_at"] - item["created_at"]).total_seconds())
+        logger.info("📤 Dequeued message for user %s (seq %s)", user_id, item["seq"])
+        return item["chat_id"], item["first_name"], item["text"]
+
+    async def mark_done(self, user_id: int):
+        item_id = self._current.pop(user_id, None)
+        if item_id is not None:
+            await work_items_collection.delete_one({"_id": item_id})
+            self.metrics["processed"] += 1
+
+    async def release_worker(self, user_id: int) -> bool:
+        """
+        Give up the lease. Returns True if items arrived in the meantime and
+        the lease was taken back, i.e. the caller should keep working.
+        """
+        self._owned.discard(user_id)
+        # An item we never marked done failed in the handler; drop it like the
+        # in-memory queue does rather than retrying it forever
+        item_id = self._current.pop(user_id, None)
+        if item_id is not None:
+            await work_items_collection.delete_one({"_id": item_id})
+        # The next owner may be another replica: its reads must see this user's writes
+        await write_buffer.flush()
+        if write_buffer.has_pending_for_user(user_id):
+            logger.warning("⚠️ Releasing user %s with writes still buffered (flush failed)", user_id)
+        await queue_leases_collection.update_one(
+            {"_id": user_id, "owner": self.replica_id},
+            {"$set": {"owner": None, "lease_expires_at": None, "last_owner": self.replica_id}}
+        )
+        # An enqueue on another replica may have lost the race against our lease
+        if await self.has_pending(user_id):
+            return await self.claim_worker(user_id)
+        return False
+
+    # ── Background loops ──────────────────────────────────────────────────────
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            if not self._owned:
+                continue
+            try:
+                await queue_leases_collection.update_many(
+                    {"_id": {"$in": list(self._owned)}, "owner": self.replica_id},
+                    {"$set": {"lease_expires_at": self._lease_deadline()}}
+                )
+            except Exception as e:
+                logger.error("❌ Queue lease heartbeat failed: %s", e)
+
+    async def _recover(self):
+        """Start workers for queued users whose lease is free or expired."""
+        while True:
+            try:
+                user_ids = await work_items_collection.distinct(
+                    "user_id", {"status": {"$in": ["pending", "processing"]}}
+                )
+                for user_id in user_ids:
+                    if user_id not in self._owned and self._spawn:
+                        await self._spawn(user_id)
+            except Exception as e:
+                logger.error("❌ Queue recovery scan failed: %s", e)
+            await asyncio.sleep(self.recovery_interval)
+
+    def start(self, spawn):
+        """
+        Start heartbeats and the recovery scan. `spawn(user_id)` is awaited
+        for each user that may need a worker on this replica.
+        """
+        self._spawn = spawn
+        self._tasks = [
+            asyncio.create_task(self._heartbeat()),
+            asyncio.create_task(self._recover()),
+        ]
+        logger.info("🌐 Mongo queue backend started as %s", self.replica_id)
+
+    async def stop(self):
+        """Stop background loops and hand our leases back."""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._owned:
+            await write_buffer.flush()
+            await queue_leases_collection.update_many(
+                {"_id": {"$in": list(self._owned)}, "owner": self.replica_id},
+                {"$set": {"owner": None, "lease_expires_at": None, "last_owner": self.replica_id}}
+            )
+            self._owned.clear()
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "backend": self.name,
+            "replica_id": self.replica_id,
+            "owned_leases": len(self._owned),
+        }
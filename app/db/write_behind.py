@@ -0,0 +1,335 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from config.logger import logger
+from config.metrics import metrics
+from app.db.mongo_client import users_collection, sessions_collection, messages_collection
+
+load_dotenv()
+
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))
+
+# Sessions keep only this many recent messages; the full log is in `messages`
+SESSION_HISTORY_MAX = int(os.getenv("SESSION_HISTORY_MAX", "50"))
+# Tokens of recent session pushes kept on the session, so a retried push is applied once
+FLUSH_TOKENS_KEPT = 20
+
+
+class WriteBehindBuffer:
+    """
+    Collects user upserts and session appends and writes them in bulk.
+
+    All writes queued for one user/session between two flushes are merged
+    into a single UpdateOne ($set for users, $push/$each for sessions), and
+    each flush sends one unordered bulk_write per collection. Session pushes
+    are capped at SESSION_HISTORY_MAX with $slice, bump the session's message
+    counters and copy every message into the `messages` log. A flush runs
+    when WRITE_BEHIND_MAX_BATCH operations are pending or every
+    WRITE_BEHIND_FLUSH_INTERVAL seconds, and once more on shutdown.
+
+    Session pushes are not idempotent, so each one carries a token that is
+    recorded on the session and excluded in its filter. Pushes that a
+    BulkWriteError reports as failed are re-queued normally. If the outcome
+    is unknown (e.g. the connection dropped), the same push is sent again
+    with the same token, and newer messages for that session wait until
+    it has been acknowledged. The log entries of such a push are kept for
+    the next message log insert rather than built again, since `history`
+    is capped and the log is the only full record.
+    """
+
+    def __init__(self, max_batch: int = WRITE_BEHIND_MAX_BATCH, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+
+        self._user_sets: dict[int, dict] = {}
+        self._session_pushes: dict[str, list[dict]] = {}
+        self._session_owners: dict[str, int] = {}
+        self._archive_retry: list[dict] = []  # message log docs not inserted yet
+        self._pending_ops = 0
+
+        # Writes handed to the current bulk_write, kept until it completes
+        self._inflight_users: dict[int, dict] = {}
+        self._inflight_sessions: dict[str, list[dict]] = {}
+        # Pushes whose bulk_write outcome is unknown: session_id -> (token, messages)
+        self._session_retry: dict[str, tuple[ObjectId, list[dict]]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._generation = 0  # bumped whenever a batch is handed to Mongo
+
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+        self.metrics = {
+            "queued_user_updates": 0,
+            "queued_messages": 0,
+            "flushes": 0,
+            "flushed_ops": 0,
+            "failed_flushes": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    # ── Queueing ──────────────────────────────────────────────────────────────
+    def queue_user_update(self, user_id: int, fields: dict):
+        """Merge $set fields into the pending upsert for this user."""
+        pending = self._user_sets.get(user_id)
+        if pending is None:
+            self._user_sets[user_id] = dict(fields)
+            self._pending_ops += 1
+        else:
+            pending.update(fields)
+        self.metrics["queued_user_updates"] += 1
+        self._maybe_wake()
+
+    def queue_session_push(self, session_id: str, messages: list[dict], user_id: int = None):
+        """Append messages to the pending $push for this session."""
+        if user_id is not None:
+            self._session_owners[session_id] = user_id
+        pending = self._session_pushes.get(session_id)
+        if pending is None:
+            self._session_pushes[session_id] = list(messages)
+            self._pending_ops += 1
+        else:
+            pending.extend(messages)
+        self.metrics["queued_messages"] += len(messages)
+        self._maybe_wake()
+
+    def _maybe_wake(self):
+        if self._pending_ops >= self.max_batch:
+            self._wakeup.set()
+
+    # ── Read-side overlay ─────────────────────────────────────────────────────
+    def pending_user_fields(self, user_id: int) -> dict:
+        """Fields queued for this user that Mongo may not have yet."""
+        fields = dict(self._inflight_users.get(user_id, {}))
+        fields.update(self._user_sets.get(user_id, {}))
+        return fields
+
+    def has_pending_for_user(self, user_id: int) -> bool:
+        """Whether anything queued for this user (or their sessions) is not in Mongo yet."""
+        if user_id in self._user_sets or user_id in self._inflight_users:
+            return True
+        return any(
+            self._session_owners.get(session_id) == user_id
+            for session_id in (*self._session_pushes, *self._session_retry, *self._inflight_sessions)
+        )
+
+    def pending_messages(self, session_id: str) -> list[dict]:
+        """Messages queued for this session that Mongo may not have yet."""
+        retry = self._session_retry.get(session_id)
+        return (list(retry[1]) if retry else []) + self._session_pushes.get(session_id, [])
+
+    async def read_session(self, session_id: str, read):
+        """
+        Await `read()` (a Mongo read of the session) and return it together
+        with the messages still queued for that session. Retries if a flush
+        of this session raced the read, so nothing is missed or doubled.
+        """
+        while True:
+            if session_id in self._inflight_sessions:
+                await self.settle()
+                continue
+            generation = self._generation
+            result = await read()
+            if generation == self._generation:
+                retry = self._session_retry.get(session_id)
+                if retry and result and retry[0] in result.get("flush_tokens", []):
+                    # The unacknowledged push did reach Mongo; nothing to resend
+                    del self._session_retry[session_id]
+                return result, self.pending_messages(session_id)
+
+    async def settle(self):
+        """Wait for the bulk write currently in flight (if any) to finish."""
+        async with self._flush_lock:
+            pass
+
+    def discard_user(self, user_id: int):
+        """Forget a pending upsert and message log entries (e.g. before deleting the user)."""
+        if self._user_sets.pop(user_id, None) is not None:
+            self._pending_ops -= 1
+        self._archive_retry = [doc for doc in self._archive_retry if doc.get("user_id") != user_id]
+
+    def discard_session(self, session_id: str):
+        """Forget pending appends (e.g. before clearing the history)."""
+        self._session_owners.pop(session_id, None)
+        self._session_retry.pop(session_id, None)
+        if self._session_pushes.pop(session_id, None) is not None:
+            self._pending_ops -= 1
+
+    # ── Flushing ──────────────────────────────────────────────────────────────
+    async def flush(self):
+        """Write everything queued so far with one bulk_write per collection."""
+        async with self._flush_lock:
+            if not self._user_sets and not self._session_pushes and not self._session_retry and not self._archive_retry:
+                return
+
+            # An unacknowledged push is resent as-is; newer messages for that session wait for it
+            retry, self._session_retry = self._session_retry, {}
+            tokens = {session_id: token for session_id, (token, _) in retry.items()}
+            self._inflight_sessions = {session_id: messages for session_id, (_, messages) in retry.items()}
+            for session_id in [s for s in self._session_pushes if s not in retry]:
+                tokens[session_id] = ObjectId()
+                self._inflight_sessions[session_id] = self._session_pushes.pop(session_id)
+            self._inflight_users, self._user_sets = self._user_sets, {}
+            self._pending_ops = len(self._session_pushes)
+            self._generation += 1
+
+            now = datetime.utcnow()
+            user_ops = [
+                UpdateOne(
+                    {"user_id": user_id},
+                    {"$set": fields, "$setOnInsert": {"created_at": now}},
+                    upsert=True
+                )
+                for user_id, fields in self._inflight_users.items()
+            ]
+            session_ops = []
+            message_docs = {}  # ids are fixed here so a retried insert can't duplicate
+            for session_id, messages in self._inflight_sessions.items():
+                user_messages = sum(1 for msg in messages if msg.get("role") == "user")
+                token = tokens[session_id]
+                session_ops.append(UpdateOne(
+                    {"_id": session_id, "flush_tokens": {"$ne": token}},
+                    {
+                        "$push": {
+                            "history": {"$each": messages, "$slice": -SESSION_HISTORY_MAX},
+                            "flush_tokens": {"$each": [token], "$slice": -FLUSH_TOKENS_KEPT},
+                        },
+                        "$inc": {"message_count": len(messages), "user_message_count": user_messages},
+                        "$set": {"updated_at": now},
+                    }
+                ))
+                if session_id not in retry:  # a resent push already has its log entries in _archive_retry
+                    user_id = self._session_owners.get(session_id)
+                    message_docs[session_id] = [
+                        {"_id": ObjectId(), "session_id": session_id, "user_id": user_id, "created_at": now, **msg}
+                        for msg in messages
+                    ]
+
+            started = time.perf_counter()
+            try:
+                if user_ops:
+                    await users_collection.bulk_write(user_ops, ordered=False)  # $set upserts: safe to resend
+                    self._inflight_users = {}
+            except Exception as e:
+                self.metrics["failed_flushes"] += 1
+                logger.error("❌ Write-behind flush failed, re-queueing %s ops: %s", len(user_ops) + len(session_ops), e)
+                self._requeue_inflight(retry, tokens, message_docs, failed=set(self._inflight_sessions))
+                return
+            try:
+                if session_ops:
+                    await sessions_collection.bulk_write(session_ops, ordered=False)
+            except BulkWriteError as e:
+                # Only the reported ops failed; the rest were applied and must not be resent
+                session_ids = list(self._inflight_sessions)
+                failed = {session_ids[err["index"]] for err in e.details.get("writeErrors", [])}
+                self.metrics["failed_flushes"] += 1
+                logger.error("❌ Write-behind flush: %s of %s session pushes failed, re-queueing them",
+                             len(failed), len(session_ops))
+                if e.details.get("writeConcernErrors"):
+                    failed = set()  # outcome unknown for all: resend with the same tokens
+                self._requeue_inflight(retry, tokens, message_docs, failed)
+                return
+            except Exception as e:
+                self.metrics["failed_flushes"] += 1
+                logger.error("❌ Write-behind flush failed, will resend %s session pushes: %s", len(session_ops), e)
+                self._requeue_inflight(retry, tokens, message_docs, failed=set())
+                return
+            for session_id in self._inflight_sessions:
+                if session_id not in self._session_pushes:
+                    self._session_owners.pop(session_id, None)
+            self._inflight_sessions = {}
+
+            await self._write_archive(self._archive_retry + [doc for docs in message_docs.values() for doc in docs])
+
+            self.metrics["flushes"] += 1
+            self.metrics["flushed_ops"] += len(user_ops) + len(session_ops)
+            self.metrics["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            metrics.observe("mongo_flush", time.perf_counter() - started)
+            logger.debug(
+                "💾 Write-behind flushed %s user / %s session ops in %s ms",
+                len(user_ops), len(session_ops), self.metrics["last_flush_ms"]
+            )
+
+    async def _write_archive(self, docs: list):
+        """Insert into the message log; failed inserts are retried next flush."""
+        self._archive_retry = []
+        if not docs:
+            return
+        try:
+            await messages_collection.bulk_write([InsertOne(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys mean an earlier attempt already stored the message
+            failed = [docs[err["index"]] for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            self._archive_retry = docs if e.details.get("writeConcernErrors") else failed
+        except Exception as e:
+            logger.error("❌ Message log insert failed, retrying %s messages next flush: %s", len(docs), e)
+            self._archive_retry = docs
+
+    def _requeue_inflight(self, retry: dict, tokens: dict, message_docs: dict, failed: set):
+        """
+        Put a failed batch back in front of anything queued since. Session
+        pushes in `failed` were definitely not applied and are merged back
+        into the queue (their log entries are built again when they are
+        sent); the others (and any that were already being resent) may have
+        been applied, so they are resent with the same token and their log
+        entries go to the next message log insert.
+        """
+        for user_id, fields in self._inflight_users.items():
+            fields.update(self._user_sets.get(user_id, {}))
+            self._user_sets[user_id] = fields
+        for session_id, messages in self._inflight_sessions.items():
+            if session_id in failed and session_id not in retry:
+                self._session_pushes[session_id] = messages + self._session_pushes.get(session_id, [])
+            else:
+                self._session_retry[session_id] = (tokens[session_id], messages)
+                self._archive_retry.extend(message_docs.get(session_id, []))
+        self._inflight_users = {}
+        self._inflight_sessions = {}
+        self._pending_ops = len(self._user_sets) + len(self._session_pushes)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flusher on the running loop."""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                "💾 Write-behind started (max_batch=%s, interval=%ss)", self.max_batch, self.flush_interval
+            )
+
+    async def stop(self):
+        """Stop the flusher and write out whatever is still queued."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        logger.info("💾 Write-behind stopped: %s", self.stats())
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "pending_user_updates": len(self._user_sets),
+            "pending_sessions": len(self._session_pushes),
+            "pending_messages": sum(len(m) for m in self._session_pushes.values()),
+            "unacknowledged_sessions": len(self._session_retry),
+        }
+
+
+# Shared instance used by user_data.py
+write_buffer = WriteBehindBuffer()
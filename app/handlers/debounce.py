@@ -0,0 +1,106 @@
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The wait after a message is the user's typical gap between messages in a
+# burst × DEBOUNCE_GAP_MULTIPLIER, kept within [MIN, MAX]
+DEBOUNCE_INITIAL_SECONDS = float(os.getenv("DEBOUNCE_INITIAL_SECONDS", "1.0"))
+DEBOUNCE_MIN_SECONDS = float(os.getenv("DEBOUNCE_MIN_SECONDS", "0.3"))
+DEBOUNCE_MAX_SECONDS = float(os.getenv("DEBOUNCE_MAX_SECONDS", "2.5"))
+DEBOUNCE_GAP_MULTIPLIER = float(os.getenv("DEBOUNCE_GAP_MULTIPLIER", "1.5"))
+DEBOUNCE_EWMA_ALPHA = float(os.getenv("DEBOUNCE_EWMA_ALPHA", "0.3"))
+# A flush that caught a single message shrinks the user's wait by this factor
+DEBOUNCE_SOLO_DECAY = float(os.getenv("DEBOUNCE_SOLO_DECAY", "0.8"))
+DEBOUNCE_IDLE_TTL_SECONDS = float(os.getenv("DEBOUNCE_IDLE_TTL_SECONDS", "1800"))
+
+
+class AdaptiveDebounce:
+    """
+    Learns how long to wait for follow-up messages, per user.
+
+    Gaps between messages that belong to one burst (no reply in between,
+    shorter than twice the maximum wait) feed an EWMA of the user's typing
+    cadence; the wait is that cadence times a safety multiplier. A flush
+    that caught only one message means nobody was typing on, so that
+    user's wait decays toward the minimum. Users we know nothing about get
+    DEBOUNCE_INITIAL_SECONDS.
+    """
+
+    def __init__(
+        self,
+        initial: float = DEBOUNCE_INITIAL_SECONDS,
+        minimum: float = DEBOUNCE_MIN_SECONDS,
+        maximum: float = DEBOUNCE_MAX_SECONDS,
+        multiplier: float = DEBOUNCE_GAP_MULTIPLIER,
+        alpha: float = DEBOUNCE_EWMA_ALPHA,
+        solo_decay: float = DEBOUNCE_SOLO_DECAY
+    ):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.alpha = alpha
+        self.solo_decay = solo_decay
+        self._users: dict[int, list] = {}  # user_id -> [typical gap, last message at (None after a reply), last seen]
+
+        self.metrics = {
+            "messages": 0,
+            "gaps_learned": 0,
+            "solo_flushes": 0,
+            "batched_flushes": 0,
+        }
+
+    def _clamp(self, seconds: float) -> float:
+        return min(self.maximum, max(self.minimum, seconds))
+
+    def on_message(self, user_id: int) -> float:
+        """Record a message and return how long to wait before flushing."""
+        now = time.monotonic()
+        self.metrics["messages"] += 1
+        state = self._users.get(user_id)
+        if state is None:
+            self._users[user_id] = [self.initial / self.multiplier, now, now]
+            return self._clamp(self.initial)
+
+        if state[1] is not None and now - state[1] < 2 * self.maximum:
+            state[0] += self.alpha * (now - state[1] - state[0])
+            self.metrics["gaps_learned"] += 1
+        state[1] = state[2] = now
+        return self._clamp(state[0] * self.multiplier)
+
+    def on_flush(self, user_id: int, message_count: int):
+        """Record how many messages a flush combined."""
+        state = self._users.get(user_id)
+        if message_count > 1:
+            self.metrics["batched_flushes"] += 1
+        else:
+            self.metrics["solo_flushes"] += 1
+            if state is not None:
+                state[0] = max(self.minimum / self.multiplier, state[0] * self.solo_decay)
+
+    def on_reply(self, user_id: int):
+        """The user got an answer; their next message starts a new burst."""
+        state = self._users.get(user_id)
+        if state is not None:
+            state[1] = None
+
+    def evict_idle(self, idle_seconds: float = DEBOUNCE_IDLE_TTL_SECONDS) -> int:
+        now = time.monotonic()
+        idle = [user_id for user_id, state in self._users.items() if now - state[2] > idle_seconds]
+        for user_id in idle:
+            self._users.pop(user_id, None)
+        return len(idle)
+
+    def stats(self) -> dict:
+        waits = [self._clamp(state[0] * self.multiplier) for state in self._users.values()]
+        return {
+            **self.metrics,
+            "tracked_users": len(waits),
+            "avg_wait_s": round(sum(waits) / len(waits), 3) if waits else self.initial,
+        }
+
+
+# Shared instance used by the message handler
+debouncer = AdaptiveDebounce()
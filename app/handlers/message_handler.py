@@ -1,23 +1,44 @@
 import asyncio
-from telegram import Update
-from telegram.constants import ChatAction
+import os
+import time
+from telegram import InputFile, Update
 from telegram.ext import MessageHandler, ContextTypes, filters
 from config import queue as user_queue
 from config.logger import logger
+from config.metrics import metrics
 from app.db.training_storage import store_for_training
 from app.db.user_data import (
     create_or_update_user,
-    get_current_session_history,
-    append_message_to_current_session,
+    get_session_context,
+    append_messages_to_current_session,
     mark_session_completed,
-    update_partial_summary
+    get_current_session_id,
+    get_user_profile
 )
-from app.ai.agent import ask_ai_sync  # updated sync wrapper with streaming
+from app.ai.agent import ask_ai
+from app.ai.fast_path import fast_path, local_response
+from app.ai.faq_index import faq_index
+from app.ai.summarizer import summary_scheduler
+from app.ai.tokens import token_counter
+from app.handlers.streaming_reply import StreamingReply
+from app.handlers.outbound import outbound
+from app.handlers.debounce import debouncer
+from app.pdf.contract_pdf import contract_renderer
 
-# ── Debounce setup ─────────────────────────────────────────────────────────────
-DEBOUNCE_SECONDS = 1.0
+# Show replies while they are generated (set STREAM_REPLIES=false to send once done)
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() == "true"
+# Cancel a reply nobody has seen yet when the user sends more, and redo it with everything
+SUPERSEDE_INFLIGHT = os.getenv("SUPERSEDE_INFLIGHT", "true").lower() == "true"
+
+CONTRACT_FILENAME = "عقد_إيجار.pdf"
+
+# ── Debounce setup (the wait adapts to each user, see debounce.py) ─────────────
 _debounce_buffers: dict[int, list[str]] = {}
 _debounce_tasks:   dict[int, asyncio.Task] = {}
+_debounce_started: dict[int, float] = {}  # arrival of the first buffered message
+
+# AI calls in progress: user_id -> {"task", "text", "shown", "superseded"}
+_inflight_calls: dict[int, dict] = {}
 
 async def _flush_debounce(
     user_id: int,
@@ -27,31 +48,67 @@ async def _flush_debounce(
 ):
     """Send the buffered messages as one combined request."""
     msgs = _debounce_buffers.pop(user_id, [])
+    started = _debounce_started.pop(user_id, None)
     if not msgs:
         return
+    if started is not None:
+        metrics.observe("debounce", time.monotonic() - started)
+    debouncer.on_flush(user_id, len(msgs))
 
     combined_text = "\n".join(msgs)
-    logger.info(f"🔄 Debounced for user {user_id}: {len(msgs)} messages combined")
+    logger.info("🔄 Debounced for user %s: %s messages combined", user_id, len(msgs))
 
     # Enqueue combined text
-    await user_queue.enqueue_message(user_id, chat_id, first_name, combined_text)
-    if not user_queue.is_worker_running(user_id):
-        task = asyncio.create_task(process_user_queue(user_id, context))
-        user_queue.set_worker_task(user_id, task)
+    await user_queue.get_queue_backend().enqueue(user_id, chat_id, first_name, combined_text)
+    await start_worker(user_id, context)
+
+
+async def start_worker(user_id: int, context):
+    """
+    Start a queue worker for the user unless one is already running here
+    (or, with the Mongo backend, on another replica). `context` only needs
+    a `.bot`, so the Application itself works for recovered queues.
+    """
+    if user_queue.is_worker_running(user_id):
+        return
+    if not await user_queue.get_queue_backend().claim_worker(user_id):
+        return
+    if user_queue.is_worker_running(user_id):
+        return  # another flush for this user won the race while we awaited
+    task = asyncio.create_task(process_user_queue(user_id, context))
+    user_queue.set_worker_task(user_id, task)
+
+
+def get_debounce_stats() -> dict:
+    """Live debounce state counts for monitoring."""
+    return {
+        "buffers": len(_debounce_buffers),
+        "pending_flushes": len(_debounce_tasks),
+        "inflight_ai_calls": len(_inflight_calls),
+        **debouncer.stats(),
+    }
 
 async def _schedule_flush(
     user_id: int,
     chat_id: int,
     first_name: str,
-    context: ContextTypes.DEFAULT_TYPE
+    context: ContextTypes.DEFAULT_TYPE,
+    wait: float
 ):
-    """Wait for DEBOUNCE_SECONDS, then flush; cancel if a new message arrives."""
+    """Wait `wait` seconds, then flush; cancel if a new message arrives first."""
     try:
-        await asyncio.sleep(DEBOUNCE_SECONDS)
+        await asyncio.sleep(wait)
+        # Past this point a new message starts a new flush instead of cancelling this one
+        if _debounce_tasks.get(user_id) is asyncio.current_task():
+            _debounce_tasks.pop(user_id, None)
         await _flush_debounce(user_id, chat_id, first_name, context)
     except asyncio.CancelledError:
         # New message arrived—this flush is cancelled
         pass
+    finally:
+        # Forget the task once it is no longer the user's pending flush
+        if _debounce_tasks.get(user_id) is asyncio.current_task():
+            _debounce_tasks.pop(user_id, None)
 
 # ── Handlers ───────────────────────────────────────────────────────────────────
 
@@ -62,123 +119,235 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     first_name = user.first_name
     text    = update.message.text.strip()
 
-    # 1️⃣ Add incoming text to debounce buffer
+    # 1️⃣ Add incoming text to debounce buffer (steps 1-3 run before any await,
+    # so concurrent updates from one user keep their arrival order)
     buf = _debounce_buffers.setdefault(user_id, [])
     buf.append(text)
+    _debounce_started.setdefault(user_id, time.monotonic())
+    wait = debouncer.on_message(user_id)
 
     # 2️⃣ Cancel any existing scheduled flush
     prev_task = _debounce_tasks.get(user_id)
     if prev_task and not prev_task.done():
         prev_task.cancel()
 
-    # 3️⃣ Schedule a new flush after DEBOUNCE_SECONDS
+    # 3️⃣ Schedule a new flush after the user's adaptive wait
     _debounce_tasks[user_id] = asyncio.create_task(
-        _schedule_flush(user_id, chat_id, first_name, context)
+        _schedule_flush(user_id, chat_id, first_name, context, wait)
     )
-async def process_user_queue(user_id: int, context: ContextTypes.DEFAULT_TYPE):
-    
 
-    loop = asyncio.get_running_loop()
+    # 4️⃣ An unseen reply still being generated is dropped and redone with this message
+    await _supersede_inflight(user_id)
+
+
+async def _supersede_inflight(user_id: int):
+    """
+    Cancel the user's in-flight AI call if none of its reply has been shown
+    yet, and put its text back at the front of the debounce buffer so the
+    pending flush asks again with everything the user wrote.
+    """
+    inflight = _inflight_calls.get(user_id)
+    if not SUPERSEDE_INFLIGHT or inflight is None or inflight["shown"] or inflight["superseded"]:
+        return
+    # Older queued messages are answered first; merging past them would reorder the chat
+    if await user_queue.get_queue_backend().has_pending(user_id):
+        return
+    if _inflight_calls.get(user_id) is not inflight or inflight["shown"] or inflight["superseded"]:
+        return  # the call finished or started showing while we checked
+    if user_id not in _debounce_tasks:
+        return  # the buffer was flushed while we checked; re-adding the text would reorder it
+
+    if not inflight["task"].cancel():
+        return  # already finished; its reply is about to be sent
+    inflight["superseded"] = True
+    _debounce_buffers.setdefault(user_id, []).insert(0, inflight["text"])
+    _debounce_started.setdefault(user_id, time.monotonic())
+    metrics.count("ai_superseded")
+    logger.info("✂️ Superseded in-flight AI call for user %s: user is still typing", user_id)
+
+
+async def _process_message(
+    user_id: int,
+    chat_id: int,
+    first_name: str,
+    text: str,
+    context: ContextTypes.DEFAULT_TYPE
+):
+    """Answer one queued message with the typing indicator shown meanwhile."""
+    # — show the typing indicator while we work —
+    outbound.start_typing(context.bot, chat_id)
     try:
-        while user_queue.queue_has_pending_messages(user_id):
-            chat_id, first_name, text = await user_queue.dequeue_message(user_id)
-
-            # — start continuous typing indicator —
-            stop_evt = asyncio.Event()
-
-            async def continuous_typing():
-                while not stop_evt.is_set():
-                    await context.bot.send_chat_action(
-                        chat_id=chat_id,
-                        action=ChatAction.TYPING
-                    )
-                    await asyncio.sleep(1.0)
-
-            typing_task = asyncio.create_task(continuous_typing())
-
-            # — record user & build history —
-            create_or_update_user(user_id=user_id, first_name=first_name)
-            history = get_current_session_history(user_id)
-            history.append({"role": "user", "content": text})
-
-            # — 🔁 Update partial summary every 10 user messages —
-            user_message_count = len([
-                msg for msg in history if msg.get("role") == "user"
-            ])
-
-            if user_message_count % 10 == 0:
-                summary_prompt = "لخّص المحادثة التالية بإيجاز:\n\n"
-                for msg in history[-20:]:  # last 20 messages
-                    role = "مستخدم" if msg["role"] == "user" else "مساعد"
-                    summary_prompt += f"{role}: {msg['content']}\n"
-
-                summary_response = await loop.run_in_executor(
-                    None,
-                    lambda: ask_ai_sync(
-                        user_id=user_id,
-                        message_history=[
-                            {"role": "user", "content": summary_prompt}
-                        ]
-                    )
-                )
-
-                # — update partial summary in MongoDB —
-                partial_summary = summary_response.get("reply", "").strip()
-                # — ensure it's not empty —
-                if partial_summary:
-                    update_partial_summary(user_id, partial_summary)
-                    logger.info(f"✅ Updated partial summary for user {user_id}")
-                else:
-                    logger.warning(f"⚠️ Empty summary returned for user {user_id}")
-
-            # — call the blocking AI in an executor —
-            response = await loop.run_in_executor(
-                None,
-                lambda: ask_ai_sync(
-                    user_id=user_id,
-                    message_history=history
-                )
-            )
+        with metrics.timer("turn"):
+            await _answer_message(user_id, chat_id, first_name, text, context)
+    finally:
+        outbound.stop_typing(chat_id)
 
-            # — extract reply & flags —
-            reply = response.get("reply", "عذراً، لم أفهم طلبك.")
-            session_end = response.get("session_end", False)
-            summary = response.get("summary")
 
-            # store the exchange for future training
-            store_for_training(prompt=text, completion=reply)
+async def _answer_message(
+    user_id: int,
+    chat_id: int,
+    first_name: str,
+    text: str,
+    context: ContextTypes.DEFAULT_TYPE
+):
+    """Build the prompt context, get the AI reply, send and persist it."""
+    # — record user & build history —
+    await create_or_update_user(user_id=user_id, first_name=first_name)
+    session = await get_session_context(user_id)
+    history = session["history"]
+    user_message = token_counter.message("user", text)
+    history.append(user_message)
+
+    partial_summary = session["partial_summary"]
+
+    # — scripted opening turns and FAQ questions are answered locally, the rest by the AI —
+    source = "fast_path"
+    response = fast_path.answer(user_id, history)
+    if response is None:
+        source = "faq"
+        faq_answer = faq_index.answer(user_id, text)
+        if faq_answer:
+            response = local_response(faq_answer)
+    streamer = StreamingReply(context.bot, chat_id) if STREAM_REPLIES and response is None else None
+    inflight = {"task": None, "text": text, "shown": False, "superseded": False}
+
+    async def on_text(delta: str):
+        inflight["shown"] = True  # from here on the reply can no longer be superseded
+        await streamer.push(delta)
+        if streamer.started:
+            outbound.stop_typing(chat_id)  # the live message replaces the typing indicator
+
+    try:
+        if response is None:
+            source = "ai"
+            # — load prompt context, then ask the AI (bounded by the shared AI semaphore) —
+            user_profile = await get_user_profile(user_id)
+            inflight["task"] = asyncio.create_task(ask_ai(
+                user_id=user_id,
+                message_history=history,
+                partial_summary=partial_summary,
+                user_profile=user_profile,
+                on_text=on_text if streamer else None
+            ))
+            _inflight_calls[user_id] = inflight
+            try:
+                response = await inflight["task"]
+            except asyncio.CancelledError:
+                if not inflight["superseded"]:
+                    raise
+                # — the user kept typing: nothing was shown or stored, the merged text is re-queued —
+                return
+            finally:
+                if _inflight_calls.get(user_id) is inflight:
+                    _inflight_calls.pop(user_id, None)
+
+        metrics.count(f"reply_{source}")
+
+        # — extract reply & flags —
+        reply = response.get("reply", "عذراً، لم أفهم طلبك.")
+        session_end = response.get("session_end", False)
+        summary = response.get("summary")
+
+        # store the exchange for future training (canned fast-path/FAQ text is not model output)
+        if source == "ai":
+            await store_for_training(prompt=text, completion=reply, source=source)
+
+        # — log both sides in Mongo —
+        # (each message carries its token count, so it is never recounted)
+        assistant_message = token_counter.message("assistant", reply)
+        await append_messages_to_current_session(user_id, [user_message, assistant_message])
+        history.append(assistant_message)
+
+        # — finish the live reply, or split and send it —
+        with metrics.timer("reply_send"):
+            if streamer:
+                await streamer.finish(reply)
+            else:
+                await outbound.send_text(context.bot, chat_id, reply)
+    finally:
+        # a failure (or cancellation) above must not leave the live message half-written
+        if streamer:
+            await streamer.abort()
+    debouncer.on_reply(user_id)
+
+    # — render and send the contract if the AI asked for it —
+    if response.get("pdf_request"):
+        await _send_contract_pdf(user_id, chat_id, response.get("pdf_content"), context)
+
+    # — refresh the partial summary in the background if due —
+    if not session_end:
+        summary_scheduler.maybe_schedule(
+            user_id,
+            session["session_id"] or await get_current_session_id(user_id),
+            history,
+            session["message_count"] + 2,
+            partial_summary,
+            session["summarized_count"]
+        )
+
+    # — finalize session if needed —
+    if session_end:
+        await mark_session_completed(user_id=user_id, summary=summary)
+        logger.info("Session completed for user %s", user_id)
 
-            # — log both sides in Mongo —
-            append_message_to_current_session(user_id, {"role": "user", "content": text})
-            append_message_to_current_session(user_id, {"role": "assistant", "content": reply})
 
-            # — split and send long reply —
-            CHUNK_SIZE = 1000
-            for i in range(0, len(reply), CHUNK_SIZE):
-                await context.bot.send_message(chat_id=chat_id, text=reply[i:i + CHUNK_SIZE])
+async def _send_contract_pdf(user_id: int, chat_id: int, content: dict, context: ContextTypes.DEFAULT_TYPE):
+    """Render the contract in the PDF worker pool and send it as a document."""
+    if not content:
+        logger.warning("⚠️ [SEND_PDF] without contract data for user %s", user_id)
+        return
+    try:
+        with metrics.timer("pdf_render"):
+            pdf = await contract_renderer.render(content)
+        await outbound.send_document(
+            context.bot,
+            chat_id,
+            document=InputFile(pdf, filename=CONTRACT_FILENAME),
+        )
+        logger.info("📄 Contract PDF sent to user %s (%s bytes)", user_id, len(pdf))
+    except Exception as e:
+        metrics.count("pdf_failed")
+        logger.error("❌ Failed to render/send contract PDF for user %s: %s", user_id, e)
+        await outbound.send_message(context.bot, chat_id, "عذراً، تعذّر تجهيز ملف العقد. حاول مرة ثانية بعد شوي.")
+
 
-            # — stop the typing loop —
-            stop_evt.set()
-            await typing_task
+async def process_user_queue(user_id: int, context: ContextTypes.DEFAULT_TYPE):
+    backend = user_queue.get_queue_backend()
+    keep_going = False
+    try:
+        while await backend.has_pending(user_id):
+            item = await backend.dequeue(user_id)
+            if item is None:
+                break
+            chat_id, first_name, text = item
 
-            # — finalize session if needed —
-            if session_end:
-                mark_session_completed(user_id=user_id, summary=summary)
-                logger.info(f"Session completed for user {user_id}")
+            # — one global processing slot per message keeps scheduling fair —
+            async with user_queue.worker_slot(user_id):
+                await _process_message(user_id, chat_id, first_name, text, context)
 
-            user_queue.mark_message_done(user_id)
+            await backend.mark_done(user_id)
 
     except Exception as e:
-        logger.error(f"Error in user {user_id} queue: {e}")
+        metrics.count("queue_worker_failed")
+        logger.error("Error in user %s queue: %s", user_id, e)
         try:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text="عذراً، حدث خطأ أثناء المعالجة."
+            await outbound.send_message(
+                context.bot,
+                chat_id,
+                "عذراً، حدث خطأ أثناء المعالجة."
             )
         except:
             logger.error("Failed to send fallback error message.")
     finally:
         user_queue.clear_worker_task(user_id)
+        try:
+            keep_going = await backend.release_worker(user_id)
+        except Exception as e:
+            logger.error("Failed to release queue for user %s: %s", user_id, e)
+
+    if keep_going:
+        task = asyncio.create_task(process_user_queue(user_id, context))
+        user_queue.set_worker_task(user_id, task)
 
 # Export the handler to your dispatcher
 message_handler = MessageHandler(
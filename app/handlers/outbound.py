@@ -0,0 +1,225 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, RetryAfter
+from config.logger import logger
+from config.metrics import metrics
+
+load_dotenv()
+
+# Telegram's documented limits: ~30 messages/s overall, ~1 message/s per chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_GLOBAL_BURST = float(os.getenv("TELEGRAM_GLOBAL_BURST", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+# A chat action is shown for about 5 seconds
+TYPING_REFRESH_SECONDS = float(os.getenv("TYPING_REFRESH_SECONDS", "4.5"))
+TYPING_CHECK_INTERVAL = 0.5
+
+MAX_MESSAGE_LENGTH = MessageLimit.MAX_TEXT_LENGTH
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Split text into messages of at most `limit` characters, preferring
+    paragraph breaks, then line breaks, then spaces; words longer than the
+    limit are cut as a last resort.
+    """
+    text = text.strip()
+    parts = []
+    while len(text) > limit:
+        window = text[:limit + 1]
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator)
+            if cut > 0:
+                break
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until one token is available (0 if one is available now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class OutboundScheduler:
+    """
+    Single gateway for everything the bot sends to Telegram.
+
+    Every call waits for a token from the global bucket and from the
+    chat's own bucket, and a 429 (RetryAfter) pauses that chat — or every
+    chat, for global flood waits — before the call is retried. Typing
+    indicators are kept by one shared loop that only refreshes a chat's
+    action when the previous one is about to expire.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_BURST)
+        self._chats: dict[int, TokenBucket] = {}
+        self._chat_paused_until: dict[int, float] = {}
+        self._paused_until = 0.0
+
+        self._typing: dict[int, list] = {}  # chat_id -> [bot, last_sent]
+        self._typing_task: asyncio.Task | None = None
+
+        self.metrics = {
+            "calls": 0,
+            "retry_after": 0,
+            "typing_actions": 0,
+            "throttled_seconds": 0.0,
+        }
+
+    # ── Rate limiting ─────────────────────────────────────────────────────────
+    async def _acquire(self, chat_id: int, per_chat: bool = True):
+        bucket = self._chats.get(chat_id)
+        if bucket is None and per_chat:
+            bucket = self._chats[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        while True:
+            now = time.monotonic()
+            wait = max(
+                self._global.delay(),
+                bucket.delay() if per_chat else 0.0,
+                self._paused_until - now,
+                self._chat_paused_until.get(chat_id, 0.0) - now,
+            )
+            if wait <= 0:
+                self._global.take()
+                if per_chat:
+                    bucket.take()
+                return
+            self.metrics["throttled_seconds"] += wait
+            await asyncio.sleep(wait)
+
+    async def _call(self, chat_id: int, method, per_chat: bool = True, **kwargs):
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            await self._acquire(chat_id, per_chat)
+            self.metrics["calls"] += 1
+            try:
+                with metrics.timer(f"telegram_{method.__name__}"):
+                    return await method(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                self.metrics["retry_after"] += 1
+                until = time.monotonic() + seconds
+                self._chat_paused_until[chat_id] = until
+                if seconds > 1:
+                    # Long waits usually mean the bot as a whole is flooding
+                    self._paused_until = max(self._paused_until, until)
+                logger.warning("⏳ Telegram flood control for chat %s: waiting %ss (attempt %s)", chat_id, seconds, attempt + 1)
+                if attempt == TELEGRAM_MAX_RETRIES:
+                    raise
+
+    # ── Public API ────────────────────────────────────────────────────────────
+    async def send_message(self, bot, chat_id: int, text: str, **kwargs):
+        message = await self._call(chat_id, bot.send_message, text=text, **kwargs)
+        typing = self._typing.get(chat_id)
+        if typing:
+            typing[1] = 0.0  # sending a message clears the chat action
+        return message
+
+    async def send_text(self, bot, chat_id: int, text: str, **kwargs) -> list:
+        """Send text of any length, split on paragraph/word boundaries."""
+        return [await self.send_message(bot, chat_id, part, **kwargs) for part in split_text(text)]
+
+    async def edit_message_text(self, bot, chat_id: int, message_id: int, text: str, **kwargs):
+        try:
+            return await self._call(chat_id, bot.edit_message_text, message_id=message_id, text=text, **kwargs)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return None
+            raise
+
+    async def delete_message(self, bot, chat_id: int, message_id: int):
+        return await self._call(chat_id, bot.delete_message, message_id=message_id)
+
+    async def send_document(self, bot, chat_id: int, document, **kwargs):
+        return await self._call(chat_id, bot.send_document, document=document, **kwargs)
+
+    # ── Typing indicator ──────────────────────────────────────────────────────
+    def start_typing(self, bot, chat_id: int):
+        """Show "typing…" in the chat until stop_typing() is called."""
+        self._typing.setdefault(chat_id, [bot, 0.0])
+        if self._typing_task is None or self._typing_task.done():
+            self._typing_task = asyncio.create_task(self._typing_loop())
+
+    def stop_typing(self, chat_id: int):
+        """Stop refreshing the chat's typing indicator (idempotent)."""
+        self._typing.pop(chat_id, None)
+
+    async def _send_typing(self, chat_id: int, bot):
+        try:
+            # Chat actions are cheap and don't count against the chat's message rate
+            await self._call(chat_id, bot.send_chat_action, per_chat=False, action=ChatAction.TYPING)
+            self.metrics["typing_actions"] += 1
+        except Exception as e:
+            logger.debug("Typing action failed for chat %s: %s", chat_id, e)
+
+    async def _typing_loop(self):
+        while self._typing:
+            now = time.monotonic()
+            due = [
+                (chat_id, typing) for chat_id, typing in self._typing.items()
+                if now - typing[1] >= TYPING_REFRESH_SECONDS
+            ]
+            for chat_id, typing in due:
+                typing[1] = now
+                asyncio.create_task(self._send_typing(chat_id, typing[0]))
+            await asyncio.sleep(TYPING_CHECK_INTERVAL)
+
+    # ── Housekeeping ──────────────────────────────────────────────────────────
+    def evict_idle(self) -> int:
+        """Forget full (idle) per-chat buckets and expired pauses."""
+        now = time.monotonic()
+        idle = [chat_id for chat_id, bucket in self._chats.items() if bucket.idle]
+        for chat_id in idle:
+            self._chats.pop(chat_id, None)
+        for chat_id, until in list(self._chat_paused_until.items()):
+            if until < now:
+                self._chat_paused_until.pop(chat_id, None)
+        return len(idle)
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "throttled_seconds": round(self.metrics["throttled_seconds"], 3),
+            "chat_buckets": len(self._chats),
+            "typing_chats": len(self._typing),
+        }
+
+
+# Shared instance for all handlers
+outbound = OutboundScheduler()
@@ -10,9 +10,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     first_name = user.first_name or "User"
 
     # Save user in DB
-    create_or_update_user(user_id=user_id, first_name=first_name)
+    await create_or_update_user(user_id=user_id, first_name=first_name)
 
-    logger.info(f"User {user_id} started the bot.")
+    logger.info("User %s started the bot.", user_id)
 
     await update.message.reply_text(
       "أهلاً وسهلاً! أرسل أي رسالة للبدء."
@@ -0,0 +1,41 @@
+import os
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+from dotenv import load_dotenv
+from config.logger import logger
+from config.metrics import metrics
+from app.handlers.outbound import outbound
+
+load_dotenv()
+
+# Comma-separated Telegram user ids allowed to run /stats
+ADMIN_USER_IDS = {int(uid) for uid in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if uid}
+
+
+def format_stats(snapshot: dict) -> str:
+    """Compact plain-text report of stage latencies, events and gauges."""
+    lines = [f"⏱️ Uptime: {snapshot['uptime_seconds']}s", "", "Stage latency (ms): n / avg / p50 / p95 / max"]
+    for stage, s in snapshot["stages"].items():
+        lines.append(
+            f"• {stage}: {s['count']} / {s['avg'] * 1000:.0f} / {s['p50'] * 1000:.0f}"
+            f" / {s['p95'] * 1000:.0f} / {s['max'] * 1000:.0f}"
+        )
+    if snapshot["events"]:
+        lines += ["", "Events:"]
+        lines += [f"• {event}: {count:g}" for event, count in snapshot["events"].items()]
+    if snapshot["gauges"]:
+        lines += ["", "Current:"]
+        lines += [f"• {name}: {value:g}" for name, value in snapshot["gauges"].items()]
+    return "\n".join(lines)
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_USER_IDS:
+        logger.warning("🚫 /stats denied for user %s", user_id)
+        return
+
+    await outbound.send_text(context.bot, update.effective_chat.id, format_stats(metrics.snapshot()))
+
+# Export the handler to be registered in bot.py
+stats_handler = CommandHandler("stats", stats)
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from config.logger import logger
+from app.handlers.outbound import outbound, split_text
+
+load_dotenv()
+
+# Telegram tolerates roughly one edit per second per chat
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+
+class StreamingReply:
+    """
+    Shows a reply while it is still being generated.
+
+    The first visible text is sent as soon as it arrives; later text is
+    applied with edit_message_text at most once every STREAM_EDIT_INTERVAL
+    seconds. When the text outgrows Telegram's message limit it is split on
+    a paragraph/word boundary and continues in a new message. All calls go
+    through the shared outbound scheduler, which enforces rate limits.
+    """
+
+    def __init__(self, bot, chat_id: int, edit_interval: float = STREAM_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+
+        self._text = ""
+        self._sent: list[tuple[int, str]] = []  # (message_id, text shown)
+        self._dirty = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._last_update = 0.0
+        self._finished = False
+
+    @property
+    def started(self) -> bool:
+        return bool(self._sent)
+
+    async def push(self, delta: str):
+        """Add newly generated text; the screen is updated in the background."""
+        self._text += delta
+        if not self._text.strip():
+            return
+        if self._task is None:
+            # First visible text goes out immediately
+            await self._sync()
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._dirty.set()
+
+    async def finish(self, final_text: str):
+        """Stop streaming and make the chat show exactly `final_text`."""
+        await self._stop()
+        self._text = final_text
+        await self._sync()
+        self._finished = True
+
+    async def abort(self):
+        """
+        Stop streaming after a failure: cancel the background edits and
+        write out the text received so far. Does nothing after finish().
+        """
+        if self._finished:
+            return
+        await self._stop()
+        self._finished = True
+        if not self.started:
+            return
+        try:
+            await self._sync()
+        except Exception as e:
+            logger.error("❌ Could not write the final edit of a streamed reply in chat %s: %s", self.chat_id, e)
+
+    async def _stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            wait = self.edit_interval - (time.monotonic() - self._last_update)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._dirty.clear()
+            await self._sync()
+
+    async def _sync(self):
+        """Send or edit messages until the chat matches the current text."""
+        pages = split_text(self._text)
+        for index, page in enumerate(pages):
+            if index < len(self._sent):
+                message_id, shown = self._sent[index]
+                if page == shown:
+                    continue
+                await outbound.edit_message_text(self.bot, self.chat_id, message_id, page)
+                self._sent[index] = (message_id, page)
+            else:
+                message = await outbound.send_message(self.bot, self.chat_id, page)
+                if message is not None:
+                    self._sent.append((message.message_id, page))
+
+        # The final text can be shorter than what was streamed (e.g. an error)
+        while len(self._sent) > len(pages):
+            message_id, _ = self._sent.pop()
+            await outbound.delete_message(self.bot, self.chat_id, message_id)
+        self._last_update = time.monotonic()
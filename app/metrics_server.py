@@ -0,0 +1,31 @@
+import tornado.httpserver
+import tornado.web
+from config.logger import logger
+from config.metrics import metrics
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("ok")
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Prometheus scrape target for the shared metrics registry."""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.render())
+
+
+def start_metrics_server(listen: str, port: int) -> tornado.httpserver.HTTPServer:
+    """
+    Serve /metrics (and /healthz) on their own port, separate from the
+    webhook, so the scrape target can stay on loopback in both bot modes.
+    """
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (r"/metrics", MetricsHandler),
+        (r"/healthz", HealthHandler),
+    ]))
+    server.listen(port, address=listen)
+    logger.info("📈 Metrics endpoint listening on http://%s:%s/metrics", listen, port)
+    return server
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
+from dotenv import load_dotenv
+from config.logger import logger
+
+load_dotenv()
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
+CONTRACT_TEMPLATE = os.getenv("CONTRACT_TEMPLATE", os.path.join(TEMPLATE_DIR, "contract.json"))
+# Any TTF with Arabic glyphs; DejaVu Sans ships with most Linux images
+CONTRACT_FONT_PATH = os.getenv("CONTRACT_FONT_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+CONTRACT_FONT_BOLD_PATH = os.getenv("CONTRACT_FONT_BOLD_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+FONT_FAMILY = "contract"
+YES_NO = {True: "نعم", False: "لا"}
+
+
+# ── Template (parsed once per process) ─────────────────────────────────────────
+@lru_cache(maxsize=8)
+def load_template(path: str = CONTRACT_TEMPLATE) -> dict:
+    """
+    Read and pre-compile a contract template: dotted field keys are split
+    into paths once, so a render only walks dictionaries.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    return {
+        "title": raw["title"],
+        "sections": [
+            (section["title"], [(tuple(key.split(".")), label) for key, label in section["fields"]])
+            for section in raw["sections"]
+        ],
+        "extra_title": raw.get("extra_title", ""),
+        "ignore": set(raw.get("ignore", [])),
+        "signatures": raw.get("signatures", []),
+    }
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return YES_NO[value]
+    if isinstance(value, list):
+        return "، ".join(_format_value(v) for v in value)
+    if isinstance(value, dict):
+        return "، ".join(_format_value(v) for v in value.values() if v not in (None, ""))
+    return str(value)
+
+
+def _pop_path(content: dict, path: tuple):
+    """Remove and return content[a][b]…, or None if any level is missing."""
+    node = content
+    for key in path[:-1]:
+        node = node.get(key)
+        if not isinstance(node, dict):
+            return None
+    return node.pop(path[-1], None)
+
+
+def _leftovers(content: dict, prefix: str = "") -> list:
+    """(label, value) pairs for fields the template doesn't know about."""
+    rows = []
+    for key, value in content.items():
+        label = f"{prefix}{key}"
+        if isinstance(value, dict):
+            rows.extend(_leftovers(value, f"{label} / "))
+        elif value not in (None, "", []):
+            rows.append((label, _format_value(value)))
+    return rows
+
+
+def layout_rows(content: dict, template: dict) -> list:
+    """Sections as (title, [(label, text), …]), skipping empty ones."""
+    remaining = json.loads(json.dumps(content, ensure_ascii=False))  # deep copy we can pop from
+    for key in template["ignore"]:
+        remaining.pop(key, None)
+
+    sections = []
+    for title, fields in template["sections"]:
+        rows = []
+        for path, label in fields:
+            value = _pop_path(remaining, path)
+            if value not in (None, "", []):
+                rows.append((label, _format_value(value)))
+        if rows:
+            sections.append((title, rows))
+
+    extra = _leftovers(remaining)
+    if extra:
+        sections.append((template["extra_title"], extra))
+    return sections
+
+
+# ── Rendering (runs inside the worker processes) ───────────────────────────────
+def render_contract(content: dict, template_path: str = CONTRACT_TEMPLATE) -> bytes:
+    """Render `content` (the model's JSON payload) as a right-to-left A4 PDF."""
+    from fpdf import FPDF
+
+    template = load_template(template_path)
+    bold = "B" if os.path.exists(CONTRACT_FONT_BOLD_PATH) else ""
+
+    pdf = FPDF(format="A4")
+    pdf.set_auto_page_break(auto=True, margin=15)
+    # fpdf2 subsets fonts in place while writing, so each document embeds its own copy
+    pdf.add_font(FONT_FAMILY, "", CONTRACT_FONT_PATH)
+    if bold:
+        pdf.add_font(FONT_FAMILY, "B", CONTRACT_FONT_BOLD_PATH)
+    pdf.set_text_shaping(use_shaping_engine=True, direction="rtl", script="arab", language="ara")
+    pdf.add_page()
+
+    pdf.set_font(FONT_FAMILY, bold, 18)
+    pdf.cell(0, 12, template["title"], align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(FONT_FAMILY, "", 10)
+    pdf.cell(0, 8, f"تاريخ الإنشاء: {date.today():%Y/%m/%d}", align="R", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(2)
+
+    for title, rows in layout_rows(content, template):
+        pdf.set_font(FONT_FAMILY, bold, 13)
+        pdf.set_fill_color(235, 240, 245)
+        pdf.cell(0, 9, title, align="R", fill=True, new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font(FONT_FAMILY, "", 11)
+        for label, text in rows:
+            pdf.multi_cell(0, 7, f"{label}: {text}", align="R", new_x="LMARGIN", new_y="NEXT")
+        pdf.ln(3)
+
+    if template["signatures"]:
+        pdf.ln(10)
+        width = (pdf.w - pdf.l_margin - pdf.r_margin) / len(template["signatures"])
+        pdf.set_font(FONT_FAMILY, "", 11)
+        for label in template["signatures"]:
+            pdf.cell(width, 8, f"{label}: ____________", align="C")
+        pdf.ln()
+
+    return bytes(pdf.output())
+
+
+def _init_worker(template_path: str):
+    """
+    Warm a worker with one throwaway render: imports fpdf/HarfBuzz, parses
+    the template into the cache and pulls the font files into memory, so
+    the first real contract doesn't pay for any of it.
+    """
+    render_contract({}, template_path)
+
+
+# ── Async front end ────────────────────────────────────────────────────────────
+class ContractRenderer:
+    """
+    Renders contract PDFs in a process pool so layout and font subsetting
+    never block the event loop. Workers are spawned on first use and warm
+    themselves up in the pool initializer.
+    """
+
+    def __init__(self, workers: int = PDF_WORKERS, template_path: str = CONTRACT_TEMPLATE):
+        self.workers = workers
+        self.template_path = template_path
+        self._pool: ProcessPoolExecutor | None = None
+        self.metrics = {"renders": 0, "failures": 0, "render_seconds": 0.0}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # spawn: never fork the bot's event loop, threads or sockets
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.template_path,),
+            )
+            logger.info("🖨️ Contract PDF pool started with %s worker(s)", self.workers)
+        return self._pool
+
+    async def render(self, content: dict) -> bytes:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            pdf = await loop.run_in_executor(self._get_pool(), render_contract, content, self.template_path)
+        except Exception:
+            self.metrics["failures"] += 1
+            raise
+        self.metrics["renders"] += 1
+        self.metrics["render_seconds"] += time.perf_counter() - started
+        return pdf
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        renders = self.metrics["renders"]
+        return {
+            "workers": self.workers,
+            "renders": renders,
+            "failures": self.metrics["failures"],
+            "avg_render_ms": round(self.metrics["render_seconds"] / renders * 1000, 1) if renders else 0.0,
+        }
+
+
+# Shared instance for all handlers
+contract_renderer = ContractRenderer()
@@ -0,0 +1,110 @@
+"""
+Fuzz and benchmark the streaming output parser.
+
+Random completions are built from pieces whose visible text, tag and
+payload are known, then fed to StreamParser split at random points; every
+split must give exactly the same result as the expected one. The benchmark
+then measures throughput on a realistic completion streamed in token-sized
+chunks.
+
+    python -m benchmarks.bench_output_parser [--cases 5000] [--seed 1]
+"""
+import argparse
+import json
+import random
+import time
+from app.ai.output_parser import PDF_TAG, StreamParser, parse_completion
+
+TEXT_PIECES = [
+    "تمام، ", "وش رقم الصك؟ ", "أبشر! ", "المبلغ {50,000} ريال ", "اختر [1] أو [2] ",
+    "`رمز` ", "```python\nprint(1)\n``` تم ", "[SEND", "{ قوس } ", "\n\n", "السعر 3 ريال } ",
+    "[SEND_PDF", "`` ", "json ", "ok ",
+]
+
+
+def random_payload(rng: random.Random) -> dict:
+    return {
+        "profile_updates": {"national_id": str(rng.randint(10**9, 2 * 10**9)), "city": "الرياض"},
+        "note": rng.choice(["نص فيه } قوس", 'اقتباس \\" هنا', "{ داخل النص }", "\\\\"]),
+        "items": [rng.randint(0, 9) for _ in range(rng.randint(0, 4))],
+    }
+
+
+def random_completion(rng: random.Random):
+    """Return (raw completion, expected visible text, expected pdf flag, expected payload)."""
+    raw, visible = [], []
+    pdf, payload = False, None
+    for _ in range(rng.randint(1, 12)):
+        piece = rng.choice(TEXT_PIECES)
+        raw.append(piece)
+        visible.append(piece)
+        if rng.random() < 0.15:
+            raw.append(PDF_TAG)
+            pdf = True
+    if rng.random() < 0.7:
+        payload = random_payload(rng)
+        blob = json.dumps(payload, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 2]))
+        if rng.random() < 0.4:
+            raw.append(f"\n```json\n{blob}\n```")
+            visible.append("\n")  # text before the fence is released as it comes
+        else:
+            raw.append(blob)
+        if rng.random() < 0.3:
+            raw.append(" شكراً")
+            visible.append(" شكراً")
+    return "".join(raw), "".join(visible), pdf, payload
+
+
+def random_chunks(rng: random.Random, text: str) -> list:
+    chunks, i = [], 0
+    while i < len(text):
+        size = rng.choice([1, 1, 2, 3, 4, 7, 16])
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def fuzz(cases: int, seed: int):
+    rng = random.Random(seed)
+    for case in range(cases):
+        raw, visible, pdf, payload = random_completion(rng)
+        whole = parse_completion(raw)
+        assert whole.pdf_requested == pdf, (case, raw)
+        assert whole.payload == payload, (case, raw, whole.payload)
+        assert whole.text == visible, (case, raw, whole.text)
+
+        parser = StreamParser()
+        streamed = "".join(parser.feed(chunk) for chunk in random_chunks(rng, raw)) + parser.close()
+        assert streamed == whole.text, (case, raw, streamed, whole.text)
+        assert parser.payload == whole.payload and parser.pdf_requested == whole.pdf_requested, (case, raw)
+    print(f"fuzz: {cases} completions OK (seed {seed})")
+
+
+def benchmark(rounds: int = 2000):
+    text = "أبشر! هذي بيانات العقد اللي وصلتني، تأكد منها قبل ما أرسل العقد. " * 8
+    payload = json.dumps(random_payload(random.Random(0)), ensure_ascii=False)
+    raw = text + PDF_TAG + "\n" + payload
+    chunks = [raw[i:i + 4] for i in range(0, len(raw), 4)]  # ~token-sized
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        parser = StreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+    elapsed = time.perf_counter() - started
+
+    chars = len(raw) * rounds
+    print(
+        f"benchmark: {rounds} completions of {len(raw)} chars in {len(chunks)} chunks → "
+        f"{elapsed / rounds * 1e6:.1f} µs per completion, {chars / elapsed / 1e6:.2f} M chars/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    fuzz(args.cases, args.seed)
+    benchmark()
@@ -0,0 +1,72 @@
+"""
+Benchmark contract PDF rendering.
+
+Measures renders per second in-process (one core) and through the
+ContractRenderer process pool, and reports throughput per worker.
+
+    python -m benchmarks.bench_pdf [--renders 40] [--workers 2] [--out /tmp/contract.pdf]
+"""
+import argparse
+import asyncio
+import os
+import time
+from app.pdf.contract_pdf import ContractRenderer, render_contract
+
+SAMPLE_CONTRACT = {
+    "contract_type": "سكني",
+    "start_date": "1447/05/01",
+    "duration": "سنة",
+    "deed": {"type": "صك إلكتروني", "number": "310112345678", "issue_date": "1445/03/12", "owner_id": "1012345678"},
+    "property": {"type": "عمارة", "usage": "سكن عائلات", "name": "عمارة النخيل", "national_address": "RRRD2929", "floors": 3},
+    "unit": {"number": "12", "type": "شقة", "floor": 2, "area": "140 م²", "rooms": 4, "furnished": False},
+    "landlord": {"name": "محمد أحمد", "national_id": "1012345678", "birth_date": "1400/01/01"},
+    "tenant": {"name": "خالد عبدالله", "national_id": "1098765432", "address": {"city": "الرياض", "district": "النرجس"}},
+    "financial": {"annual_rent": "45000 ريال", "payment_cycle": "نصف سنوي"},
+    "services": {"electricity": "المستأجر - عداد 12345678", "water": "المؤجر"},
+    "terms": {
+        "sublease_allowed": False,
+        "government_review_allowed": True,
+        "minor_repairs_allowed": True,
+        "unit_modification_allowed": False,
+    },
+    "profile_updates": {"national_id": "1098765432"},
+}
+
+
+def bench_inline(renders: int) -> float:
+    render_contract(SAMPLE_CONTRACT)  # warm-up: imports, template cache
+    started = time.perf_counter()
+    for _ in range(renders):
+        render_contract(SAMPLE_CONTRACT)
+    return renders / (time.perf_counter() - started)
+
+
+async def bench_pool(renders: int, workers: int) -> float:
+    renderer = ContractRenderer(workers=workers)
+    try:
+        # Spawn and warm every worker before timing
+        await asyncio.gather(*[renderer.render(SAMPLE_CONTRACT) for _ in range(workers)])
+        started = time.perf_counter()
+        await asyncio.gather(*[renderer.render(SAMPLE_CONTRACT) for _ in range(renders)])
+        return renders / (time.perf_counter() - started)
+    finally:
+        renderer.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--renders", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--out", help="also write one rendered contract to this path")
+    args = parser.parse_args()
+
+    if args.out:
+        with open(args.out, "wb") as f:
+            f.write(render_contract(SAMPLE_CONTRACT))
+        print(f"wrote {args.out}")
+
+    inline = bench_inline(args.renders)
+    print(f"in-process: {inline:.2f} renders/s (1 core)")
+    pooled = asyncio.run(bench_pool(args.renders, args.workers))
+    cores = min(args.workers, os.cpu_count() or 1)
+    print(f"pool:       {pooled:.2f} renders/s with {args.workers} workers on {cores} core(s) → {pooled / cores:.2f} renders/s per core")
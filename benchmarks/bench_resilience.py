@@ -0,0 +1,252 @@
+"""
+Benchmark model-call latency during a provider brownout.
+
+Starts a fake OpenAI-compatible endpoint (streaming and non-streaming
+/v1/chat/completions over SSE) whose primary model misbehaves: some
+requests stall before the first token, some are slow, some fail with
+500/429. The same workload is then run through a plain single streamed
+call (the old ask_ai behaviour), through ResilientChat, and through
+ResilientChat with hedging, and p50/p99 completion latency is compared.
+
+    python -m benchmarks.bench_resilience [--requests 300] [--concurrency 30] [--stall-prob 0.05]
+    python -m benchmarks.bench_resilience --serve --port 8089   # then run the bot with AI_BASE_URL=http://127.0.0.1:8089/v1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+REPLY = "أبشر! سجلت بيانات المستأجر، عشان أكمل العقد أحتاج رقم الصك وتاريخ إصداره ونوع العقار ورقم الوحدة."
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Brownout:
+    """How one model misbehaves; every request rolls the dice once."""
+
+    def __init__(self, stall_prob=0.0, slow_prob=0.0, slow_ttft=3.0, error_prob=0.0, rate_limit_prob=0.0):
+        self.stall_prob = stall_prob
+        self.slow_prob = slow_prob
+        self.slow_ttft = slow_ttft
+        self.error_prob = error_prob
+        self.rate_limit_prob = rate_limit_prob
+
+    def roll(self, rng: random.Random) -> str:
+        x = rng.random()
+        for outcome, prob in (("stall", self.stall_prob), ("error", self.error_prob),
+                              ("rate_limit", self.rate_limit_prob), ("slow", self.slow_prob)):
+            if x < prob:
+                return outcome
+            x -= prob
+        return "ok"
+
+
+def make_app(brownouts: dict, ttft: float, tokens_per_second: float, stall_seconds: float, seed: int = 1):
+    """Tornado application serving a fake /v1/chat/completions."""
+    import tornado.web
+    from tornado.iostream import StreamClosedError
+
+    logging.getLogger("tornado.access").setLevel(logging.ERROR)
+    rng = random.Random(seed)
+    words = REPLY.split(" ")
+    healthy = Brownout()
+
+    class CompletionsHandler(tornado.web.RequestHandler):
+        def initialize(self):
+            self.closed = asyncio.Event()
+
+        def on_connection_close(self):
+            self.closed.set()
+
+        async def pause(self, seconds: float):
+            try:
+                await asyncio.wait_for(self.closed.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+
+        def error(self, status: int, kind: str):
+            self.set_status(status)
+            self.finish({"error": {"message": f"fake {kind}", "type": kind, "code": kind}})
+
+        async def post(self):
+            body = json.loads(self.request.body)
+            model = body.get("model", "")
+            outcome = brownouts.get(model, healthy).roll(rng)
+            self.application.settings["served"][outcome] = self.application.settings["served"].get(outcome, 0) + 1
+
+            if outcome == "error":
+                return self.error(500, "server_error")
+            if outcome == "rate_limit":
+                return self.error(429, "rate_limit_exceeded")
+            first_wait = {"stall": stall_seconds, "slow": brownouts.get(model, healthy).slow_ttft}.get(outcome, ttft)
+            await self.pause(first_wait)
+            if self.closed.is_set():
+                return
+
+            base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": model}
+            usage = {"prompt_tokens": 900, "completion_tokens": len(words), "total_tokens": 900 + len(words)}
+            if not body.get("stream"):
+                return self.finish({
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": REPLY}}],
+                    "usage": usage,
+                })
+
+            self.set_header("Content-Type", "text/event-stream")
+            self.set_header("Cache-Control", "no-cache")
+            try:
+                for i, word in enumerate(words):
+                    if i:
+                        await self.pause(1 / tokens_per_second)
+                    delta = {"content": " " + word} if i else {"role": "assistant", "content": word}
+                    chunk = {**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                    self.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+                    await self.flush()
+                    if self.closed.is_set():
+                        return
+                final = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                self.write(f"data: {json.dumps(final)}\n\n")
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self.write(f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n")
+                self.write("data: [DONE]\n\n")
+                await self.finish()
+            except StreamClosedError:
+                pass
+
+    return tornado.web.Application([(r"/v1/chat/completions", CompletionsHandler)], served={})
+
+
+async def run_plain(client, model: str, messages: list) -> str:
+    """The old ask_ai call: one streamed request, no deadline, no retry."""
+    stream = await client.chat.completions.create(model=model, messages=messages, stream=True, max_tokens=256)
+    parts = []
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+    return "".join(parts)
+
+
+async def run_resilient(chat, messages: list) -> str:
+    return "".join([delta async for delta in chat.stream(messages, max_tokens=256)])
+
+
+async def run_mode(name: str, call, requests: int, concurrency: int) -> dict:
+    latencies, failures = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    messages = [{"role": "user", "content": "أبغى أسوي عقد إيجار"}]
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call(messages)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    return {
+        "mode": name,
+        "elapsed_s": round(time.perf_counter() - started, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "failed": failures,
+    }
+
+
+async def bench(args) -> list[dict]:
+    import httpx
+    from openai import AsyncOpenAI
+    from app.ai.resilience import ResilientChat
+    from config.metrics import metrics
+
+    brownouts = {args.model: Brownout(args.stall_prob, args.slow_prob, args.slow_ttft, args.error_prob, args.rate_limit_prob)}
+    app = make_app(brownouts, args.ttft, args.tokens_per_second, args.stall_seconds, args.seed)
+    server = app.listen(args.port, address="127.0.0.1")
+    port = next(iter(server._sockets.values())).getsockname()[1]
+
+    client = AsyncOpenAI(
+        api_key="bench",
+        base_url=f"http://127.0.0.1:{port}/v1",
+        max_retries=0,
+        timeout=httpx.Timeout(args.stall_seconds + 30, connect=5.0),
+        http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency * 3)),
+    )
+    results = []
+    try:
+        results.append(await run_mode(
+            "plain", lambda m: run_plain(client, args.model, m), args.requests, args.concurrency))
+        for hedge in (False, True):
+            chat = ResilientChat(client, args.model, args.fallback_model, hedge=hedge)
+            before = metrics.events.values()
+            result = await run_mode(
+                "resilient+hedge" if hedge else "resilient",
+                lambda m: run_resilient(chat, m), args.requests, args.concurrency,
+            )
+            after = metrics.events.values()
+            result["events"] = {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+            result["breakers"] = {model: b["times_opened"] for model, b in chat.stats()["breakers"].items()}
+            results.append(result)
+    finally:
+        await client.close()
+        server.stop()
+    print(f"served: {app.settings['served']}")
+    return results
+
+
+async def serve(args):
+    brownouts = {args.model: Brownout(args.stall_prob, args.slow_prob, args.slow_ttft, args.error_prob, args.rate_limit_prob)}
+    make_app(brownouts, args.ttft, args.tokens_per_second, args.stall_seconds, args.seed).listen(args.port, address="127.0.0.1")
+    print(f"fake OpenAI endpoint on http://127.0.0.1:{args.port}/v1 (brownout on {args.model})")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--model", default="gpt-4o", help="the browned-out primary model")
+    parser.add_argument("--fallback-model", default="gpt-4o-mini")
+    parser.add_argument("--ttft", type=float, default=0.3, help="healthy time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--stall-prob", type=float, default=0.05, help="requests that hang before the first token")
+    parser.add_argument("--stall-seconds", type=float, default=30.0)
+    parser.add_argument("--slow-prob", type=float, default=0.05)
+    parser.add_argument("--slow-ttft", type=float, default=3.0)
+    parser.add_argument("--error-prob", type=float, default=0.05, help="requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.02, help="requests answered with HTTP 429")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--serve", action="store_true", help="only run the fake endpoint")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_CONSOLE_LEVEL", "ERROR")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="ejar-bench-"))
+    if args.serve:
+        asyncio.run(serve(args))
+    else:
+        results = asyncio.run(bench(args))
+        for r in results:
+            if args.json:
+                print(json.dumps(r))
+            else:
+                print(f"{r['mode']:16} p50 {r['p50_ms']:>8} ms | p99 {r['p99_ms']:>8} ms | max {r['max_ms']:>8} ms "
+                      f"| failed {r['failed']:>3} | {r['elapsed_s']}s {r.get('events', '')}")
@@ -0,0 +1,122 @@
+"""
+Check that the write-behind buffer loses and doubles nothing when a flush fails.
+
+Each scenario pushes messages to a few sessions on the fake Mongo, makes
+one bulk_write fail in a specific way, then flushes until the buffer is
+empty. Every message must end up exactly once in the session (history and
+message_count) and exactly once in the `messages` log.
+
+    python -m benchmarks.check_write_behind
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+SESSIONS = 4
+MESSAGES_PER_SESSION = 3
+
+
+def fail_once(collection, mode: str, failed_index: int = 1):
+    """
+    Make the next bulk_write on `collection` fail:
+    - "before": raise before anything is applied
+    - "after": apply every op, then raise (the reply was lost)
+    - "partial": apply every op but `failed_index`, then raise BulkWriteError for it
+    - "write_concern": apply every op, then raise BulkWriteError with a writeConcernError
+    """
+    from pymongo.errors import AutoReconnect, BulkWriteError
+
+    original = collection.bulk_write
+
+    async def bulk_write(ops: list, ordered: bool = True):
+        collection.bulk_write = original
+        if mode == "before":
+            raise AutoReconnect("connection reset (before apply)")
+        if mode == "partial":
+            await original([op for i, op in enumerate(ops) if i != failed_index], ordered=ordered)
+            raise BulkWriteError({
+                "writeErrors": [{"index": failed_index, "code": 2, "errmsg": "fake failure"}],
+                "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0, "nMatched": len(ops) - 1,
+                "nModified": len(ops) - 1, "nRemoved": 0, "upserted": [],
+            })
+        await original(ops, ordered=ordered)
+        if mode == "write_concern":
+            raise BulkWriteError({
+                "writeErrors": [], "writeConcernErrors": [{"code": 64, "errmsg": "fake wtimeout"}],
+                "nInserted": 0, "nUpserted": 0, "nMatched": len(ops), "nModified": len(ops),
+                "nRemoved": 0, "upserted": [],
+            })
+        raise AutoReconnect("connection reset (after apply)")
+
+    collection.bulk_write = bulk_write
+
+
+async def run_scenario(name: str, target: str, mode: str) -> list[str]:
+    from benchmarks.fakes import FakeCollection
+    from app.db import write_behind
+
+    write_behind.users_collection = FakeCollection("users")
+    write_behind.sessions_collection = FakeCollection("sessions")
+    write_behind.messages_collection = FakeCollection("messages")
+    buffer = write_behind.WriteBehindBuffer(flush_interval=3600)
+
+    sessions = [f"s{i}" for i in range(SESSIONS)]
+    for user_id, session_id in enumerate(sessions):
+        await write_behind.sessions_collection.insert_one(
+            {"_id": session_id, "user_id": user_id, "history": [], "message_count": 0, "user_message_count": 0}
+        )
+        buffer.queue_user_update(user_id, {"first_name": f"user {user_id}"})
+        for n in range(MESSAGES_PER_SESSION):
+            buffer.queue_session_push(session_id, [{"role": "user", "content": f"{session_id}:{n}"}], user_id=user_id)
+
+    fail_once(getattr(write_behind, f"{target}_collection"), mode)
+    await buffer.flush()
+    # A message that arrives while a push is being resent must not jump ahead of it
+    buffer.queue_session_push(sessions[0], [{"role": "assistant", "content": "late"}], user_id=0)
+    for _ in range(5):
+        await buffer.flush()
+
+    problems = []
+    stats = buffer.stats()
+    if stats["pending_sessions"] or stats["unacknowledged_sessions"] or buffer._archive_retry:
+        problems.append(f"buffer not drained: {stats}")
+    for user_id, session_id in enumerate(sessions):
+        expected = [f"{session_id}:{n}" for n in range(MESSAGES_PER_SESSION)] + (["late"] if user_id == 0 else [])
+        session = await write_behind.sessions_collection.find_one({"_id": session_id})
+        history = [msg["content"] for msg in session["history"]]
+        logged = sorted(doc["content"] for doc in write_behind.messages_collection.docs.values()
+                        if doc["session_id"] == session_id)
+        if history != expected or session["message_count"] != len(expected):
+            problems.append(f"{session_id}: history {history}, message_count {session['message_count']}")
+        if logged != sorted(expected):
+            problems.append(f"{session_id}: message log {logged}")
+    if len(write_behind.users_collection.docs) != SESSIONS:
+        problems.append(f"{len(write_behind.users_collection.docs)} users stored")
+    print(f"{'✅' if not problems else '❌'} {name}")
+    for problem in problems:
+        print(f"    {problem}")
+    return problems
+
+
+async def main() -> int:
+    scenarios = [
+        ("users write fails", "users", "before"),
+        ("sessions write fails before applying", "sessions", "before"),
+        ("sessions write applied, reply lost", "sessions", "after"),
+        ("sessions BulkWriteError for one push", "sessions", "partial"),
+        ("sessions write concern error", "sessions", "write_concern"),
+        ("message log write fails", "messages", "before"),
+        ("message log write applied, reply lost", "messages", "after"),
+    ]
+    failures = 0
+    for name, target, mode in scenarios:
+        failures += bool(await run_scenario(name, target, mode))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=1")
+    os.environ.setdefault("LOG_CONSOLE_LEVEL", "CRITICAL")
+    os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="ejar-check-"))
+    sys.exit(asyncio.run(main()))
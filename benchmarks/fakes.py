@@ -0,0 +1,416 @@
+"""
+In-process stand-ins for the bot's external services, for benchmarks.
+
+- FakeCollection / install_fake_mongo: a dict-backed subset of the async
+  pymongo Collection API, covering exactly what app/db uses.
+- FakeAIClient: streams a canned completion with a configurable time to
+  first token and token rate, like AsyncOpenAI with stream=True.
+- FakeBot: records every Telegram call the bot makes and its timestamp.
+
+install_fake_mongo() must run before anything imports app.db.user_data
+(or any other module that binds collections at import time).
+"""
+import asyncio
+import copy
+import itertools
+import time
+from types import SimpleNamespace
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.operations import DeleteOne, InsertOne, ReplaceOne, UpdateOne
+
+
+# ── Mongo ─────────────────────────────────────────────────────────────────────
+def _get(doc: dict, dotted: str):
+    node = doc
+    for key in dotted.split("."):
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(_matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = _get(doc, key)
+        if isinstance(cond, dict) and cond and all(op.startswith("$") for op in cond):
+            for op, arg in cond.items():
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$nin" and value in arg:
+                    return False
+                if op == "$ne" and (value == arg or (isinstance(value, list) and arg in value)):
+                    return False
+                if op == "$lt" and not (value is not None and value < arg):
+                    return False
+                if op == "$lte" and not (value is not None and value <= arg):
+                    return False
+                if op == "$gt" and not (value is not None and value > arg):
+                    return False
+                if op == "$gte" and not (value is not None and value >= arg):
+                    return False
+                if op == "$exists" and (value is not None) != bool(arg):
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _apply_update(doc: dict, update: dict, inserting: bool):
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for key, arg in fields.items():
+            *parents, last = key.split(".")
+            node = doc
+            for part in parents:
+                node = node.setdefault(part, {})
+            if op in ("$set", "$setOnInsert"):
+                node[last] = copy.deepcopy(arg)
+            elif op == "$unset":
+                node.pop(last, None)
+            elif op == "$inc":
+                node[last] = node.get(last, 0) + arg
+            elif op == "$max":
+                if node.get(last) is None or arg > node[last]:
+                    node[last] = copy.deepcopy(arg)
+            elif op == "$push":
+                items = node.setdefault(last, [])
+                if isinstance(arg, dict) and "$each" in arg:
+                    items.extend(copy.deepcopy(arg["$each"]))
+                    if "$slice" in arg:
+                        cut = arg["$slice"]
+                        node[last] = items[cut:] if cut < 0 else items[:cut]
+                else:
+                    items.append(copy.deepcopy(arg))
+            else:
+                raise NotImplementedError(f"update operator {op}")
+
+
+def _project(doc: dict, projection: dict | None) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    result = {"_id": doc.get("_id")}
+    for key, spec in projection.items():
+        if key not in doc:
+            continue
+        if isinstance(spec, dict) and "$slice" in spec:
+            cut = spec["$slice"]
+            result[key] = copy.deepcopy(doc[key][cut:] if cut < 0 else doc[key][:cut])
+        elif spec:
+            result[key] = copy.deepcopy(doc[key])
+    return result
+
+
+class FakeCollection:
+    """
+    Enough of AsyncCollection for app/db: documents live in a dict keyed by
+    _id with a hash index on user_id; every call yields to the event loop
+    and optionally sleeps `latency` seconds like a network round trip.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.docs: dict = {}
+        self._by_user: dict = {}
+        self.ops = 0
+
+    async def _round_trip(self):
+        self.ops += 1
+        await asyncio.sleep(self.latency)
+
+    def _candidates(self, query: dict):
+        if "_id" in query and not isinstance(query["_id"], dict):
+            doc = self.docs.get(query["_id"])
+            return [doc] if doc is not None else []
+        if "user_id" in query and not isinstance(query["user_id"], dict):
+            return [self.docs[i] for i in self._by_user.get(query["user_id"], ()) if i in self.docs]
+        return list(self.docs.values())
+
+    def _find(self, query: dict, sort=None) -> list:
+        found = [doc for doc in self._candidates(query) if _matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            found.sort(key=lambda d: _get(d, key), reverse=direction < 0)
+        return found
+
+    def _insert(self, doc: dict):
+        doc.setdefault("_id", next(self._ids))
+        if doc["_id"] in self.docs:
+            raise ValueError(f"duplicate key {doc['_id']!r} in {self.name}")
+        self.docs[doc["_id"]] = doc
+        if "user_id" in doc:
+            self._by_user.setdefault(doc["user_id"], set()).add(doc["_id"])
+
+    def _remove(self, doc: dict):
+        self.docs.pop(doc["_id"], None)
+        if "user_id" in doc:
+            self._by_user.get(doc["user_id"], set()).discard(doc["_id"])
+
+    def _upsert_doc(self, query: dict, update: dict) -> dict:
+        doc = {k: copy.deepcopy(v) for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        _apply_update(doc, update, inserting=True)
+        self._insert(doc)
+        return doc
+
+    def _update(self, doc: dict, update: dict):
+        old_user = doc.get("user_id")
+        _apply_update(doc, update, inserting=False)
+        if doc.get("user_id") != old_user and "user_id" in doc:
+            self._by_user.setdefault(doc["user_id"], set()).add(doc["_id"])
+
+    # ── Reads ─────────────────────────────────────────────────────────────────
+    def find(self, query: dict = None, projection: dict = None):
+        return _FakeCursor(self, query or {}, projection)
+
+    async def find_one(self, query: dict = None, projection: dict = None, sort=None):
+        await self._round_trip()
+        found = self._find(query or {}, sort)
+        return _project(found[0], projection) if found else None
+
+    async def count_documents(self, query: dict):
+        await self._round_trip()
+        return len(self._find(query))
+
+    async def distinct(self, key: str, query: dict = None):
+        await self._round_trip()
+        return list(dict.fromkeys(_get(doc, key) for doc in self._find(query or {})))
+
+    # ── Writes ────────────────────────────────────────────────────────────────
+    async def insert_one(self, doc: dict):
+        await self._round_trip()
+        self._insert(copy.deepcopy(doc))
+        return SimpleNamespace(inserted_id=doc.get("_id"))
+
+    async def insert_many(self, docs: list, ordered: bool = True):
+        await self._round_trip()
+        for doc in docs:
+            self._insert(copy.deepcopy(doc))
+        return SimpleNamespace(inserted_ids=[doc.get("_id") for doc in docs])
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        await self._round_trip()
+        return self._update_one(query, update, upsert)
+
+    def _update_one(self, query: dict, update: dict, upsert: bool = False):
+        found = self._find(query)
+        if found:
+            self._update(found[0], update)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = self._upsert_doc(query, update)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query: dict, update: dict):
+        await self._round_trip()
+        found = self._find(query)
+        for doc in found:
+            self._update(doc, update)
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found))
+
+    async def find_one_and_update(
+        self, query: dict, update: dict, projection: dict = None, sort=None,
+        upsert: bool = False, return_document=ReturnDocument.BEFORE
+    ):
+        await self._round_trip()
+        found = self._find(query, sort)
+        if not found:
+            if not upsert:
+                return None
+            doc = self._upsert_doc(query, update)
+            return _project(doc, projection) if return_document == ReturnDocument.AFTER else None
+        doc = found[0]
+        before = _project(doc, projection)
+        self._update(doc, update)
+        return _project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def delete_one(self, query: dict):
+        await self._round_trip()
+        found = self._find(query)
+        if found:
+            self._remove(found[0])
+        return SimpleNamespace(deleted_count=len(found[:1]))
+
+    async def delete_many(self, query: dict):
+        await self._round_trip()
+        found = self._find(query)
+        for doc in found:
+            self._remove(doc)
+        return SimpleNamespace(deleted_count=len(found))
+
+    async def bulk_write(self, ops: list, ordered: bool = True):
+        await self._round_trip()
+        for op in ops:
+            if isinstance(op, UpdateOne):
+                self._update_one(op._filter, op._doc, op._upsert)
+            elif isinstance(op, InsertOne):
+                if op._doc.get("_id") not in self.docs:
+                    self._insert(copy.deepcopy(op._doc))
+            elif isinstance(op, ReplaceOne):
+                found = self._find(op._filter)[:1]
+                for doc in found:
+                    self._remove(doc)
+                if found or op._upsert:
+                    self._insert(copy.deepcopy(op._doc))
+            elif isinstance(op, DeleteOne):
+                for doc in self._find(op._filter)[:1]:
+                    self._remove(doc)
+            else:
+                raise NotImplementedError(type(op).__name__)
+        return SimpleNamespace(acknowledged=True)
+
+
+class _FakeCursor:
+    """find() result supporting sort, skip, limit and to_list."""
+
+    def __init__(self, collection: FakeCollection, query: dict, projection: dict = None):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = ASCENDING):
+        self._sort = key if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    async def to_list(self, length: int = None):
+        await self.collection._round_trip()
+        found = self.collection._find(self.query, self._sort)[self._skip:]
+        found = found[:self._limit] if self._limit else found
+        return [_project(doc, self.projection) for doc in found[:length] if doc is not None]
+
+
+def install_fake_mongo(latency: float = 0.0) -> dict:
+    """
+    Swap every collection in app.db.mongo_client for a FakeCollection.
+    Returns {attribute name: FakeCollection}.
+    """
+    from app.db import mongo_client
+
+    fakes = {}
+    for attr, value in list(vars(mongo_client).items()):
+        if type(value).__name__ == "AsyncCollection":
+            fakes[attr] = FakeCollection(value.name, latency)
+            setattr(mongo_client, attr, fakes[attr])
+
+    async def close_client():
+        pass
+
+    mongo_client.close_client = close_client
+    return fakes
+
+
+# ── OpenAI ────────────────────────────────────────────────────────────────────
+class _FakeStream:
+    def __init__(self, pieces: list, ttft: float, token_interval: float, usage):
+        self._pieces = pieces
+        self._ttft = ttft
+        self._interval = token_interval
+        self._usage = usage
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def close(self):
+        pass
+
+    async def _chunks(self):
+        await asyncio.sleep(self._ttft)
+        for i, piece in enumerate(self._pieces):
+            if i:
+                await asyncio.sleep(self._interval)
+            delta = SimpleNamespace(content=piece)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=self._usage)
+
+
+class FakeAIClient:
+    """
+    Stand-in for AsyncOpenAI's chat.completions.create. Streamed calls
+    yield `reply` in ~4-character tokens after `ttft` seconds, one every
+    1 / tokens_per_second; non-streamed calls (summaries) return after
+    ttft plus the same generation time.
+    """
+
+    def __init__(self, reply: str, ttft: float = 0.4, tokens_per_second: float = 60.0, chars_per_token: int = 4):
+        self.reply = reply
+        self.ttft = ttft
+        self.token_interval = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.pieces = [reply[i:i + chars_per_token] for i in range(0, len(reply), chars_per_token)]
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _usage(self, messages: list):
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=len(self.pieces),
+            prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+        )
+
+    async def create(self, messages: list, stream: bool = False, **kwargs):
+        self.calls += 1
+        if stream:
+            return _FakeStream(self.pieces, self.ttft, self.token_interval, self._usage(messages))
+        await asyncio.sleep(self.ttft + self.token_interval * len(self.pieces))
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=self._usage(messages))
+
+    async def close(self):
+        pass
+
+
+# ── Telegram ──────────────────────────────────────────────────────────────────
+class FakeBot:
+    """
+    Records the Bot API calls made through the outbound scheduler.
+    `on_message(chat_id, text)` is called for each new message sent.
+    """
+
+    def __init__(self, latency: float = 0.0, on_message=None):
+        self.latency = latency
+        self.on_message = on_message
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+
+    async def _call(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        await asyncio.sleep(self.latency)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await self._call("send_message")
+        if self.on_message:
+            self.on_message(chat_id, text)
+        return SimpleNamespace(message_id=next(self._message_ids), chat_id=chat_id, text=text, date=time.time())
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs):
+        await self._call("edit_message_text")
+        return SimpleNamespace(message_id=message_id, chat_id=chat_id, text=text)
+
+    async def delete_message(self, chat_id: int, message_id: int, **kwargs):
+        await self._call("delete_message")
+        return True
+
+    async def send_chat_action(self, chat_id: int, action: str, **kwargs):
+        await self._call("send_chat_action")
+        return True
+
+    async def send_document(self, chat_id: int, document, **kwargs):
+        await self._call("send_document")
+        return SimpleNamespace(message_id=next(self._message_ids), chat_id=chat_id)
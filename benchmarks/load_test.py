@@ -0,0 +1,256 @@
+"""
+End-to-end load test of the message pipeline, fully offline.
+
+Thousands of simulated users send synthetic Telegram updates through
+handle_user_message → debounce → queue → process_user_queue → ask_ai and
+back out through the outbound scheduler. Mongo is replaced by an
+in-memory stand-in, the OpenAI client by a stub that streams a canned
+reply at a configurable speed, and the Telegram bot by a recorder (see
+benchmarks/fakes.py). Reports throughput, p50/p99 reply latency, where
+the time went per stage, and memory.
+
+    python -m benchmarks.load_test [--users 2000] [--turns 3] [--ttft 0.4] [--json]
+
+Telegram rate limits are lifted unless --telegram-limits is given, so the
+numbers measure the bot rather than the 30 msg/s cap.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+SCRIPT = [
+    "السلام عليكم",
+    "أبغى أسوي عقد إيجار لشقتي في الرياض",
+    "المستأجر اسمه خالد عبدالله ورقم هويته 1098765432",
+    "الإيجار السنوي 45000 ريال والدفع كل ست شهور",
+    "العنوان الوطني RRRD2929 والشقة في الدور الثاني",
+    "تمام كذا، كمل",
+]
+FOLLOW_UPS = ["وبعد؟", "لحظة", "وش المطلوب بعد؟", "ما فهمت"]
+
+AI_REPLY = (
+    "أبشر! سجلت بيانات المستأجر. عشان أكمل العقد أحتاج منك رقم الصك وتاريخ إصداره، "
+    "ونوع العقار (عمارة أو فيلا أو غيرها)، ورقم الوحدة ومساحتها. "
+    "وإذا عندك أي ملاحظات على شروط العقد مثل التأجير من الباطن أو الصيانة البسيطة، قلها لي الحين."
+)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def configure_environment(args):
+    """Settings that modules read at import time; must run before importing app.*"""
+    os.environ.setdefault("BOT_TOKEN", "0:load-test")
+    os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=1")
+    os.environ.setdefault("AI_API_KEY", "load-test")
+    os.environ["METRICS_PORT"] = "0"
+    # Keep the run's log out of the repo's logs/
+    os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="ejar-load-test-"))
+    os.environ.setdefault("LOG_CONSOLE_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_LEVEL", "INFO")
+    os.environ["QUEUE_BACKEND"] = "memory"
+    if not args.telegram_limits:
+        for name in ("TELEGRAM_GLOBAL_RATE", "TELEGRAM_GLOBAL_BURST", "TELEGRAM_CHAT_RATE", "TELEGRAM_CHAT_BURST"):
+            os.environ[name] = "1000000"
+
+
+class Tracker:
+    """Turn start times in, first-reply and completion latencies out."""
+
+    def __init__(self):
+        self.turn_started: dict[int, float] = {}
+        self.done: dict[int, asyncio.Event] = {}
+        self.first_reply: list[float] = []
+        self.complete: list[float] = []
+        self._waiting_first: set[int] = set()
+
+    def start_turn(self, chat_id: int):
+        self.turn_started[chat_id] = time.perf_counter()
+        self._waiting_first.add(chat_id)
+        self.done.setdefault(chat_id, asyncio.Event()).clear()
+
+    def on_message(self, chat_id: int, text: str):
+        if chat_id in self._waiting_first:
+            self._waiting_first.discard(chat_id)
+            self.first_reply.append(time.perf_counter() - self.turn_started[chat_id])
+
+    def finish_turn(self, chat_id: int):
+        if chat_id in self._waiting_first:
+            return  # superseded: nothing was sent, the merged turn is still to come
+        started = self.turn_started.pop(chat_id, None)
+        if started is not None:
+            self.complete.append(time.perf_counter() - started)
+        self.done.setdefault(chat_id, asyncio.Event()).set()
+
+
+def make_update(update_id: int, user_id: int, first_name: str, text: str):
+    from telegram import Update
+
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": first_name},
+            "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+            "text": text,
+        },
+    }, None)
+
+
+async def run(args) -> dict:
+    from types import SimpleNamespace
+    from benchmarks.fakes import FakeAIClient, FakeBot, install_fake_mongo
+
+    collections = install_fake_mongo(latency=args.mongo_latency_ms / 1000)
+
+    from app.ai import agent
+    from app.handlers import message_handler as handler
+    from app.db.write_behind import write_buffer
+    from app.db.training_storage import training_sink
+    from app.ai.summarizer import summary_scheduler
+    from config.metrics import metrics
+
+    ai = FakeAIClient(AI_REPLY, ttft=args.ttft, tokens_per_second=args.tokens_per_second)
+    agent.ai_client = agent.chat.client = ai
+    if args.debounce is not None:
+        # Fixed window instead of the adaptive one
+        handler.debouncer.initial = handler.debouncer.minimum = handler.debouncer.maximum = args.debounce
+
+    tracker = Tracker()
+    bot = FakeBot(latency=args.telegram_latency_ms / 1000, on_message=tracker.on_message)
+    context = SimpleNamespace(bot=bot)
+
+    process_message = handler._process_message
+
+    async def tracked_process_message(user_id, chat_id, first_name, text, context):
+        try:
+            await process_message(user_id, chat_id, first_name, text, context)
+        finally:
+            tracker.finish_turn(chat_id)
+
+    handler._process_message = tracked_process_message
+
+    rng = random.Random(args.seed)
+    update_ids = iter(range(1, 10**9))
+    sent = 0
+
+    async def simulated_user(user_id: int):
+        nonlocal sent
+        await asyncio.sleep(rng.uniform(0, args.ramp))
+        first_name = f"user{user_id}"
+        for turn in range(args.turns):
+            text = SCRIPT[turn] if turn < len(SCRIPT) else rng.choice(FOLLOW_UPS)
+            burst = [text, rng.choice(FOLLOW_UPS)] if rng.random() < args.burst_prob else [text]
+            tracker.start_turn(user_id)
+            for i, part in enumerate(burst):
+                if i:
+                    await asyncio.sleep(rng.uniform(0.1, args.burst_gap))
+                await handler.handle_user_message(make_update(next(update_ids), user_id, first_name, part), context)
+                sent += 1
+            await tracker.done[user_id].wait()
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think)
+
+    write_buffer.start()
+    training_sink.start()
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    await asyncio.gather(*[simulated_user(1000 + i) for i in range(args.users)])
+    elapsed = time.perf_counter() - started
+
+    await summary_scheduler.stop()
+    await write_buffer.stop()
+    await training_sink.stop()
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    turns = len(tracker.complete)
+    return {
+        "users": args.users,
+        "turns": turns,
+        "messages_sent": sent,
+        "elapsed_s": round(elapsed, 2),
+        "turns_per_s": round(turns / elapsed, 1),
+        "messages_per_s": round(sent / elapsed, 1),
+        "first_reply_ms": {
+            "p50": round(percentile(tracker.first_reply, 0.5) * 1000, 1),
+            "p99": round(percentile(tracker.first_reply, 0.99) * 1000, 1),
+            "mean": round(statistics.fmean(tracker.first_reply) * 1000, 1) if tracker.first_reply else 0.0,
+        },
+        "complete_ms": {
+            "p50": round(percentile(tracker.complete, 0.5) * 1000, 1),
+            "p99": round(percentile(tracker.complete, 0.99) * 1000, 1),
+            "mean": round(statistics.fmean(tracker.complete) * 1000, 1) if tracker.complete else 0.0,
+        },
+        "stages_p50_ms": {
+            stage: round(s["p50"] * 1000, 2) for stage, s in metrics.stage_seconds.summary().items()
+        },
+        "ai_calls": ai.calls,
+        "ai_superseded": metrics.events.values().get("ai_superseded", 0),
+        "telegram_calls": bot.calls,
+        "mongo_ops": {c.name: c.ops for c in collections.values() if c.ops},
+        "rss_peak_mb": round(rss_peak / 1024, 1),
+        "rss_growth_mb": round((rss_peak - rss_before) / 1024, 1),
+        "traced_peak_mb": round(traced_peak / 2**20, 1) if traced_peak is not None else None,
+    }
+
+
+def print_report(result: dict):
+    print(
+        f"{result['users']} users, {result['turns']} turns ({result['messages_sent']} messages) "
+        f"in {result['elapsed_s']}s → {result['turns_per_s']} turns/s, {result['messages_per_s']} messages/s"
+    )
+    for name in ("first_reply_ms", "complete_ms"):
+        r = result[name]
+        print(f"{name:15} p50 {r['p50']:>8} | p99 {r['p99']:>8} | mean {r['mean']:>8}")
+    print("stage p50 (ms): " + ", ".join(f"{k}={v}" for k, v in result["stages_p50_ms"].items()))
+    print(f"AI calls: {result['ai_calls']} ({result['ai_superseded']} superseded), Telegram calls: {result['telegram_calls']}")
+    print(f"Mongo ops: {result['mongo_ops']}")
+    memory = f"peak RSS {result['rss_peak_mb']} MB (+{result['rss_growth_mb']} MB during the run)"
+    if result["traced_peak_mb"] is not None:
+        memory += f", traced Python peak {result['traced_peak_mb']} MB"
+    print(memory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=3, help="turns per user")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which users arrive")
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause between a reply and the next turn")
+    parser.add_argument("--burst-prob", type=float, default=0.3, help="chance a turn is sent as two quick messages")
+    parser.add_argument("--burst-gap", type=float, default=1.2, help="longest pause between the two (s)")
+    parser.add_argument("--debounce", type=float, help="fixed debounce window in seconds (default: adaptive)")
+    parser.add_argument("--ttft", type=float, default=0.4, help="stub model time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="stub model streaming speed")
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.5)
+    parser.add_argument("--telegram-latency-ms", type=float, default=20.0)
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the real Telegram rate limits")
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python allocations (slower)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the result as one JSON object (for CI)")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print_report(result)
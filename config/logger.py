@@ -1,38 +1,150 @@
+import atexit
+import json
 import logging
+import multiprocessing
 import os
+import queue
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from dotenv import load_dotenv
 
-# Define logs directory path
-log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+LOG_CONSOLE_LEVEL = os.getenv("LOG_CONSOLE_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # "text" or "json"
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_FILE_BACKUP_COUNT = int(os.getenv("LOG_FILE_BACKUP_COUNT", "5"))
+# Each DEBUG call site may log LOG_DEBUG_SAMPLE_BURST records per window;
+# the rest are dropped and counted on the next record that gets through
+LOG_DEBUG_SAMPLE_WINDOW = float(os.getenv("LOG_DEBUG_SAMPLE_WINDOW", "1.0"))
+LOG_DEBUG_SAMPLE_BURST = int(os.getenv("LOG_DEBUG_SAMPLE_BURST", "5"))
+
+# Define logs directory path (LOG_DIR overrides it, e.g. for benchmark runs)
+log_dir = os.getenv("LOG_DIR") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")
 os.makedirs(log_dir, exist_ok=True)  # Create the logs/ folder if it doesn't exist
 
 # Define full log file path
 log_file_path = os.path.join(log_dir, "bot.log")
 
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DebugSampler(logging.Filter):
+    """
+    Rate-limits DEBUG records per call site so chatty hot paths can't
+    flood the log queue; higher levels always pass.
+    """
+
+    def __init__(self, window: float = LOG_DEBUG_SAMPLE_WINDOW, burst: int = LOG_DEBUG_SAMPLE_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._sites: dict[tuple, list] = {}  # (path, line) -> [window start, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.window <= 0:
+            return True
+        now = time.monotonic()
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None:
+            self._sites[(record.pathname, record.lineno)] = [now, 1, 0]
+            return True
+        if now - site[0] >= self.window:
+            suppressed = site[2]
+            site[:] = [now, 1, 0]
+            if suppressed:
+                record.msg = f"{record.msg} [+{suppressed} similar suppressed]"
+            return True
+        if site[1] < self.burst:
+            site[1] += 1
+            return True
+        site[2] += 1
+        return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread unformatted, so %-formatting and
+    all file/console I/O happen off the event loop. Records whose args are
+    mutable containers are rendered first, since they may change later.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args and any(isinstance(arg, (dict, list, set)) for arg in (
+            record.args.values() if isinstance(record.args, dict) else record.args
+        )):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+if LOG_FORMAT == "json":
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Create console handler
+console_handler = logging.StreamHandler()
+console_handler.setLevel(LOG_CONSOLE_LEVEL)
+console_handler.setFormatter(formatter)
+handlers = [console_handler]
+
+# Rotating log file; only the main process writes it (PDF workers are
+# spawned children and would otherwise race on rotation)
+file_handler = None
+if multiprocessing.parent_process() is None:
+    file_handler = RotatingFileHandler(
+        log_file_path,
+        maxBytes=LOG_FILE_MAX_BYTES,
+        backupCount=LOG_FILE_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(formatter)
+    handlers.append(file_handler)
+
 # Create a custom logger
 logger = logging.getLogger("bot_logger")
-logger.setLevel(logging.DEBUG)  # Capture all log levels
+logger.setLevel(LOG_LEVEL)
 
-# Create file handler and set level
-file_handler = logging.FileHandler(log_file_path, encoding='utf-8')
-file_handler.setLevel(logging.DEBUG)
+# The logger only enqueues; a background thread formats and writes
+log_queue = queue.SimpleQueue()
+queue_handler = DeferredQueueHandler(log_queue)
+queue_handler.addFilter(DebugSampler())
+log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
 
-# Create console handler (optional)
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+_listening = False
 
-# Create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
 
-# Add handlers to logger if not already added
-if not logger.hasHandlers():
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-else:
-    # Avoid adding multiple handlers if this file is imported more than once
-    handlers = [type(h) for h in logger.handlers]
-    if logging.FileHandler not in handlers:
-        logger.addHandler(file_handler)
-    if logging.StreamHandler not in handlers:
-        logger.addHandler(console_handler)
\ No newline at end of file
+def stop_logging():
+    """Write out every queued record and stop the listener (safe to call twice)."""
+    global _listening
+    if _listening:
+        _listening = False
+        log_listener.stop()
+
+
+# Add handlers to logger if not already added (this file may be imported more than once)
+if not any(isinstance(h, QueueHandler) for h in logger.handlers):
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    log_listener.start()
+    _listening = True
+    atexit.register(stop_logging)
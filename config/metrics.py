@@ -0,0 +1,212 @@
+import bisect
+import os
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Local Prometheus endpoint (0 disables it); keep it on loopback or behind a firewall
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Seconds; covers cache hits (ms) up to slow completions and flood waits
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0)
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, one series per label set."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts…, sum, count, max]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0, 0.0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):  # slower than the last bucket only counts towards +Inf
+            series[index] += 1
+        series[-3] += value
+        series[-2] += 1
+        series[-1] = max(series[-1], value)
+
+    def quantile(self, q: float, **labels) -> float:
+        """Estimate a quantile by interpolating inside its bucket."""
+        series = self._series.get(tuple(sorted(labels.items())))
+        if not series or not series[-2]:
+            return 0.0
+        rank = q * series[-2]
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, series):
+            if count and seen + count >= rank:
+                return min(lower + (bound - lower) * (rank - seen) / count, series[-1])
+            seen += count
+            lower = bound
+        return series[-1]  # beyond the last bucket: the slowest one seen
+
+    def summary(self) -> dict:
+        """{label value(s): {count, avg, p50, p95, max}} for the /stats command."""
+        result = {}
+        for key, series in sorted(self._series.items()):
+            labels = dict(key)
+            count = series[-2]
+            result[",".join(str(v) for v in labels.values())] = {
+                "count": count,
+                "avg": series[-3] / count if count else 0.0,
+                "p50": self.quantile(0.5, **labels),
+                "p95": self.quantile(0.95, **labels),
+                "max": series[-1],
+            }
+        return result
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {series[-2]}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {_number(series[-3])}")
+            lines.append(f"{self.name}_count{_label_text(key)} {series[-2]}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per label set."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> dict:
+        return {",".join(str(v) for _, v in key) or "total": value for key, value in sorted(self._values.items())}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_label_text(key)} {_number(value)}" for key, value in sorted(self._values.items()))
+        return lines
+
+
+class Collected:
+    """
+    A gauge (or counter) read at scrape time from a callback, so live
+    values like queue depth come straight from the component's stats().
+    The callback returns a number, or {label value: number} for `label`.
+    """
+
+    def __init__(self, name: str, help_text: str, read, kind: str = "gauge", label: str = None):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.kind = kind
+        self.label = label
+
+    def samples(self) -> list[tuple]:
+        value = self.read()
+        if isinstance(value, dict):
+            return [(((self.label, key),), v) for key, v in value.items()]
+        return [((), value)]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{_label_text(key)} {_number(value)}" for key, value in self.samples())
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process metrics for the message pipeline: per-stage latency
+    histograms, event counters, and callbacks for live gauges. Rendered in
+    the Prometheus text format by the local /metrics endpoint and
+    summarised for admins by the /stats command.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stage_seconds = Histogram("bot_stage_seconds", "Time spent in each stage of answering a message")
+        self.events = Counter("bot_events_total", "Pipeline events (replies by source, errors, …)")
+        self._collected: list[Collected] = []
+
+    def observe(self, stage: str, seconds: float):
+        self.stage_seconds.observe(seconds, stage=stage)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time the enclosed block (sync or containing awaits) as `stage`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+    def count(self, event: str, amount: float = 1):
+        self.events.inc(amount, event=event)
+
+    def expose(self, name: str, help_text: str, read, kind: str = "gauge", label: str = None):
+        """Register a value read from `read()` at every scrape."""
+        self._collected = [c for c in self._collected if c.name != name]
+        self._collected.append(Collected(name, help_text, read, kind, label))
+
+    def render(self) -> str:
+        lines = [
+            "# HELP bot_uptime_seconds Seconds since the bot process started",
+            "# TYPE bot_uptime_seconds gauge",
+            f"bot_uptime_seconds {_number(round(time.time() - self.started, 3))}",
+        ]
+        lines += self.stage_seconds.render()
+        lines += self.events.render()
+        for collected in self._collected:
+            try:
+                lines += collected.render()
+            except Exception:
+                continue  # one broken callback must not take down the scrape
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Plain-dict view: stage latencies, event counts and current gauges."""
+        gauges = {}
+        for collected in self._collected:
+            try:
+                for key, value in collected.samples():
+                    name = collected.name + (f"[{key[0][1]}]" if key else "")
+                    gauges[name] = value
+            except Exception:
+                continue
+        return {
+            "uptime_seconds": round(time.time() - self.started),
+            "stages": self.stage_seconds.summary(),
+            "events": self.events.values(),
+            "gauges": gauges,
+        }
+
+
+# Shared registry for the whole process
+metrics = MetricsRegistry()
@@ -1,34 +1,91 @@
 import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
 from config.logger import logger
+from config.metrics import metrics
 import os
 from datetime import datetime
+from dotenv import load_dotenv
 
+load_dotenv()
 
+MAX_QUEUE_PER_USER = int(os.getenv("MAX_QUEUE_PER_USER", "20"))
+QUEUE_IDLE_TTL_SECONDS = float(os.getenv("QUEUE_IDLE_TTL_SECONDS", "600"))
+MAX_ACTIVE_WORKERS = int(os.getenv("MAX_ACTIVE_WORKERS", "100"))
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "memory")  # "memory" or "mongo"
 
 # Global dictionaries for queues and workers
 user_queues = {}
 user_workers = {}
+user_last_active = {}
+
+# Global limit on messages being processed at once. asyncio.Semaphore wakes
+# waiters in FIFO order, and workers take one slot per message, so a busy
+# user can't starve others.
+worker_limiter = asyncio.Semaphore(MAX_ACTIVE_WORKERS)
+active_slots = 0
+waiting_slots = 0
+
+class UserQueue:
+    """
+    One user's pending messages, oldest first. Holds at most `maxsize`
+    items; past that, new text is merged into the newest item instead.
+    """
+
+    def __init__(self, maxsize: int = MAX_QUEUE_PER_USER):
+        self.maxsize = maxsize
+        self.items: deque = deque()  # (chat_id, first_name, message_text, queued_at)
+        self._not_empty = asyncio.Event()
+
+    def put(self, chat_id: int, first_name: str, message_text: str) -> bool:
+        """Append a message; returns False if it was merged into the last item."""
+        if len(self.items) >= self.maxsize:
+            last_chat_id, last_first_name, last_text, queued_at = self.items[-1]
+            self.items[-1] = (last_chat_id, last_first_name, f"{last_text}\n{message_text}", queued_at)
+            return False
+        self.items.append((chat_id, first_name, message_text, time.monotonic()))
+        self._not_empty.set()
+        return True
+
+    async def get(self) -> tuple:
+        """Remove and return the oldest item, waiting for one if empty."""
+        while not self.items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self.items.popleft()
+
+    def qsize(self) -> int:
+        return len(self.items)
+
+    def empty(self) -> bool:
+        return not self.items
+
 
 async def enqueue_message(user_id: int, chat_id: int, first_name: str, message_text: str):
     """
-    Add a message to the user's queue.
+    Add a message to the user's queue. Once the queue holds
+    MAX_QUEUE_PER_USER items, new text is merged into the last one instead.
     """
     queue = get_user_queue(user_id)
-    await queue.put((chat_id, first_name, message_text))
+    user_last_active[user_id] = time.monotonic()
+    if not queue.put(chat_id, first_name, message_text):
+        logger.warning("⚠️ Queue full for user %s, merged message into last item", user_id)
+        return
 
-    logger.info(f"📥 Queued message for user {user_id}: {message_text}")
-    logger.debug(f"Queue size for user {user_id}: {queue.qsize()}")
+    logger.info("📥 Queued message for user %s (%s chars)", user_id, len(message_text))
+    logger.debug("Queue size for user %s: %s", user_id, queue.qsize())
 
     # Optional: Export queue to file for debugging
     #export_queue_to_file()
 
-def get_user_queue(user_id: int) -> asyncio.Queue:
+def get_user_queue(user_id: int) -> UserQueue:
     """
-    Get or create an asyncio.Queue for the user.
+    Get or create a UserQueue for the user.
     """
     if user_id not in user_queues:
-        user_queues[user_id] = asyncio.Queue()
-        logger.debug(f"🆕 Created new queue for user {user_id}")
+        user_queues[user_id] = UserQueue(maxsize=MAX_QUEUE_PER_USER)
+        logger.debug("🆕 Created new queue for user %s", user_id)
     return user_queues[user_id]
 
 def is_worker_running(user_id: int) -> bool:
@@ -36,7 +93,7 @@ def is_worker_running(user_id: int) -> bool:
     Check if a worker task is already running for this user.
     """
     running = user_id in user_workers
-    logger.debug(f"👀 Worker running for user {user_id}: {running}")
+    logger.debug("👀 Worker running for user %s: %s", user_id, running)
     return running
 
 def set_worker_task(user_id: int, task: asyncio.Task):
@@ -44,7 +101,7 @@ def set_worker_task(user_id: int, task: asyncio.Task):
     Store the asyncio task running for the user's queue.
     """
     user_workers[user_id] = task
-    logger.debug(f"🔧 Set worker task for user {user_id}")
+    logger.debug("🔧 Set worker task for user %s", user_id)
 
 def queue_has_pending_messages(user_id: int) -> bool:
     """
@@ -52,7 +109,7 @@ def queue_has_pending_messages(user_id: int) -> bool:
     """
     queue = user_queues.get(user_id)
     has_pending = queue and not queue.empty()
-    logger.debug(f"⏳ Pending messages for user {user_id}: {has_pending}")
+    logger.debug("⏳ Pending messages for user %s: %s", user_id, has_pending)
     return has_pending
 
 def clear_worker_task(user_id: int):
@@ -61,24 +118,24 @@ def clear_worker_task(user_id: int):
     """
     if user_id in user_workers:
         user_workers.pop(user_id, None)
-        logger.debug(f"🧹 Cleared worker task for user {user_id}")
+        logger.debug("🧹 Cleared worker task for user %s", user_id)
 
 async def dequeue_message(user_id: int):
     """
     Get the next message from the user's queue.
     """
     queue = get_user_queue(user_id)
-    message = await queue.get()
-    logger.info(f"📤 Dequeued message for user {user_id}")
-    return message
+    chat_id, first_name, message_text, queued_at = await queue.get()
+    user_last_active[user_id] = time.monotonic()
+    metrics.observe("queue_wait", user_last_active[user_id] - queued_at)
+    logger.info("📤 Dequeued message for user %s", user_id)
+    return chat_id, first_name, message_text
 
 def mark_message_done(user_id: int):
     """
-    Mark the current task as done for the user's queue.
+    Mark the current message as processed (dequeue already removed it).
     """
-    queue = get_user_queue(user_id)
-    queue.task_done()
-    logger.debug(f"✅ Marked message as done for user {user_id}")
+    logger.debug("✅ Marked message as done for user %s", user_id)
 
 def delete_user_queue(user_id: int):
     """
@@ -86,7 +143,118 @@ def delete_user_queue(user_id: int):
     """
     if user_id in user_queues:
         user_queues.pop(user_id, None)
-        logger.info(f"🗑️ Deleted queue for user {user_id}")
+        logger.info("🗑️ Deleted queue for user %s", user_id)
+    user_last_active.pop(user_id, None)
+
+
+@asynccontextmanager
+async def worker_slot(user_id: int):
+    """
+    Hold one of the MAX_ACTIVE_WORKERS global processing slots.
+    """
+    global active_slots, waiting_slots
+    waiting_slots += 1
+    try:
+        with metrics.timer("slot_wait"):
+            await worker_limiter.acquire()
+    finally:
+        waiting_slots -= 1
+    active_slots += 1
+    try:
+        yield
+    finally:
+        active_slots -= 1
+        worker_limiter.release()
+        user_last_active[user_id] = time.monotonic()
+
+
+def evict_idle_queues(idle_seconds: float = QUEUE_IDLE_TTL_SECONDS) -> int:
+    """
+    Drop queues that are empty, have no worker and were idle for
+    `idle_seconds`. Returns the number of users evicted.
+    """
+    now = time.monotonic()
+    idle = [
+        user_id for user_id, queue in user_queues.items()
+        if queue.empty()
+        and user_id not in user_workers
+        and now - user_last_active.get(user_id, 0) > idle_seconds
+    ]
+    for user_id in idle:
+        user_queues.pop(user_id, None)
+        user_last_active.pop(user_id, None)
+    if idle:
+        logger.info("🧹 Evicted %s idle user queues", len(idle))
+    return len(idle)
+
+
+def get_queue_stats() -> dict:
+    """
+    Live counts for monitoring.
+    """
+    return {
+        "queues": len(user_queues),
+        "workers": len(user_workers),
+        "queued_messages": sum(q.qsize() for q in user_queues.values()),
+        "active_slots": active_slots,
+        "waiting_for_slot": waiting_slots,
+        "max_active_workers": MAX_ACTIVE_WORKERS,
+        **(_backend.stats() if _backend else {}),
+    }
+
+
+class MemoryQueueBackend:
+    """
+    Default backend: the in-process asyncio queues above. Ordering holds
+    within one bot process; queued messages are lost on restart.
+    """
+
+    name = "memory"
+
+    async def enqueue(self, user_id: int, chat_id: int, first_name: str, message_text: str):
+        await enqueue_message(user_id, chat_id, first_name, message_text)
+
+    async def claim_worker(self, user_id: int) -> bool:
+        return not is_worker_running(user_id)
+
+    async def has_pending(self, user_id: int) -> bool:
+        return bool(queue_has_pending_messages(user_id))
+
+    async def dequeue(self, user_id: int):
+        return await dequeue_message(user_id)
+
+    async def mark_done(self, user_id: int):
+        mark_message_done(user_id)
+
+    async def release_worker(self, user_id: int) -> bool:
+        # Enqueue and the worker check run without yielding, so nothing can slip in
+        return False
+
+    def start(self, spawn):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+_backend = None
+
+def get_queue_backend():
+    """
+    Return the configured queue backend (QUEUE_BACKEND=memory|mongo).
+    """
+    global _backend
+    if _backend is None:
+        if QUEUE_BACKEND == "mongo":
+            from app.db.work_queue import MongoQueueBackend
+            _backend = MongoQueueBackend()
+        else:
+            _backend = MemoryQueueBackend()
+        logger.info("🧵 Using %s queue backend", _backend.name)
+    return _backend
 
 
 def export_queue_to_file():
@@ -109,8 +277,8 @@ def export_queue_to_file():
         f.write("+-----------+--------------+----------------------------+\n")
 
         for user_id, queue in user_queues.items():
-            for item in list(queue._queue):  # safe for reading
-                chat_id, first_name, message_text = item
+            for item in list(queue.items):
+                chat_id, first_name, message_text, _ = item
                 f.write(f"| {str(user_id).ljust(9)} | {first_name.ljust(12)} | {message_text[:26].ljust(26)} |\n")
 
         f.write("+-----------+--------------+----------------------------+\n")